@@ -210,6 +210,8 @@ def write_prediction(config):
     config.set(s, 'batch/snapshot_dir', '%(expdir)s/data/snapshots')
     config.set(s, 'batch/viz_dir', '%(expdir)s/viz/prediction')
     config.set(s, 'batch/summary_dir', '%(expdir)s/data/summaries')
+    config.set(s, 'batch/preprocessed_cache_dir', 
+        '%(expdir)s/data/preprocessed')
 
     ## hyperparams
     config.set(s, 'batch/batch_size', '2000')                              #
@@ -17,6 +17,7 @@ import time
 path = os.path.join(os.path.dirname(__file__), os.pardir)
 sys.path.append(os.path.abspath(path))
 
+import baseline_benchmark
 import dataset_loaders
 
 MODEL_TYPES = [
@@ -47,6 +48,9 @@ def fit(model, data):
     print(r_sq)
     return r_sq
 
+def score(model, x, y):
+    return model.score(x, y)
+
 def build_model(model_type, num_targets = 1):
     if model_type == 'linear_regression':
         base = linear_model.SGDRegressor()
@@ -65,11 +69,11 @@ def build_model(model_type, num_targets = 1):
     elif model_type == 'svm':
         base = svm.SVR(verbose=1)
     elif model_type == 'constant_mean':
-        base = dummy.DummyRegressor('mean')
+        base = dummy.DummyRegressor(strategy='mean')
     elif model_type == 'constant_median':
-        base = dummy.DummyRegressor('median')
+        base = dummy.DummyRegressor(strategy='median')
     elif model_type == 'constant_zero':
-        base = dummy.DummyRegressor('constant', constant=0)
+        base = dummy.DummyRegressor(strategy='constant', constant=0)
     else:
         raise(ValueError('invalid model type: {}'.format(model_type)))
 
@@ -94,9 +98,37 @@ def parse_args():
         default='all')
     parser.add_argument('-f', dest='dataset_filepath', 
         default='../../data/datasets/may/ngsim_5_sec.h5')
+    add_benchmark_args(parser)
     args = parser.parse_args()
     return args
 
+def add_benchmark_args(parser):
+    parser.add_argument('--benchmark', action='store_true',
+        help='fit the models concurrently and report a benchmark table')
+    parser.add_argument('--processes', type=int, default=1,
+        help='number of models to fit at once when benchmarking')
+    parser.add_argument('--n_jobs', type=int, default=1,
+        help='number of jobs of each model when benchmarking')
+    parser.add_argument('--max_train', type=int, default=None,
+        help='number of training samples to subsample when benchmarking')
+    parser.add_argument('--max_val', type=int, default=None,
+        help='number of validation samples to subsample when benchmarking')
+    parser.add_argument('--output', default='',
+        help='optional csv filepath of the benchmark results')
+
+def benchmark(opts, data, model_types, build_model, score, 
+        sample_weight_key=None):
+    model_types = model_types if opts.model_type == 'all' else [
+        opts.model_type]
+    data = baseline_benchmark.subsample(data, opts.max_train, opts.max_val)
+    results = baseline_benchmark.run_benchmarks(model_types, build_model, 
+        score, data, num_processes=opts.processes, n_jobs=opts.n_jobs, 
+        sample_weight_key=sample_weight_key)
+    print(baseline_benchmark.format_table(results))
+    if opts.output != '':
+        baseline_benchmark.write_results(opts.output, results)
+    return results
+
 if __name__ == '__main__':
     # in case things get a bit crazy
     np.random.seed(1)
@@ -109,6 +141,11 @@ if __name__ == '__main__':
         opts.dataset_filepath, shuffle=True, train_split=.9, 
         debug_size=None, timesteps=1, num_target_bins=2)
 
+    # optionally benchmark the models instead of fitting them in turn
+    if opts.benchmark:
+        benchmark(opts, data, MODEL_TYPES, build_model, score)
+        sys.exit(0)
+
     # build the model
     if len(data['y_train'].shape) > 1:
         _, num_targets = data['y_train'].shape
@@ -0,0 +1,203 @@
+"""
+Benchmark baseline models for speed and accuracy, fitting them concurrently
+in a process pool.
+"""
+import csv
+import multiprocessing
+import numpy as np
+import os
+import sys
+import time
+
+path = os.path.join(os.path.dirname(__file__), os.pardir)
+sys.path.append(os.path.abspath(path))
+
+import neural_networks.profiling as profiling
+
+# dataset of the benchmark, set before forking the pool such that workers
+# share it instead of receiving a pickled copy with each task
+_DATA = None
+
+COLUMNS = ['model', 'score', 'fit_sec', 'predict_samples_per_sec',
+    'peak_rss_mb', 'rss_increase_mb', 'num_train', 'num_val']
+
+def subsample(data, max_train=None, max_val=None, seed=1):
+    """
+    Description:
+        - Select a random subset of the training and validation splits for
+            quick benchmarks. Other values are shared.
+
+    Args:
+        - data: dictionary with split values under keys ending in
+            '_train' or '_val'
+        - max_train: maximum number of training samples, None for all
+        - max_val: maximum number of validation samples, None for all
+        - seed: random seed of the selection
+
+    Returns:
+        - dictionary of the same keys
+    """
+    rng = np.random.RandomState(seed)
+    idxs = {}
+    for (split, max_samples) in [('train', max_train), ('val', max_val)]:
+        num_samples = len(data['x_{}'.format(split)])
+        if max_samples is not None and max_samples < num_samples:
+            idxs[split] = np.sort(rng.choice(num_samples, max_samples,
+                replace=False))
+
+    subsampled = {}
+    for (k, v) in data.items():
+        split = k.rsplit('_', 1)[-1]
+        if split in idxs:
+            subsampled[k] = v[idxs[split]]
+        else:
+            subsampled[k] = v
+    return subsampled
+
+def configure_model(model, n_jobs=1, seed=1):
+    """
+    Description:
+        - Set the parallelism and random state of a model and of the
+            estimators it wraps. If wrapped estimators are parallel, the
+            wrapper itself runs serially, so that n_jobs bounds the number
+            of concurrent jobs.
+
+    Args:
+        - model: sklearn estimator
+        - n_jobs: number of jobs of the model
+        - seed: random state of the model
+    """
+    params = model.get_params()
+    n_jobs_keys = [k for k in params if k.endswith('n_jobs')]
+    inner_keys = [k for k in n_jobs_keys if '__' in k]
+    settings = dict((k, n_jobs if (k in inner_keys or len(inner_keys) == 0)
+        else 1) for k in n_jobs_keys)
+    settings.update((k, seed) for k in params if k.endswith('random_state'))
+    model.set_params(**settings)
+
+def benchmark_model(model_type, build_model, score, num_targets=1,
+        n_jobs=1, seed=1, sample_weight_key=None):
+    """
+    Description:
+        - Fit a model to the benchmark dataset, and measure its fit time,
+            prediction throughput, memory use and validation score.
+
+    Args:
+        - model_type: name of the model, passed to build_model
+        - build_model: function building a model from
+            (model_type, num_targets)
+        - score: function computing a score from (model, x_val, y_val),
+            where larger is better
+        - num_targets: number of targets
+        - n_jobs: number of jobs of the model
+        - seed: random seed
+        - sample_weight_key: optional key prefix of sample weights in the
+            dataset, for example 'lw' to fit with 'lw_train'
+
+    Returns:
+        - dictionary of the values in COLUMNS
+    """
+    data = _DATA
+    np.random.seed(seed)
+    model = build_model(model_type, num_targets)
+    configure_model(model, n_jobs, seed)
+    x_train, y_train = data['x_train'], data['y_train']
+    x_val, y_val = data['x_val'], data['y_val']
+    start_rss = profiling.peak_rss_mb()
+
+    kwargs = {}
+    if sample_weight_key is not None:
+        kwargs['sample_weight'] = data[
+            '{}_train'.format(sample_weight_key)].reshape(-1)
+    st = time.time()
+    model.fit(x_train, y_train, **kwargs)
+    fit_sec = time.time() - st
+
+    st = time.time()
+    model.predict(x_val)
+    predict_sec = time.time() - st
+
+    return {
+        'model': model_type,
+        'score': score(model, x_val, y_val),
+        'fit_sec': fit_sec,
+        'predict_samples_per_sec': len(x_val) / max(predict_sec, 1e-8),
+        'peak_rss_mb': profiling.peak_rss_mb(),
+        'rss_increase_mb': profiling.peak_rss_mb() - start_rss,
+        'num_train': len(x_train),
+        'num_val': len(x_val)
+    }
+
+def _benchmark_model(args):
+    return benchmark_model(*args)
+
+def run_benchmarks(model_types, build_model, score, data, num_processes=1,
+        n_jobs=1, seed=1, sample_weight_key=None):
+    """
+    Description:
+        - Benchmark models concurrently, each in a fresh process of a pool,
+            such that the memory use of each model is measured separately.
+
+    Args:
+        - model_types: names of the models to benchmark
+        - build_model: module level function building a model from
+            (model_type, num_targets)
+        - score: module level function computing a score from
+            (model, x_val, y_val)
+        - data: dictionary with keys 'x_train', 'y_train', 'x_val', 'y_val'
+        - num_processes: number of models fit at once
+        - n_jobs: number of jobs of each model
+        - seed: random seed of every model
+        - sample_weight_key: see benchmark_model
+
+    Returns:
+        - list of result dictionaries, sorted by decreasing score
+    """
+    global _DATA
+    _DATA = data
+    y_train = data['y_train']
+    num_targets = y_train.shape[1] if len(y_train.shape) > 1 else 1
+    tasks = [(mt, build_model, score, num_targets, n_jobs, seed,
+        sample_weight_key) for mt in model_types]
+
+    pool = multiprocessing.Pool(num_processes, maxtasksperchild=1)
+    try:
+        results = pool.map(_benchmark_model, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        _DATA = None
+    # models without a valid score are listed last
+    return sorted(results, key=lambda r: (not np.isnan(r['score']), 
+        r['score']), reverse=True)
+
+def format_table(results):
+    """
+    Description:
+        - Format benchmark results as a table with a row per model.
+    """
+    header = ['model', 'score', 'fit (s)', 'predict (samples/s)',
+        'peak rss (MB)', 'rss increase (MB)', 'train', 'val']
+    rows = [[r['model'], '{:.6f}'.format(r['score']),
+        '{:.2f}'.format(r['fit_sec']),
+        '{:.0f}'.format(r['predict_samples_per_sec']),
+        '{:.1f}'.format(r['peak_rss_mb']),
+        '{:.1f}'.format(r['rss_increase_mb']),
+        str(r['num_train']), str(r['num_val'])] for r in results]
+    widths = [max(len(row[i]) for row in [header] + rows)
+        for i in range(len(header))]
+    lines = ['  '.join(v.ljust(w) for (v, w) in zip(row, widths))
+        for row in [header] + rows]
+    lines.insert(1, '  '.join('-' * w for w in widths))
+    return '\n'.join(lines)
+
+def write_results(filepath, results):
+    """
+    Description:
+        - Write benchmark results to a csv file.
+    """
+    with open(filepath, 'w') as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=COLUMNS)
+        writer.writeheader()
+        for r in results:
+            writer.writerow(r)
@@ -5,6 +5,7 @@ np.set_printoptions(precision=6, suppress=True)
 import os
 from sklearn import dummy
 from sklearn import ensemble
+from sklearn import metrics
 from sklearn import multioutput
 import sys
 import time
@@ -12,6 +13,7 @@ import time
 path = os.path.join(os.path.dirname(__file__), os.pardir)
 sys.path.append(os.path.abspath(path))
 
+import baseline
 import dataset_loaders
 import prediction_metrics
 
@@ -40,15 +42,27 @@ def fit(model, data, viz_dir, name):
         y_pred.reshape(-1, num_targets), y_probs, 
         data['lw_val'], name, viz_dir)
 
+def score(model, x, y):
+    # mean roc auc over the targets that have both classes
+    probs = model.predict_proba(x)
+    if isinstance(probs, list):
+        probs = np.stack([p[:, -1] for p in probs], axis=1)
+    else:
+        probs = probs[:, -1]
+    y, probs = y.reshape(len(y), -1), probs.reshape(len(y), -1)
+    aucs = [metrics.roc_auc_score(y[:, i], probs[:, i]) 
+        for i in range(y.shape[1]) if len(np.unique(y[:, i])) > 1]
+    return np.mean(aucs) if len(aucs) > 0 else np.nan
+
 def build_model(model_type, num_targets = 1):
     if model_type == 'gradient_boosting':
         base = ensemble.GradientBoostingClassifier(n_estimators=100, verbose=True)
     elif model_type == 'random_forest':
         base = ensemble.RandomForestClassifier()
     elif model_type == 'dummy_stratified':
-        base = dummy.DummyClassifier('stratified')
+        base = dummy.DummyClassifier(strategy='stratified')
     elif model_type == 'dummy_most_frequent':
-        base = dummy.DummyClassifier('most_frequent')
+        base = dummy.DummyClassifier(strategy='most_frequent')
     else:
         raise(ValueError('invalid model type: {}'.format(model_type)))
 
@@ -66,6 +80,7 @@ def parse_args():
         default='../../data/datasets/may/ngsim_5_sec.h5')
     parser.add_argument('-t', dest='target_index', type=int,
         default=4)
+    baseline.add_benchmark_args(parser)
     args = parser.parse_args()
     return args
 
@@ -82,6 +97,12 @@ if __name__ == '__main__':
         debug_size=None, timesteps=1, num_target_bins=2, 
         target_index=opts.target_index, load_likelihood_weights=True)
 
+    # optionally benchmark the models instead of fitting them in turn
+    if opts.benchmark:
+        baseline.benchmark(opts, data, MODEL_TYPES, build_model, score, 
+            sample_weight_key='lw')
+        sys.exit(0)
+
     # build the model
     if len(data['y_train'].shape) > 1:
         _, num_targets = data['y_train'].shape
@@ -3,10 +3,17 @@ Class for iterating through a dataset.
 """
 
 import numpy as np
+import six.moves.queue as queue
+import threading
+
+import dataset_loaders
 
 class Dataset(object):
 
-    def __init__(self, data, flags):
+    # prefixes of the data keys that make up a batch
+    batch_keys = ['x', 'y']
+
+    def __init__(self, data, flags, num_buffers=2):
         """
         Description:
             - Initialize the dataset.
@@ -18,8 +25,12 @@ class Dataset(object):
                 such that when indexing into the first dimension
                 of that value, you retrieve an element of a sample.
             - flags: object containing options
+            - num_buffers: number of preallocated buffers into which 
+                training batches are gathered. A yielded training batch 
+                remains valid until num_buffers further batches are drawn.
         """
         self.flags = flags
+        self.num_buffers = num_buffers
         self.data = data
 
     @property
@@ -28,7 +39,8 @@ class Dataset(object):
 
     @data.setter
     def data(self, data):
-        keys = ['x_train', 'y_train', 'x_val', 'y_val']
+        keys = ['{}_{}'.format(k, split) 
+            for split in ['train', 'val'] for k in self.batch_keys]
         for k in keys:
             if k not in data:
                 raise ValueError('data must contain key: {}'.format(k))
@@ -52,94 +64,237 @@ class Dataset(object):
             else:
                 self.num_val_batches = num_batches
 
-    def next_batch(self, validation=False):
-        # retrieve training or validation set
-        suffix = 'val' if validation else 'train'
-        x, y = self.data['x_{}'.format(suffix)], self.data['y_{}'.format(suffix)]
-        num_batches = self.num_val_batches if validation else self.num_train_batches
+        # a single permutation of the training set, reshuffled in place 
+        # each epoch, along with the buffers batches are gathered into
+        self._train_idxs = np.arange(len(data['x_train']))
+        self._buffers = []
+        for _ in range(self.num_buffers):
+            self._buffers.append([np.empty(
+                (self.flags.batch_size,) + data['{}_train'.format(k)].shape[1:], 
+                dtype=data['{}_train'.format(k)].dtype) 
+                for k in self.batch_keys])
+        self._buffer_idx = 0
 
-        # suffle data for this epoch
-        idxs = np.random.permutation(len(x))
-        x = x[idxs]
-        y = y[idxs]
+    def next_batch(self, validation=False):
+        if validation:
+            return self._sequential_batches('val')
+        else:
+            return self._shuffled_batches('train')
 
-        # yield data in batches
+    def _sequential_batches(self, split):
+        # in order, so batches are views of the data without copying
+        arrays = [self.data['{}_{}'.format(k, split)] for k in self.batch_keys]
+        num_batches = (self.num_val_batches if split == 'val' 
+            else self.num_train_batches)
         for bidx in range(num_batches):
-            # compute start and end indices
             start = bidx * self.flags.batch_size
             end = (bidx + 1) * self.flags.batch_size
+            yield tuple(a[start:end] for a in arrays)
+
+    def _shuffled_batches(self, split):
+        arrays = [self.data['{}_{}'.format(k, split)] for k in self.batch_keys]
+        idxs = self._train_idxs
+
+        # suffle data for this epoch
+        np.random.shuffle(idxs)
 
-            # retrieve the data
-            inputs = x[start:end]
-            targets = y[start:end]
+        # gather each batch into the next buffer
+        for bidx in range(self.num_train_batches):
+            start = bidx * self.flags.batch_size
+            end = (bidx + 1) * self.flags.batch_size
+            batch_idxs = idxs[start:end]
+            n = len(batch_idxs)
+            buffers = self._buffers[self._buffer_idx]
+            self._buffer_idx = (self._buffer_idx + 1) % self.num_buffers
+            # the indices are valid, and unlike the default mode 'raise',
+            # 'clip' writes into the buffer without a temporary copy
+            for (a, b) in zip(arrays, buffers):
+                np.take(a, batch_idxs, axis=0, out=b[:n], mode='clip')
+            yield tuple(b[:n] for b in buffers)
 
-            yield inputs, targets
+class WeightedDataset(Dataset):
 
-class WeightedDataset(object):
+    batch_keys = ['x', 'y', 'lw']
 
-    def __init__(self, data, flags):
+    def __init__(self, data, flags, num_buffers=2):
         """
         Description:
             - Initialize the dataset.
 
         Args:
             - data: a dictionary that must contain the keys:
-                'x_train', 'y_train', 'x_val', 'y_val'
+                'x_train', 'y_train', 'lw_train', 'x_val', 'y_val', 'lw_val'
                 Each of these keys should correspond to a value,
                 such that when indexing into the first dimension
                 of that value, you retrieve an element of a sample.
             - flags: object containing options
+            - num_buffers: see Dataset
+        """
+        super(WeightedDataset, self).__init__(data, flags, num_buffers)
+
+class StreamingDataset(object):
+
+    def __init__(self, input_filepath, flags, train_split=.8, shuffle=True,
+            debug_size=None, chunk_size=100000, normalize=True, 
+            use_stats_cache=True, **loader_kwargs):
+        """
+        Description:
+            - Initialize a dataset that streams batches from an hdf5 file 
+                in chunks rather than loading the whole file into memory.
+
+        Args:
+            - input_filepath: filepath of the risk dataset
+            - flags: object containing options
+            - train_split: fraction of samples used for training, the 
+                split is contiguous in the file
+            - shuffle: whether to shuffle the chunk order and the samples 
+                within each chunk every epoch
+            - debug_size: if set, use only this many samples
+            - chunk_size: number of samples read from file at a time
+            - normalize: whether to normalize features using statistics of 
+                the training samples, computed in a separate pass
+            - use_stats_cache: whether to cache the normalization statistics
+                in a sidecar file of the dataset
+            - loader_kwargs: preprocessing options passed through to 
+                dataset_loaders.risk_dataset_chunk_iterator
         """
+        self.input_filepath = input_filepath
         self.flags = flags
-        self.data = data
+        self.shuffle = shuffle
+        self.chunk_size = chunk_size
+        self.loader_kwargs = loader_kwargs
 
-    @property
-    def data(self):
-        return self._data
+        num_samples = dataset_loaders.risk_dataset_num_samples(
+            input_filepath, debug_size)
+        self.num_train_samples = int(np.ceil(num_samples * train_split))
+        self.num_val_samples = num_samples - self.num_train_samples
+        self.num_train_batches = int(np.ceil(
+            self.num_train_samples / float(self.flags.batch_size)))
+        self.num_val_batches = int(np.ceil(
+            self.num_val_samples / float(self.flags.batch_size)))
 
-    @data.setter
-    def data(self, data):
-        keys = ['x_train', 'y_train', 'lw_train', 'x_val', 'y_val', 'lw_val']
-        for k in keys:
-            if k not in data:
-                raise ValueError('data must contain key: {}'.format(k))
+        # compute normalization statistics over the training samples
+        self.means, self.stds = None, None
+        if normalize:
+            self.means, self.stds = dataset_loaders.load_feature_stats(
+                input_filepath, end=self.num_train_samples, 
+                chunk_size=chunk_size, use_cache=use_stats_cache, 
+                **loader_kwargs)
+            self.loader_kwargs['mean'] = self.means
+            self.loader_kwargs['std'] = self.stds
 
-        # set data
-        self._data = data
+        # infer dimensions from the first preprocessed chunk
+        first = next(dataset_loaders.risk_dataset_chunk_iterator(
+            input_filepath, start=0, end=1, **self.loader_kwargs))
+        self.input_dim = first['x'].shape[-1]
+        self.output_dim = first['y'].shape[-1]
 
-        # compute batch information
-        for split in ['train', 'val']:
-            num_samples = len(data['x_{}'.format(split)])
-            num_batches = int(num_samples / self.flags.batch_size)
+    def chunks(self, validation=False):
+        """
+        Description:
+            - Iterate over the preprocessed chunks of the train or validation 
+                samples, see dataset_loaders.risk_dataset_chunk_iterator.
+        """
+        if validation:
+            start, end = self.num_train_samples, (
+                self.num_train_samples + self.num_val_samples)
+        else:
+            start, end = 0, self.num_train_samples
+        return dataset_loaders.risk_dataset_chunk_iterator(
+            self.input_filepath, start=start, end=end, 
+            chunk_size=self.chunk_size, 
+            shuffle=self.shuffle and not validation, 
+            **self.loader_kwargs)
 
-            # if num_samples not divisible by batch_size, then 
-            # simply add an additional batch, which will be addressed
-            # in next_batch using python indexing past the end of a container
-            if num_samples % self.flags.batch_size != 0:
-                num_batches += 1
+    def next_batch(self, validation=False):
+        keys = ['x', 'y']
+        if self.loader_kwargs.get('load_likelihood_weights', False):
+            keys += ['lw']
 
-            if split == 'train':
-                self.num_train_batches = num_batches
-            else:
-                self.num_val_batches = num_batches
+        # samples left over at the end of a chunk are carried into the next
+        # one so that only the final batch of the epoch is partial
+        leftover = None
+        batch_size = self.flags.batch_size
+        for chunk in self.chunks(validation):
+            if leftover is not None:
+                chunk = {k: np.concatenate((leftover[k], chunk[k])) 
+                    for k in keys}
+                leftover = None
+
+            num_samples = len(chunk['x'])
+            num_full = num_samples // batch_size * batch_size
+            for start in range(0, num_full, batch_size):
+                end = start + batch_size
+                yield tuple(chunk[k][start:end] for k in keys)
+
+            if num_full < num_samples:
+                leftover = {k: chunk[k][num_full:] for k in keys}
+
+        if leftover is not None:
+            yield tuple(leftover[k] for k in keys)
+
+class PrefetchingDataset(object):
+
+    def __init__(self, dataset, num_prefetch=2):
+        """
+        Description:
+            - Wraps a dataset such that its batches are prepared in a 
+                background thread while the consumer processes the current 
+                batch. Attributes other than next_batch are delegated to 
+                the wrapped dataset.
+
+        Args:
+            - dataset: object implementing next_batch. If it gathers batches
+                into reused buffers, it must have at least num_prefetch + 2 
+                of them, since that many batches may be alive at once.
+            - num_prefetch: max number of batches prepared ahead of time
+        """
+        num_buffers = getattr(dataset, 'num_buffers', None)
+        if num_buffers is not None and num_buffers < num_prefetch + 2:
+            raise ValueError('dataset must have at least {} buffers to '
+                'prefetch {} batches, got {}'.format(
+                num_prefetch + 2, num_prefetch, num_buffers))
+        self.dataset = dataset
+        self.num_prefetch = num_prefetch
+
+    def __getattr__(self, name):
+        return getattr(self.dataset, name)
 
     def next_batch(self, validation=False):
-        # retrieve training or validation set
-        suffix = 'val' if validation else 'train'
-        x, y, w = (self.data['x_{}'.format(suffix)], 
-            self.data['y_{}'.format(suffix)], self.data['lw_{}'.format(suffix)])
-        num_batches = self.num_val_batches if validation else self.num_train_batches
+        batches = queue.Queue(maxsize=self.num_prefetch)
+        stop = threading.Event()
+        end = object()
 
-        # suffle data for this epoch
-        idxs = np.random.permutation(len(x))
-        x = x[idxs]
-        y = y[idxs]
-        w = w[idxs]
+        def produce():
+            try:
+                for batch in self.dataset.next_batch(validation=validation):
+                    if not _put(batch):
+                        return
+                _put(end)
+            except Exception as e:
+                _put(e)
 
-        # yield data in batches
-        for bidx in range(num_batches):
-            # compute start and end indices
-            start = bidx * self.flags.batch_size
-            end = (bidx + 1) * self.flags.batch_size
-            yield x[start:end], y[start:end], w[start:end]
-        
\ No newline at end of file
+        def _put(item):
+            # wake periodically so the thread exits if the consumer stops
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        thread = threading.Thread(target=produce)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if batch is end:
+                    break
+                elif isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
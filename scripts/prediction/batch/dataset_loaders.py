@@ -1,7 +1,9 @@
 
-import collections
 import h5py
+import hashlib
 import numpy as np
+import os
+import shutil
 
 BEHAVIORAL_NAMES = ["is_attentive",
         "prob_attentive_to_inattentive",
@@ -37,40 +39,95 @@ def enforce_censor_values(features, feature_labels):
                 features[:, fidx] = np.clip(features[:, fidx], low, high)
     return features
 
-def normalize_features(data, mean=None, std=None, threshold=1e-8):
+class RunningStats(object):
+
+    def __init__(self):
+        """
+        Description:
+            - Accumulates per-feature mean and variance over batches of 
+                samples in a single pass, merging the moments of each batch 
+                with the parallel algorithm of Chan et al.
+        """
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, x):
+        """
+        Description:
+            - Add a batch of samples, where the last axis indexes features.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        x = x.reshape(-1, x.shape[-1])
+        if len(x) == 0:
+            return
+        mean = np.mean(x, axis=0)
+        m2 = np.sum((x - mean) ** 2, axis=0)
+        self.merge_moments(len(x), mean, m2)
+
+    def merge(self, other):
+        """
+        Description:
+            - Merge the statistics of another RunningStats into this one.
+        """
+        if other.count > 0:
+            self.merge_moments(other.count, other.mean, other.m2)
+
+    def merge_moments(self, count, mean, m2):
+        if self.count == 0:
+            self.count, self.mean, self.m2 = count, mean, m2
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / float(total))
+        self.m2 = self.m2 + m2 + delta ** 2 * (self.count * count / float(total))
+        self.count = total
+
+    def std(self, threshold=1e-8):
+        """
+        Description:
+            - Standard deviation of the features, with values below the 
+                threshold replaced by 1 so that no division takes place.
+        """
+        std = np.sqrt(self.m2 / max(self.count, 1))
+        std[std < threshold] = 1
+        return std
+
+def _normalize_inplace(x, mean, std):
+    if not np.issubdtype(x.dtype, np.floating) or not x.flags.writeable:
+        x = x.astype(np.float64)
+    x -= mean
+    x /= std
+    return x
+
+def normalize_features(data, mean=None, std=None, threshold=1e-8, 
+        chunk_size=100000):
     """
     Description:
-        - Normalize the dataset (features).
+        - Normalize the dataset (features). Statistics are accumulated in 
+            chunks and the features normalized in place, so that no full 
+            copy of the training set is made.
 
     Args:
         - data: dictionary containing x_train and x_val
         - threshold: threshold for std dev at which 
             no division takes place
+        - chunk_size: number of samples over which to compute statistics 
+            at a time
 
     Returns:
         - normalized dataset
     """
-    if len(data['x_train'].shape) == 2:
-        axes = 0
-    else:
-        axes = (0,1)
-
     if mean is None or std is None:
-        mean = np.mean(data['x_train'], axis=axes)
-        data['x_train'] = (data['x_train'] - mean)
-
-        # compute the standard deviation after mean subtraction
-        std = np.std(data['x_train'], axis=axes)
-
-        # if the standard deviation is sufficiently low
-        # then just divide by 1
-        std[std < threshold] = 1
-    else:
-        data['x_train'] = (data['x_train'] - mean)
+        stats = RunningStats()
+        for s in range(0, len(data['x_train']), chunk_size):
+            stats.update(data['x_train'][s:s + chunk_size])
+        mean = stats.mean
+        std = stats.std(threshold)
 
     # normalize
-    data['x_train'] = data['x_train'] / std
-    data['x_val'] = (data['x_val'] - mean) / std
+    data['x_train'] = _normalize_inplace(data['x_train'], mean, std)
+    data['x_val'] = _normalize_inplace(data['x_val'], mean, std)
 
     # store means and standard deviations as well
     data['means'] = mean
@@ -79,37 +136,279 @@ def normalize_features(data, mean=None, std=None, threshold=1e-8):
     return data
 
 def discretize_targets(targets, num_bins):
+    """
+    Description:
+        - Replace targets in [0, 1] with the index of their bin, in place. 
+            Bins are linearly spaced and a value on the cut between two bins
+            is assigned to the higher one. Values outside [0, 1] are left 
+            unchanged.
+
+    Args:
+        - targets: array of targets
+        - num_bins: number of bins
+
+    Returns:
+        - targets
+    """
     # linear bins for now
     cuts = np.linspace(0, 1, num_bins + 1)
 
-    # collect indices where the target is between the cut
-    bin_idxs = []
-    for lo, hi in zip(cuts, cuts[1:]):
-        idxs = np.where((targets >= lo) & (targets <= hi))
-        bin_idxs.append(idxs)
+    # index of the last cut at or below each value, with values equal to 1 
+    # belonging to the last bin
+    valid = (targets >= 0) & (targets <= 1)
+    bins = np.digitize(targets[valid], cuts) - 1
+    bins[bins == num_bins] = num_bins - 1
+    targets[valid] = bins
+    return targets
+
+def _count_classes(values, classes=None, counts=None):
+    # merge the counts of the unique values in values into classes / counts
+    new_classes, inverse = np.unique(values, return_inverse=True)
+    new_counts = np.bincount(inverse.ravel(), minlength=len(new_classes))
+    if classes is None:
+        return new_classes, new_counts
+    classes, inverse = np.unique(
+        np.concatenate((classes, new_classes)), return_inverse=True)
+    counts = np.bincount(inverse.ravel(), 
+        weights=np.concatenate((counts, new_counts)), 
+        minlength=len(classes)).astype(np.int64)
+    return classes, counts
+
+def _iterate_target_chunks(targets, num_bins, chunk_size):
+    # yield in-memory copies of chunks of targets, which may be an hdf5 
+    # dataset, discretizing them if num_bins is provided
+    chunk_size = len(targets) if chunk_size is None else chunk_size
+    for s in range(0, len(targets), max(chunk_size, 1)):
+        chunk = np.array(targets[s:s + chunk_size])
+        if num_bins is not None:
+            discretize_targets(chunk, num_bins)
+        yield s, chunk
+
+def get_balanced_class_weights(targets, num_bins=None, chunk_size=None):
+    """
+    Description:
+        - Compute per-sample, per-target weights inversely proportional to 
+            the frequency of the sample's class for that target, normalized
+            such that the rarest class has weight 1.
 
-    # for each bin, assign values that belong to it
-    for c, idxs in enumerate(bin_idxs):
-        targets[idxs] = c
+    Args:
+        - targets: array of class targets of shape (num_samples, num_targets)
+            which may be an hdf5 dataset when chunk_size is provided
+        - num_bins: if provided, discretize the targets into this many bins 
+            before counting, without modifying targets
+        - chunk_size: if provided, read targets this many samples at a time, 
+            making two passes over them
 
-def get_balanced_class_weights(targets):
+    Returns:
+        - weights: array of shape (num_samples, num_targets)
+    """
+    num_targets = targets.shape[1]
+
+    # count classes of each target
+    class_counts = [(None, None)] * num_targets
+    for _, chunk in _iterate_target_chunks(targets, num_bins, chunk_size):
+        for tidx in range(num_targets):
+            class_counts[tidx] = _count_classes(
+                chunk[:, tidx], *class_counts[tidx])
+
+    # weights are the inverse counts normalized by the max inverse count
+    # python scalar exponentiation is used to match collections.Counter-based 
+    # values exactly
+    class_weights = []
+    for (classes, counts) in class_counts:
+        inv = np.array([int(c) ** -1 for c in counts])
+        class_weights.append(inv / max(inv))
+
+    # insert weights
     weights = np.empty(targets.shape)
-    for tidx in range(targets.shape[1]):
-        # count classes and normalize
-        c = collections.Counter()
-        c.update(targets[:,tidx])
-        for k in c.keys():
-            c[k] = c[k] ** -1
-        max_v = max(c.values())
-        for k in c.keys():
-            c[k] /= max_v
-
-        # insert weights
-        for k in c.keys():
-            idxs = np.where(targets[:,tidx] == k)[0]
-            weights[idxs, tidx] = c[k]
+    for s, chunk in _iterate_target_chunks(targets, num_bins, chunk_size):
+        for tidx in range(num_targets):
+            classes, _ = class_counts[tidx]
+            class_idxs = np.searchsorted(classes, chunk[:, tidx])
+            weights[s:s + len(chunk), tidx] = class_weights[tidx][class_idxs]
     return weights
 
+# memoized feature selections keyed by (feature names hash, fore_limit)
+_KEEP_IDXS_CACHE = {}
+
+def _feature_names_hash(feature_names):
+    names = [str(name) for name in feature_names]
+    return hashlib.sha1(repr(names).encode('utf-8')).hexdigest()
+
+def _compute_keep_idxs(feature_names, fore_limit):
+    # removing fore features optionally
+    discard_idxs = []
+    for i, name in enumerate(feature_names):
+        if name.count('fore') > fore_limit:
+            discard_idxs.append(i)
+    
+    # removing behavioral
+    beh_idxs = []
+    for i, feature_name in enumerate(feature_names):
+        for beh_name in BEHAVIORAL_NAMES:
+            if beh_name in feature_name:
+                beh_idxs.append(i)
+    beh_idxs = np.array(beh_idxs)
+    keep_idxs = set(range(len(feature_names)))
+    keep_idxs = keep_idxs.symmetric_difference(beh_idxs)
+
+    # fore features
+    keep_idxs = keep_idxs.symmetric_difference(discard_idxs)
+
+    # convert to usable indices, sorted so that column reads are in order
+    return np.array(sorted(keep_idxs), dtype=np.int64)
+
+def compute_keep_idxs(feature_names, fore_limit=8):
+    """
+    Description:
+        - Compute the indices of the features to keep when ignoring 
+            behavioral features and fore features beyond the limit. The 
+            result is memoized per set of feature names and fore_limit.
+
+    Args:
+        - feature_names: list of feature names in the dataset
+        - fore_limit: max number of 'fore' occurrences in a kept feature name,
+            a value of 8 allows all fore features
+
+    Returns:
+        - keep_idxs: sorted, read-only array of feature indices to keep
+    """
+    key = (_feature_names_hash(feature_names), fore_limit)
+    if key not in _KEEP_IDXS_CACHE:
+        keep_idxs = _compute_keep_idxs(feature_names, fore_limit)
+        keep_idxs.flags.writeable = False
+        _KEEP_IDXS_CACHE[key] = keep_idxs
+    return _KEEP_IDXS_CACHE[key]
+
+def keep_idxs_to_ranges(keep_idxs):
+    """
+    Description:
+        - Convert sorted indices into a list of contiguous (start, end) ranges.
+    """
+    if len(keep_idxs) == 0:
+        return []
+    breaks = np.where(np.diff(keep_idxs) != 1)[0] + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(keep_idxs)]))
+    return [(int(keep_idxs[s]), int(keep_idxs[e - 1]) + 1) 
+        for (s, e) in zip(starts, ends)]
+
+def merge_ranges(ranges, max_gap):
+    """
+    Description:
+        - Merge sorted (start, end) ranges separated by at most max_gap.
+    """
+    merged = []
+    for (lo, hi) in ranges:
+        if len(merged) > 0 and lo - merged[-1][1] <= max_gap:
+            merged[-1] = (merged[-1][0], hi)
+        else:
+            merged.append((lo, hi))
+    return merged
+
+def _feature_selection_attr_name(feature_names, fore_limit):
+    return 'keep_idxs_fore_limit_{}_{}'.format(
+        fore_limit, _feature_names_hash(feature_names)[:16])
+
+def feature_selection_filepath(input_filepath):
+    return '{}.features.h5'.format(input_filepath)
+
+def store_feature_selection_index(input_filepath, fore_limit=8):
+    """
+    Description:
+        - Store the feature selection for fore_limit as an attribute of a 
+            sidecar file of the dataset so that later loads need not 
+            recompute it. The dataset itself is not modified, so caches 
+            keyed by its modification time remain valid. The attribute name 
+            includes a hash of the feature names.
+    """
+    with h5py.File(input_filepath, 'r') as infile:
+        feature_names = infile['risk'].attrs['feature_names']
+    attr_name = _feature_selection_attr_name(feature_names, fore_limit)
+    with h5py.File(feature_selection_filepath(input_filepath), 'a') as outfile:
+        outfile.attrs[attr_name] = compute_keep_idxs(feature_names, fore_limit)
+
+def load_feature_selection_index(infile, fore_limit=8):
+    """
+    Description:
+        - Load the feature selection of an open dataset, from its sidecar 
+            file if stored there and otherwise by computing it.
+    """
+    feature_names = infile['risk'].attrs['feature_names']
+    attr_name = _feature_selection_attr_name(feature_names, fore_limit)
+    sidecar_filepath = feature_selection_filepath(infile.filename)
+    if os.path.exists(sidecar_filepath):
+        with h5py.File(sidecar_filepath, 'r') as sidecar:
+            if attr_name in sidecar.attrs:
+                return np.asarray(sidecar.attrs[attr_name], dtype=np.int64)
+    return compute_keep_idxs(feature_names, fore_limit)
+
+def read_features(features_ds, start=0, end=None, timesteps=None, 
+        keep_idxs=None, max_gap=4):
+    """
+    Description:
+        - Read a range of samples of the features, selecting the last 
+            timesteps and the columns of keep_idxs as part of the read so 
+            that few unused columns are loaded. Contiguous ranges of columns
+            separated by at most max_gap columns are read together, and a 
+            range without gaps is read directly into the output array. 
+            Each read of a chunked (e.g., compressed) dataset decompresses 
+            every chunk it touches, so all columns are read at once.
+
+    Args:
+        - features_ds: hdf5 dataset (or array) of features
+        - start, end: range of samples to read
+        - timesteps: if provided, number of final timesteps to read, a 
+            single timestep is squeezed out
+        - keep_idxs: sorted indices of feature columns to read, None for all
+        - max_gap: max number of unused columns read to merge two ranges
+
+    Returns:
+        - features: array of the selected features
+    """
+    end = len(features_ds) if end is None else min(end, len(features_ds))
+    multi_timestep = len(features_ds.shape) > 2
+    t_slice = slice(None)
+    if multi_timestep and timesteps is not None:
+        t_slice = slice(max(features_ds.shape[1] - timesteps, 0), None)
+
+    if keep_idxs is None:
+        if multi_timestep:
+            features = features_ds[start:end, t_slice, :]
+        else:
+            features = features_ds[start:end]
+    else:
+        shape = (end - start,)
+        if multi_timestep:
+            shape += (len(range(features_ds.shape[1])[t_slice]),)
+        shape += (len(keep_idxs),)
+        features = np.empty(shape, dtype=features_ds.dtype)
+        if getattr(features_ds, 'chunks', None) is not None:
+            max_gap = features_ds.shape[-1]
+        ranges = merge_ranges(keep_idxs_to_ranges(keep_idxs), max_gap)
+        offset = 0
+        for (lo, hi) in ranges:
+            cols = keep_idxs[(keep_idxs >= lo) & (keep_idxs < hi)]
+            n = len(cols)
+            if multi_timestep:
+                src = np.s_[start:end, t_slice, lo:hi]
+                dest = np.s_[:, :, offset:offset + n]
+            else:
+                src = np.s_[start:end, lo:hi]
+                dest = np.s_[:, offset:offset + n]
+            if n < hi - lo:
+                # drop the unused columns read along with the range
+                features[dest] = np.take(features_ds[src], cols - lo, axis=-1)
+            elif hasattr(features_ds, 'read_direct'):
+                features_ds.read_direct(features, src, dest)
+            else:
+                features[dest] = features_ds[src]
+            offset += n
+
+    if multi_timestep and timesteps is not None and features.shape[1] == 1:
+        features = np.squeeze(features, axis=1)
+    return features
+
 def risk_dataset_loader(input_filepath, normalize=True, 
         debug_size=None, train_split=.8, shuffle=False, timesteps=None,
         num_target_bins=None, balanced_class_loss=False, 
@@ -129,23 +428,27 @@ def risk_dataset_loader(input_filepath, normalize=True,
         - shuffle: whether to shuffle the order of the samples
 
     Returns:
-        - data: a dictionary with keys 'x_train', 'y_train', 'x_val', 'y_val'
+        - data: a dictionary with keys 'x_train', 'y_train', 'x_val', 'y_val',
+            and 'idxs_train', 'idxs_val' giving the index in the file of each
+            sample, such that the unshuffled dataset is a reordering of these
     """
     infile = h5py.File(input_filepath, 'r')
 
+    # only read the features that are kept
+    feature_names = infile['risk'].attrs['feature_names']
+    keep_idxs = None
+    if ignore_behavioral_features:
+        keep_idxs = load_feature_selection_index(infile, fore_limit)
+        feature_names = [feature_names[i] for i in keep_idxs]
+
     # if debugging, use fewer samples
+    # and downselect timesteps during the read
+    features = read_features(infile['risk/features'], end=debug_size, 
+        timesteps=timesteps, keep_idxs=keep_idxs)
     if debug_size is not None:
-        features = infile['risk/features'][:debug_size]
         targets = infile['risk/targets'][:debug_size]
     else:
-        features = infile['risk/features'].value
-        targets = infile['risk/targets'].value
-
-    # downselect timesteps
-    if len(features.shape) > 2 and timesteps is not None:
-        features = features[:, -timesteps:,:]
-        if features.shape[1] == 1:
-            features = np.squeeze(features, axis=1)
+        targets = infile['risk/targets'][()]
 
     # downselect targets if specified
     if target_index is not None:
@@ -161,17 +464,19 @@ def risk_dataset_loader(input_filepath, normalize=True,
             weights = None
 
     # enforce censor values
-    enforce_censor_values(features, infile['risk'].attrs['feature_names'])
+    enforce_censor_values(features, feature_names)
 
     msg = 'features and targets must be same length: features len: {}\ttargets len: {}'.format(
         len(features), len(targets))
     assert len(features) == len(targets), msg
 
     # if shuffle then randomly permute order
+    sample_idxs = np.arange(len(features))
     if shuffle:
         shuffle_idxs = np.random.permutation(len(features))
         features = features[shuffle_idxs]
         targets = targets[shuffle_idxs]
+        sample_idxs = shuffle_idxs
     
     # separate into train / validation
     num_samples = len(features)
@@ -179,7 +484,9 @@ def risk_dataset_loader(input_filepath, normalize=True,
     data = {'x_train': features[:num_train],
         'y_train': targets[:num_train],
         'x_val': features[num_train:],
-        'y_val': targets[num_train:]}
+        'y_val': targets[num_train:],
+        'idxs_train': sample_idxs[:num_train],
+        'idxs_val': sample_idxs[num_train:]}
 
     if weights is not None:
         data['w_train'] = weights[:num_train]
@@ -203,43 +510,12 @@ def risk_dataset_loader(input_filepath, normalize=True,
         data['lw_train'] = data['lw_train'][valid_train]
         data['x_train'] = data['x_train'][valid_train]
         data['y_train'] = data['y_train'][valid_train]
+        data['idxs_train'] = data['idxs_train'][valid_train]
         valid_val = np.where(data['lw_val'] < likelihood_weight_threshold)[0]
         data['lw_val'] = data['lw_val'][valid_val]
         data['x_val'] = data['x_val'][valid_val]
         data['y_val'] = data['y_val'][valid_val]
-
-    if ignore_behavioral_features:
-        # removing fore features optionally
-        feature_names = infile['risk'].attrs['feature_names']
-        discard_idxs = []
-        # fore_limit 8 would allow all fore features
-        for i, name in enumerate(feature_names):
-            if name.count('fore') > fore_limit:
-                discard_idxs.append(i)
-        
-        # removing behavioral
-        feature_names = infile['risk'].attrs['feature_names']
-        beh_idxs = []
-        for i, feature_name in enumerate(feature_names):
-            for beh_name in BEHAVIORAL_NAMES:
-                if beh_name in feature_name:
-                    beh_idxs.append(i)
-        beh_idxs = np.array(beh_idxs)
-        keep_idxs = set(range(len(feature_names)))
-        keep_idxs = keep_idxs.symmetric_difference(beh_idxs)
-
-        # fore features
-        keep_idxs = keep_idxs.symmetric_difference(discard_idxs)
-
-        # convert to usable indices
-        keep_idxs = np.array(list(keep_idxs))
-
-        if len(data['x_train'].shape) == 3:
-            data['x_train'] = data['x_train'][:, :, keep_idxs]
-            data['x_val'] = data['x_val'][:, :, keep_idxs]
-        else:
-            data['x_train'] = data['x_train'][:, keep_idxs]
-            data['x_val'] = data['x_val'][:, keep_idxs]
+        data['idxs_val'] = data['idxs_val'][valid_val]
 
     # normalize using train statistics
     if normalize:
@@ -250,3 +526,350 @@ def risk_dataset_loader(input_filepath, normalize=True,
     data['batch_idxs'] = infile.get('risk/batch_idxs', np.array([]))
 
     return data
+
+class SceneIndex(object):
+
+    def __init__(self, batch_idxs, seeds):
+        """
+        Description:
+            - Maps sample indices to the scene (seed) they were collected in 
+                and the index of the vehicle within that scene, using a binary 
+                search over the scene boundaries for an array of samples at 
+                once.
+
+        Args:
+            - batch_idxs: the index one past the last sample of each scene, 
+                as stored in 'risk/batch_idxs'
+            - seeds: the seed of each scene, as stored in 'risk/seeds'
+        """
+        self.ends = np.asarray(batch_idxs, dtype=np.int64).reshape(-1)
+        self.starts = np.hstack(([0], self.ends[:-1]))
+        self.seeds = np.asarray(seeds).reshape(-1)
+
+    @property
+    def num_scenes(self):
+        return len(self.ends)
+
+    def scenes(self, idxs):
+        """
+        Returns:
+            - the index of the scene of each sample index
+        """
+        return np.searchsorted(self.ends, idxs, side='right')
+
+    def lookup(self, idxs):
+        """
+        Description:
+            - Find the scene of each sample index.
+
+        Args:
+            - idxs: array of sample indices in the file
+
+        Returns:
+            - seeds: the seed of the scene of each sample
+            - veh_idxs: the (one-based) index of the vehicle in its scene
+            - num_vehs: the number of vehicles in the scene of each sample
+        """
+        idxs = np.asarray(idxs, dtype=np.int64)
+        scenes = self.scenes(idxs)
+        starts = self.starts[scenes]
+        return (self.seeds[scenes], idxs - starts + 1, 
+            self.ends[scenes] - starts)
+
+    def scene_means(self, values):
+        """
+        Description:
+            - Mean of values over the samples of each scene.
+
+        Args:
+            - values: array with a value per sample, or per sample and target,
+                in which case values are averaged over targets as well
+
+        Returns:
+            - means: the mean of each scene, nan for scenes without samples
+            - counts: the number of samples of each scene
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values.reshape(len(values), -1).mean(axis=1)
+        values = values[:self.ends[-1]]
+        scenes = self.scenes(np.arange(len(values)))
+        sums = np.bincount(scenes, weights=values, minlength=self.num_scenes)
+        counts = np.bincount(scenes, minlength=self.num_scenes)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+        return means, counts
+
+def risk_dataset_num_samples(input_filepath, debug_size=None):
+    """
+    Description:
+        - Number of samples in a risk dataset without loading it.
+    """
+    with h5py.File(input_filepath, 'r') as infile:
+        num_samples = len(infile['risk/features'])
+    if debug_size is not None:
+        num_samples = min(num_samples, debug_size)
+    return num_samples
+
+def risk_dataset_chunk_iterator(input_filepath, start=0, end=None, 
+        chunk_size=100000, shuffle=False, timesteps=None, 
+        num_target_bins=None, target_index=None, 
+        load_likelihood_weights=False, likelihood_weight_threshold=2.,
+        ignore_behavioral_features=True, fore_limit=8, mean=None, std=None):
+    """
+    Description:
+        - Iterate over a risk dataset in chunks, applying the same 
+            preprocessing as risk_dataset_loader to each chunk. Only a single 
+            chunk is held in memory at a time.
+
+    Args:
+        - input_filepath: filepath from which to load
+        - start: index of the first sample to load
+        - end: index one past the last sample to load, None means all
+        - chunk_size: number of samples to read from file at a time
+        - shuffle: whether to shuffle the order of the chunks and the 
+            samples within each chunk
+        - mean, std: if both provided, normalize each chunk with them
+        - remaining args: see risk_dataset_loader
+
+    Returns:
+        - generator yielding dictionaries with keys 'x', 'y', and 
+            optionally 'lw' (if loading likelihood weights)
+    """
+    with h5py.File(input_filepath, 'r') as infile:
+        features_ds = infile['risk/features']
+        targets_ds = infile['risk/targets']
+        weights_ds = infile['risk/weights'] if load_likelihood_weights else None
+        end = len(features_ds) if end is None else min(end, len(features_ds))
+
+        # only the kept features are read from file
+        feature_names = infile['risk'].attrs['feature_names']
+        keep_idxs = None
+        if ignore_behavioral_features:
+            keep_idxs = load_feature_selection_index(infile, fore_limit)
+            feature_names = [feature_names[i] for i in keep_idxs]
+
+        chunk_starts = np.arange(start, end, chunk_size)
+        if shuffle:
+            chunk_starts = np.random.permutation(chunk_starts)
+
+        for s in chunk_starts:
+            e = min(s + chunk_size, end)
+            features = read_features(features_ds, s, e, 
+                timesteps=timesteps, keep_idxs=keep_idxs)
+            targets = targets_ds[s:e]
+
+            if target_index is not None:
+                targets = targets[:, target_index, np.newaxis]
+            if num_target_bins is not None:
+                discretize_targets(targets, num_target_bins)
+
+            enforce_censor_values(features, feature_names)
+
+            chunk = {'x': features, 'y': targets}
+
+            if load_likelihood_weights:
+                lw = weights_ds[s:e]
+                valid = np.where(lw < likelihood_weight_threshold)[0]
+                chunk['lw'] = lw[valid]
+                chunk['x'] = chunk['x'][valid]
+                chunk['y'] = chunk['y'][valid]
+
+            if mean is not None and std is not None:
+                chunk['x'] = (chunk['x'] - mean) / std
+
+            if shuffle:
+                idxs = np.random.permutation(len(chunk['x']))
+                for k in chunk.keys():
+                    chunk[k] = chunk[k][idxs]
+
+            yield chunk
+
+def compute_feature_stats(input_filepath, start=0, end=None, 
+        chunk_size=100000, threshold=1e-8, **loader_kwargs):
+    """
+    Description:
+        - Compute per-feature means and standard deviations of a range of 
+            a risk dataset in a single chunked pass over the file.
+
+    Args:
+        - input_filepath: filepath of the dataset
+        - start, end: range of samples over which to compute statistics
+        - chunk_size: number of samples read from file at a time
+        - threshold: threshold for std dev at which no division takes place
+        - loader_kwargs: preprocessing options passed through to 
+            risk_dataset_chunk_iterator
+
+    Returns:
+        - mean, std: arrays of shape (input_dim,)
+    """
+    loader_kwargs = dict(loader_kwargs, shuffle=False, mean=None, std=None)
+    stats = RunningStats()
+    for chunk in risk_dataset_chunk_iterator(input_filepath, start=start, 
+            end=end, chunk_size=chunk_size, **loader_kwargs):
+        stats.update(chunk['x'])
+    return stats.mean, stats.std(threshold)
+
+def feature_stats_cache_filepath(input_filepath):
+    return '{}.stats.h5'.format(input_filepath)
+
+def _feature_stats_cache_key(input_filepath, start, end, threshold, 
+        loader_kwargs):
+    with h5py.File(input_filepath, 'r') as infile:
+        feature_names = infile['risk'].attrs['feature_names']
+        num_samples = len(infile['risk/features'])
+    end = num_samples if end is None else min(end, num_samples)
+
+    # only the options that change which features or samples are 
+    # included affect the statistics
+    selected = None
+    if loader_kwargs.get('ignore_behavioral_features', True):
+        selected = list(compute_keep_idxs(
+            feature_names, loader_kwargs.get('fore_limit', 8)))
+    lw_threshold = None
+    if loader_kwargs.get('load_likelihood_weights', False):
+        lw_threshold = loader_kwargs.get('likelihood_weight_threshold', 2.)
+
+    key = (os.path.abspath(input_filepath), os.path.getmtime(input_filepath),
+        start, end, loader_kwargs.get('timesteps', None), selected, 
+        lw_threshold, threshold)
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+def load_feature_stats(input_filepath, start=0, end=None, chunk_size=100000,
+        threshold=1e-8, use_cache=True, **loader_kwargs):
+    """
+    Description:
+        - Load feature statistics from the sidecar cache file of the dataset
+            if they have been computed previously with the same settings, 
+            otherwise compute them with compute_feature_stats and cache them.
+            The cache is keyed by the dataset path and modification time, 
+            the sample range, timesteps and selected features.
+
+    Args:
+        - use_cache: whether to read from and write to the cache
+        - remaining args: see compute_feature_stats
+
+    Returns:
+        - mean, std: arrays of shape (input_dim,)
+    """
+    key = _feature_stats_cache_key(
+        input_filepath, start, end, threshold, loader_kwargs)
+    cache_filepath = feature_stats_cache_filepath(input_filepath)
+
+    if use_cache and os.path.exists(cache_filepath):
+        with h5py.File(cache_filepath, 'r') as infile:
+            if key in infile:
+                return infile[key]['means'][()], infile[key]['stds'][()]
+
+    mean, std = compute_feature_stats(input_filepath, start=start, end=end, 
+        chunk_size=chunk_size, threshold=threshold, **loader_kwargs)
+
+    if use_cache:
+        try:
+            with h5py.File(cache_filepath, 'a') as outfile:
+                group = outfile.require_group(key)
+                group['means'] = mean
+                group['stds'] = std
+        except (IOError, OSError) as e:
+            print('unable to cache feature stats to {}: {}'.format(
+                cache_filepath, e))
+
+    return mean, std
+
+def preprocessed_cache_path(cache_dir, input_filepath, random_seed=None, 
+        **loader_kwargs):
+    """
+    Description:
+        - Directory in which the preprocessed arrays of a call to 
+            risk_dataset_loader are cached, keyed by a hash of the dataset 
+            path and modification time, the loader arguments and the random 
+            seed (which determines the shuffle).
+    """
+    def _key_value(v):
+        # arrays (e.g., normalization statistics) are keyed by their contents
+        if isinstance(v, np.ndarray):
+            return hashlib.sha1(np.ascontiguousarray(v).tobytes()).hexdigest()
+        return repr(v)
+    key = (os.path.abspath(input_filepath), os.path.getmtime(input_filepath),
+        sorted((k, _key_value(v)) for (k, v) in loader_kwargs.items()), 
+        random_seed)
+    key = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, key)
+
+def save_preprocessed_cache(cache_path, data):
+    """
+    Description:
+        - Save the arrays of a loaded dataset as .npy files, with features, 
+            targets and weights stored as float32. The files are written to 
+            a temporary directory that is renamed once complete, so that a 
+            partially written cache is never read. The temporary directory 
+            is removed if writing or renaming it fails, for example because 
+            another process completed the same cache first.
+    """
+    tmp_path = '{}.tmp{}'.format(cache_path, os.getpid())
+    try:
+        if not os.path.exists(tmp_path):
+            os.makedirs(tmp_path)
+        for (k, v) in data.items():
+            v = np.asarray(v[()] if isinstance(v, h5py.Dataset) else v)
+            if k.split('_')[0] in ['x', 'y', 'lw', 'w']:
+                v = v.astype(np.float32)
+            np.save(os.path.join(tmp_path, '{}.npy'.format(k)), v)
+        os.rename(tmp_path, cache_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+def load_preprocessed_cache(cache_path, mmap_mode='r'):
+    """
+    Description:
+        - Load a dataset saved by save_preprocessed_cache, memory mapping the
+            arrays so that loading is nearly instant.
+
+    Returns:
+        - data: dictionary of arrays, or None if the cache does not exist
+    """
+    if not os.path.isdir(cache_path):
+        return None
+    data = dict()
+    for filename in os.listdir(cache_path):
+        if filename.endswith('.npy'):
+            k = filename[:-len('.npy')]
+            data[k] = np.load(os.path.join(cache_path, filename), 
+                mmap_mode=mmap_mode)
+    return data
+
+def cached_risk_dataset_loader(input_filepath, cache_dir, random_seed=None,
+        **loader_kwargs):
+    """
+    Description:
+        - Load a risk dataset through a cache of preprocessed arrays. The 
+            first call with a given set of arguments runs risk_dataset_loader 
+            and saves its output, later calls memory map the saved arrays.
+
+    Args:
+        - input_filepath: filepath from which to load
+        - cache_dir: directory in which to store cached datasets
+        - random_seed: the seed set before loading, which determines the 
+            shuffle, used as part of the cache key
+        - loader_kwargs: arguments to risk_dataset_loader
+
+    Returns:
+        - data: a dictionary with keys 'x_train', 'y_train', 'x_val', 'y_val'
+    """
+    cache_path = preprocessed_cache_path(
+        cache_dir, input_filepath, random_seed, **loader_kwargs)
+    data = load_preprocessed_cache(cache_path)
+    if data is not None:
+        print('loaded preprocessed dataset from {}'.format(cache_path))
+        return data
+
+    data = risk_dataset_loader(input_filepath, **loader_kwargs)
+    try:
+        save_preprocessed_cache(cache_path, data)
+    except (IOError, OSError) as e:
+        # another process may have completed the same cache meanwhile
+        if not os.path.isdir(cache_path):
+            print('unable to cache preprocessed dataset to {}: {}'.format(
+                cache_path, e))
+            return data
+    return load_preprocessed_cache(cache_path)
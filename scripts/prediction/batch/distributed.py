@@ -0,0 +1,131 @@
+"""
+Data parallel training of the batch predictor across local processes.
+
+A parameter server process holds the variables, and each worker process fits
+the network to a shard of the training set, asynchronously applying its
+gradients to the shared variables.
+"""
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+
+def cluster_spec(num_workers, port=12322, host='127.0.0.1'):
+    """
+    Description:
+        - Build a cluster of a single parameter server and num_workers
+            workers on consecutive local ports.
+
+    Args:
+        - num_workers: number of worker processes
+        - port: port of the parameter server, workers use the following ports
+        - host: host of all the processes
+
+    Returns:
+        - dictionary mapping job names to lists of addresses
+    """
+    ps = ['{}:{}'.format(host, port)]
+    workers = ['{}:{}'.format(host, port + 1 + i) for i in range(num_workers)]
+    return {'ps': ps, 'worker': workers}
+
+def shard_data(data, shard, num_shards):
+    """
+    Description:
+        - Select every num_shards-th sample of the training and validation
+            splits, starting at sample shard. Other values are shared.
+
+    Args:
+        - data: dictionary with split values under keys ending in
+            '_train' or '_val'
+        - shard: index of the shard
+        - num_shards: total number of shards
+
+    Returns:
+        - dictionary of the same keys, where split values are views
+    """
+    sharded = {}
+    for (k, v) in data.items():
+        if k.endswith('_train') or k.endswith('_val'):
+            sharded[k] = v[shard::num_shards]
+        else:
+            sharded[k] = v
+    return sharded
+
+def _run_ps(spec):
+    cluster = tf.train.ClusterSpec(spec).as_cluster_def()
+    server = tf.train.Server(cluster, job_name='ps', task_index=0,
+        config=tf.ConfigProto(device_filters=['/job:ps']))
+    server.join()
+
+def _run_worker(fit_fn, spec, task_index, num_threads, finished):
+    cluster = tf.train.ClusterSpec(spec)
+    server = tf.train.Server(cluster.as_cluster_def(), job_name='worker',
+        task_index=task_index)
+    worker_device = '/job:worker/task:{}'.format(task_index)
+    device_fn = tf.train.replica_device_setter(
+        ps_tasks=1, worker_device=worker_device, cluster=cluster)
+    config = tf.ConfigProto(
+        device_filters=['/job:ps', worker_device],
+        intra_op_parallelism_threads=num_threads,
+        inter_op_parallelism_threads=2)
+
+    def wait_for_workers():
+        # mark this worker as done training and wait for the others,
+        # such that the shared variables no longer change
+        finished[task_index].set()
+        for event in finished:
+            event.wait()
+
+    fit_fn(task_index, server.target, device_fn, config, wait_for_workers)
+
+def run_local_cluster(fit_fn, num_workers, port=12322, poll_secs=1.):
+    """
+    Description:
+        - Run a parameter server and num_workers worker processes, and
+            block until the workers finish. Processes are forked, so data
+            loaded before calling this function is shared with the workers
+            without being copied. If a worker fails, the remaining workers
+            are terminated, since they would otherwise wait for it forever,
+            and a RuntimeError is raised.
+
+    Args:
+        - fit_fn: function run in each worker as
+                fit_fn(task_index, target, device_fn, config, wait_for_workers)
+            where target is the session target, device_fn places variables
+            on the parameter server, config is the session config, and
+            wait_for_workers blocks until all workers have called it.
+        - num_workers: number of worker processes
+        - port: port of the parameter server
+        - poll_secs: seconds between checks of the worker exit codes
+    """
+    spec = cluster_spec(num_workers, port)
+    num_threads = max(1, multiprocessing.cpu_count() // num_workers)
+    finished = [multiprocessing.Event() for _ in range(num_workers)]
+
+    ps = multiprocessing.Process(target=_run_ps, args=(spec,))
+    ps.daemon = True
+    ps.start()
+    workers = []
+    for task_index in range(num_workers):
+        worker = multiprocessing.Process(target=_run_worker,
+            args=(fit_fn, spec, task_index, num_threads, finished))
+        worker.start()
+        workers.append(worker)
+
+    failed = []
+    try:
+        running = list(workers)
+        while len(running) > 0 and len(failed) == 0:
+            running[0].join(poll_secs)
+            running = [w for w in running if w.exitcode is None]
+            failed = [i for (i, w) in enumerate(workers) 
+                if w.exitcode not in (None, 0)]
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        ps.terminate()
+        ps.join()
+
+    if len(failed) > 0:
+        raise RuntimeError('workers failed: {}'.format(failed))
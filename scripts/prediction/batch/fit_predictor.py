@@ -1,5 +1,6 @@
 
 import copy
+import functools
 import numpy as np
 np.set_printoptions(suppress=True, precision=8)
 import os
@@ -14,6 +15,8 @@ import prediction_metrics
 import prediction_flags
 import dataset
 import dataset_loaders
+import distributed
+import priority_dataset
 import neural_networks.neural_network_predictor as nnp
 import neural_networks.utils
 
@@ -27,9 +30,36 @@ def main(argv=None):
     np.random.seed(FLAGS.random_seed)
     tf.set_random_seed(FLAGS.random_seed)
 
-    # load dataset
+    # optionally stream the dataset from file instead of loading it
+    if FLAGS.stream_data:
+        return stream_main()
+
+    # optionally load cached normalization statistics of the training split, 
+    # which is only known before loading if samples are not shuffled
     input_filepath = FLAGS.dataset_filepath
-    data = dataset_loaders.risk_dataset_loader(
+    mean, std = None, None
+    if FLAGS.cache_feature_stats:
+        if FLAGS.shuffle_data:
+            raise ValueError('cache_feature_stats requires shuffle_data to be '
+                'False, otherwise the statistics include validation samples')
+        num_samples = dataset_loaders.risk_dataset_num_samples(
+            input_filepath, FLAGS.debug_size)
+        num_samples = int(np.ceil(num_samples * FLAGS.train_split))
+        mean, std = dataset_loaders.load_feature_stats(
+            input_filepath,
+            end=num_samples,
+            timesteps=FLAGS.timesteps,
+            load_likelihood_weights=FLAGS.use_likelihood_weights
+        )
+
+    # load dataset, optionally through the preprocessed cache
+    if FLAGS.preprocessed_cache_dir != '':
+        loader = functools.partial(dataset_loaders.cached_risk_dataset_loader,
+            cache_dir=FLAGS.preprocessed_cache_dir, 
+            random_seed=FLAGS.random_seed)
+    else:
+        loader = dataset_loaders.risk_dataset_loader
+    data = loader(
         input_filepath, 
         shuffle=FLAGS.shuffle_data, 
         train_split=FLAGS.train_split, 
@@ -38,17 +68,16 @@ def main(argv=None):
         num_target_bins=FLAGS.num_target_bins, 
         balanced_class_loss=FLAGS.balanced_class_loss, 
         target_index=FLAGS.target_index,
-        load_likelihood_weights=FLAGS.use_likelihood_weights
+        load_likelihood_weights=FLAGS.use_likelihood_weights,
+        mean=mean,
+        std=std
     )
 
     # infer what the input dimension should be from the data
     FLAGS.input_dim = prediction_utils.infer_input_dim(data)
     FLAGS.output_dim = prediction_utils.infer_output_dim(data)
 
-    if FLAGS.balanced_class_loss or FLAGS.use_likelihood_weights:
-        d = dataset.WeightedDataset(data, FLAGS)
-    else:
-        d = dataset.Dataset(data, FLAGS)
+    d = build_dataset(data)
 
     print('training set size: {}'.format(len(data['x_train'])))
     print('means:\n{}\n{}'.format(
@@ -60,22 +89,152 @@ def main(argv=None):
     prediction_metrics.regression_score(y, np.mean(y, axis=0), 'baseline')
     prediction_metrics.regression_score(y, y, 'correct')
 
-    # fit the model
-    with tf.Session(config=tf.ConfigProto(log_device_placement=False)) as session:
+    # fit the model, optionally across a cluster of local processes
+    if FLAGS.num_workers > 1:
+        distributed.run_local_cluster(functools.partial(fit_shard, data),
+            FLAGS.num_workers, FLAGS.cluster_port)
+    else:
+        fit(data, d)
+
+def build_dataset(data):
+    # prioritized datasets gather every batch into the same buffers, and 
+    # update the priorities of the batch they sampled last
+    if FLAGS.use_priority:
+        if FLAGS.prefetch_batches > 0:
+            raise ValueError('use_priority does not support prefetch_batches')
+        if FLAGS.balanced_class_loss or FLAGS.use_likelihood_weights:
+            raise ValueError('use_priority does not support sample weights')
+        if FLAGS.priority_type == 'proportional':
+            return priority_dataset.ProportionalPrioritizedDataset(data, FLAGS)
+        elif FLAGS.priority_type == 'rank':
+            return priority_dataset.PrioritizedDataset(data, FLAGS)
+        else:
+            raise ValueError('invalid priority_type: {}'.format(
+                FLAGS.priority_type))
+
+    # batches alive at once: those queued, being prepared and being run
+    num_buffers = FLAGS.prefetch_batches + 2
+    if FLAGS.balanced_class_loss or FLAGS.use_likelihood_weights:
+        return dataset.WeightedDataset(data, FLAGS, num_buffers=num_buffers)
+    else:
+        return dataset.Dataset(data, FLAGS, num_buffers=num_buffers)
+
+def fit(data, d, target='', device_fn=None, config=None, 
+        wait_for_workers=None):
+    """
+    Description:
+        - Fit a predictor to a dataset, then save, export and evaluate it.
+
+    Args:
+        - data: the full dataset, used in saving and evaluating
+        - d: the dataset to fit
+        - target: session target, empty for an in-process session
+        - device_fn: optional device function for the variables
+        - config: optional session config
+        - wait_for_workers: in a cluster, blocks until all workers 
+            finish training
+    """
+    if config is None:
+        config = tf.ConfigProto(log_device_placement=False)
+    with tf.device(device_fn), tf.Session(target, config=config) as session:
         # split based on the task being performed
         if FLAGS.task_type == 'classification':
             network = nnp.NeuralNetworkClassifier(session, FLAGS)
         else:
             network = nnp.NeuralNetworkPredictor(session, FLAGS)
 
-        network.fit(d)
+        network.fit(prefetch(d))
+
+        # only the chief saves and evaluates, once all workers are done
+        if wait_for_workers is not None:
+            wait_for_workers()
+        if FLAGS.task_index != 0:
+            return
 
         # save weights to a julia-compatible weight file
         neural_networks.utils.save_trainable_variables(
             FLAGS.julia_weights_filepath, session, data)
 
+        # optionally export a frozen graph for scoring
+        if FLAGS.frozen_graph_filepath != '':
+            neural_networks.utils.export_inference_graph(
+                FLAGS.frozen_graph_filepath, session, FLAGS, data)
+
         # evaluate the fit
         prediction_metrics.evaluate_fit(network, data, FLAGS)
 
+def fit_shard(data, task_index, target, device_fn, config, wait_for_workers):
+    """
+    Description:
+        - Fit a shard of the dataset in a worker of a local cluster. 
+            See distributed.run_local_cluster.
+    """
+    FLAGS.task_index = task_index
+    if task_index != 0:
+        # only the chief logs to console, and workers summarize separately
+        FLAGS.verbose = False
+        FLAGS.summary_dir = os.path.join(
+            FLAGS.summary_dir, 'worker_{}'.format(task_index))
+    np.random.seed(FLAGS.random_seed + task_index)
+    tf.set_random_seed(FLAGS.random_seed + task_index)
+    shard = distributed.shard_data(data, task_index, FLAGS.num_workers)
+    fit(data, build_dataset(shard), target, device_fn, config, 
+        wait_for_workers)
+
+def prefetch(d):
+    if FLAGS.prefetch_batches > 0:
+        return dataset.PrefetchingDataset(d, FLAGS.prefetch_batches)
+    return d
+
+def stream_main():
+    """
+    Description:
+        - Fit a predictor to a dataset that is streamed from file in chunks,
+            so that memory use is independent of the size of the dataset.
+    """
+    # class weights are computed over the whole dataset when loading it, 
+    # which streaming does not support
+    if FLAGS.balanced_class_loss:
+        raise ValueError('balanced_class_loss is not supported with stream_data')
+
+    d = dataset.StreamingDataset(
+        FLAGS.dataset_filepath, 
+        FLAGS,
+        train_split=FLAGS.train_split, 
+        shuffle=FLAGS.shuffle_data, 
+        debug_size=FLAGS.debug_size, 
+        chunk_size=FLAGS.stream_chunk_size,
+        use_stats_cache=FLAGS.cache_feature_stats,
+        timesteps=FLAGS.timesteps,
+        num_target_bins=FLAGS.num_target_bins, 
+        target_index=FLAGS.target_index,
+        load_likelihood_weights=FLAGS.use_likelihood_weights
+    )
+    FLAGS.input_dim = d.input_dim
+    FLAGS.output_dim = d.output_dim
+    print('training set size: {}'.format(d.num_train_samples))
+
+    with tf.Session(config=tf.ConfigProto(log_device_placement=False)) as session:
+        if FLAGS.task_type == 'classification':
+            network = nnp.NeuralNetworkClassifier(session, FLAGS)
+        else:
+            network = nnp.NeuralNetworkPredictor(session, FLAGS)
+
+        network.fit(prefetch(d))
+
+        # save weights to a julia-compatible weight file
+        stats = {'means': d.means, 'stds': d.stds}
+        neural_networks.utils.save_trainable_variables(
+            FLAGS.julia_weights_filepath, session, stats)
+        if FLAGS.frozen_graph_filepath != '':
+            neural_networks.utils.export_inference_graph(
+                FLAGS.frozen_graph_filepath, session, FLAGS, stats)
+
+        # evaluate the fit in a single pass over the validation chunks
+        batches = ((c['x'], c['y'], c['lw']) if 'lw' in c else (c['x'], c['y'])
+            for c in d.chunks(validation=True))
+        prediction_metrics.streaming_score(
+            network, batches, FLAGS.task_type, 'validation')
+
 if __name__ == '__main__':
     tf.app.run()
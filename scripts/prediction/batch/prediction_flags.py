@@ -7,9 +7,29 @@ FLAGS = tf.app.flags.FLAGS
 tf.app.flags.DEFINE_integer('batch_size', 
                             32,
                             """Number of samples in a batch.""")
+tf.app.flags.DEFINE_integer('inference_batch_size', 
+                            4096,
+                            """Number of samples in a batch when predicting.""")
+tf.app.flags.DEFINE_integer('inference_threads', 
+                            1,
+                            """Number of concurrent session.run calls when 
+                            predicting.""")
 tf.app.flags.DEFINE_integer('num_epochs', 
                             100,
                             """Number of training epochs.""")
+tf.app.flags.DEFINE_integer('num_workers', 
+                            1,
+                            """Number of local worker processes that fit shards 
+                            of the training set in parallel, sharing variables 
+                            through a parameter server.""")
+tf.app.flags.DEFINE_integer('task_index', 
+                            0,
+                            """Index of this worker, set for each worker 
+                            process. Worker 0 is the chief.""")
+tf.app.flags.DEFINE_integer('cluster_port', 
+                            12322,
+                            """Port of the parameter server, workers use the 
+                            following ports.""")
 tf.app.flags.DEFINE_string('snapshot_dir', 
                            '../../../data/snapshots/test/',
                            """Path to directory where to save weights.""")
@@ -25,6 +45,10 @@ tf.app.flags.DEFINE_string('summary_dir',
 tf.app.flags.DEFINE_string('julia_weights_filepath', 
                            '../../../data/networks/test.weights',
                            """Path to file where to save julia weights.""")
+tf.app.flags.DEFINE_string('frozen_graph_filepath', 
+                           '',
+                           """Path to file where to save a frozen inference 
+                           graph, empty string disables the export.""")
 tf.app.flags.DEFINE_integer('save_every', 
                             1000000,
                             """Number of epochs between network saves.""")
@@ -43,9 +67,31 @@ tf.app.flags.DEFINE_bool('load_network',
 tf.app.flags.DEFINE_integer('log_summaries_every', 
                             2,
                             """Number of batches between logging summaries.""")
+tf.app.flags.DEFINE_integer('trace_every', 
+                            0,
+                            """Number of training batches between writing a full 
+                            trace of session.run, 0 disables tracing.""")
 tf.app.flags.DEFINE_integer('save_weights_every', 
                             1,
                             """Number of batches between logging summaries.""")
+tf.app.flags.DEFINE_bool('async_checkpoints', 
+                            False,
+                            """Whether to write checkpoints from a background 
+                            thread instead of blocking training.""")
+tf.app.flags.DEFINE_float('save_weights_min_interval', 
+                            0.,
+                            """Minimum number of seconds between checkpoints.""")
+tf.app.flags.DEFINE_integer('max_checkpoints_to_keep', 
+                            100,
+                            """Maximum number of recent checkpoints kept in the 
+                            snapshot directory, older ones are deleted.""")
+tf.app.flags.DEFINE_integer('summary_flush_secs', 
+                            120,
+                            """Number of seconds between flushing summaries 
+                            to disk.""")
+tf.app.flags.DEFINE_integer('summary_max_queue', 
+                            100,
+                            """Number of summaries queued before flushing.""")
 tf.app.flags.DEFINE_bool('balanced_class_loss', 
                             False,
                             """Whether or not to balance the classes in 
@@ -131,9 +177,54 @@ tf.app.flags.DEFINE_float('priority_alpha',
 tf.app.flags.DEFINE_float('priority_beta', 
                             1.0,
                             """Beta parameter for prioritization.""")
+tf.app.flags.DEFINE_string('priority_type', 
+                            'rank',
+                            """Prioritized dataset used with use_priority, 'rank' 
+                            samples by the rank of the priorities and 
+                            'proportional' in proportion to them.""")
+tf.app.flags.DEFINE_integer('priority_repartition_every', 
+                            100,
+                            """Number of priority updates after which the 
+                            prioritized dataset is re-sorted into rank segments, 
+                            0 disables this trigger.""")
+tf.app.flags.DEFINE_float('priority_repartition_tolerance', 
+                            0.05,
+                            """Fraction of samples whose priority update moved 
+                            them out of their rank segment after which the 
+                            prioritized dataset is re-sorted, 0 disables this 
+                            trigger.""")
 tf.app.flags.DEFINE_bool('use_likelihood_weights', 
                             False,
                             """Wether or not to load likelihood ratio weights.""")
+tf.app.flags.DEFINE_integer('num_report_samples', 
+                            5,
+                            """Number of worst predicted samples to report 
+                            when evaluating.""")
+tf.app.flags.DEFINE_integer('prefetch_batches', 
+                            0,
+                            """Number of batches to prepare in a background thread 
+                            while training, 0 prepares them synchronously. Set 
+                            to e.g. 2 to overlap preparing batches with training, 
+                            at the memory cost of prefetch_batches + 2 buffers.""")
+tf.app.flags.DEFINE_bool('stream_data', 
+                            False,
+                            """Whether to stream the dataset from file in chunks 
+                            rather than loading it into memory.""")
+tf.app.flags.DEFINE_integer('stream_chunk_size', 
+                            100000,
+                            """Number of samples read from file at a time when 
+                            streaming the dataset.""")
+tf.app.flags.DEFINE_string('preprocessed_cache_dir', 
+                            '',
+                            """Directory in which to cache the preprocessed dataset 
+                            as memory-mapped arrays, empty string disables it.""")
+tf.app.flags.DEFINE_bool('cache_feature_stats', 
+                            False,
+                            """Whether to compute normalization statistics in a 
+                            chunked pass over the dataset file and cache them in 
+                            a sidecar file for reuse across runs. Loading an 
+                            in-memory dataset this way requires shuffle_data to 
+                            be False, so the training split is known in advance.""")
 
 # bootstrapping constants
 tf.app.flags.DEFINE_integer('bootstrap_iterations', 
@@ -11,6 +11,7 @@ import sklearn.metrics
 import seaborn as sns
 
 import dataset_loaders
+import streaming_metrics
 
 
 
@@ -33,25 +34,83 @@ def cross_entropy_loss(y_true, y_pred, eps=1e-16):
     y_pred[y_pred > 1 - eps] = 1 - eps
     return -(y_true * np.log(y_pred) + (1 - y_true) * np.log(1 - y_pred))
 
+def top_k_indices(values, k):
+    """
+    Description:
+        - Indices of the k largest values, largest first, found without 
+            sorting all of the values.
+    """
+    values = np.asarray(values)
+    k = min(k, len(values))
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    idxs = np.argpartition(values, len(values) - k)[-k:]
+    return idxs[np.argsort(values[idxs])[::-1]]
+
 def report_poorly_performing_indices(idxs, data):
-    batch_idxs = data['batch_idxs']
-    seeds = data['seeds']
-    for idx in idxs:
-        for i, b in enumerate(batch_idxs):
-            if b > idx:
-                break
-        seed = seeds[i]
-        if i > 0:
-            veh_idx = idx - batch_idxs[i - 1] + 1
-        else:
-            veh_idx = idx + 1
+    # if the data is a reordering of the file, map to indices in the file
+    idxs = np.asarray(idxs, dtype=np.int64)
+    file_idxs = data['idxs_train'][idxs] if 'idxs_train' in data else idxs
+    scene_index = dataset_loaders.SceneIndex(data['batch_idxs'], data['seeds'])
+    seeds, veh_idxs, num_vehs = scene_index.lookup(file_idxs)
+    for (idx, seed, veh_idx, num_veh) in zip(idxs, seeds, veh_idxs, num_vehs):
         print('seed/frame: {}\tveh idx: {}'.format(seed, veh_idx))
         print('targets: {}'.format(data['y_train'][idx]))
-        print('seed num veh: {}'.format(batch_idxs[i] - batch_idxs[i-1]))
+        print('seed num veh: {}'.format(num_veh))
     print('\n')
 
-def report_poorly_performing_classification_indices(network, data, flags,
-        n_report=4):
+def predict_splits(network, data):
+    """
+    Description:
+        - Predict the train and validation sets a single time, such that all
+            metrics can be computed from the same predictions.
+
+    Returns:
+        - predictions: dictionary with keys 'train' and 'val' of the 
+            probabilities output by the network
+    """
+    return {
+        'train': network.predict(data['x_train'], predict_labels=False),
+        'val': network.predict(data['x_val'], predict_labels=False)
+    }
+
+def predict_labels(probs):
+    """
+    Description:
+        - Labels predicted from probabilities, as network.predict computes 
+            them with predict_labels=True.
+    """
+    if len(probs.shape) == 3:
+        return np.argmax(probs, axis=-1)
+    labels = np.empty(probs.shape)
+    labels[:] = np.argmax(probs, axis=-1).reshape(-1, 1)
+    return labels
+
+def unshuffled_predictions(network, data, flags, predictions):
+    """
+    Description:
+        - The dataset and predictions in the order of the file. When the data 
+            records the file index of each sample this is a reordering of the 
+            samples and predictions in memory, otherwise the dataset is 
+            reloaded without shuffling and predicted again.
+
+    Returns:
+        - unshuffled: dictionary with keys 'y_train', 'seeds', 'batch_idxs', 
+            and 'idxs_train' if the data was reordered
+        - probs: the predicted probabilities of the unshuffled samples
+    """
+    if 'idxs_train' in data and 'idxs_val' in data:
+        sample_idxs = np.concatenate((data['idxs_train'], data['idxs_val']))
+        order = np.argsort(sample_idxs, kind='mergesort')
+        unshuffled = {
+            'y_train': np.concatenate((data['y_train'], data['y_val']))[order],
+            'idxs_train': sample_idxs[order],
+            'seeds': data['seeds'],
+            'batch_idxs': data['batch_idxs']
+        }
+        probs = np.concatenate((predictions['train'], predictions['val']))
+        return unshuffled, probs[order]
+
     unshuffled = dataset_loaders.risk_dataset_loader(
         flags.dataset_filepath, shuffle=False, train_split=1., 
         debug_size=flags.debug_size, timesteps=flags.timesteps,
@@ -59,17 +118,25 @@ def report_poorly_performing_classification_indices(network, data, flags,
         balanced_class_loss=flags.balanced_class_loss, 
         target_index=flags.target_index,
         load_likelihood_weights=flags.use_likelihood_weights)
-    x, y_true = unshuffled['x_train'], unshuffled['y_train']
-    y_pred, y_probs = network.predict(x, predict_labels=True)
+    probs = network.predict(unshuffled['x_train'], predict_labels=False)
+    return unshuffled, probs
+
+def report_poorly_performing_classification_indices(network, data, flags,
+        n_report=4, predictions=None):
+    if predictions is None:
+        predictions = predict_splits(network, data)
+    unshuffled, y_probs = unshuffled_predictions(
+        network, data, flags, predictions)
+    y_true = unshuffled['y_train']
     if len(y_probs.shape) == 3:
         cur_probs = y_probs[:,:,1]
     else:
         cur_probs = y_probs[:,:]
-    ce = cross_entropy_loss(y_true, cur_probs)
+    ce = cross_entropy_loss(y_true.astype(float), cur_probs.astype(float))
 
     for tidx in range(flags.output_dim):
         print(TARGET_LABELS[tidx])
-        idxs = list(reversed(np.argsort(ce[:,tidx])))[:n_report]
+        idxs = top_k_indices(ce[:,tidx], n_report)
         report_poorly_performing_indices(idxs, unshuffled)
 
 def classification_score(y, y_pred, probs, lw, name, viz_dir):
@@ -129,8 +196,31 @@ def classification_score(y, y_pred, probs, lw, name, viz_dir):
     plt.savefig(output_filepath)
     plt.clf()
 
+def pseudo_r2(y, y_pred, y_null):
+    """
+    Description:
+        - Compute the log likelihood of predicted probabilities and the 
+            pseudo r^2 scores based on it.
+
+    Args:
+        - y: targets in [0, 1]
+        - y_pred: predicted probabilities, clipped away from 0 and 1
+        - y_null: predictions of the null model, typically the target means
+
+    Returns:
+        - ll: log likelihood of the predictions
+        - null_ll: log likelihood of the null model
+        - mcfadden_r2: mcfadden pseudo r^2
+        - tjur_r2: tjur pseudo r^2, pooled across targets
+    """
+    ll = np.sum(y * np.log(y_pred)) + np.sum((1 - y) * np.log(1 - y_pred))
+    null_ll = np.sum(y * np.log(y_null)) + np.sum((1 - y) * np.log(1 - y_null))
+    mcfadden_r2 = 1 - ll / null_ll
+    tjur_r2 = np.mean(y_pred[y >= .5]) - np.mean(y_pred[y < .5])
+    return ll, null_ll, mcfadden_r2, tjur_r2
+
 def regression_score(y, y_pred, name, data=None, eps=1e-16, 
-        y_null=None):
+        y_null=None, num_report=5):
     # prevent overflow during the sum of the log terms
     y_pred = y_pred.astype(np.float128)
     # also threshold values to prevent log exception (throws off loss value)
@@ -164,16 +254,15 @@ def regression_score(y, y_pred, name, data=None, eps=1e-16,
 
     # convert to julia format the worst indices
     if data is not None:
-        num_report = 5
         print('\noverall poorly predicted')
-        idxs = np.argsort(np.sum(-(y * np.log(y_pred) + (1 - y) * np.log(1 - y_pred)), axis=1))[-num_report:]
+        idxs = top_k_indices(np.sum(-(y * np.log(y_pred) + (1 - y) * np.log(1 - y_pred)), axis=1), num_report)
         report_poorly_performing_indices(idxs, data)
         if y_pred.shape[-1] > 3:
             print('\nrear end collisions poorly predicted')
-            idxs = np.argsort(np.sum(-(y[:,1:3] * np.log(y_pred[:,1:3]) + (1 - y[:,1:3]) * np.log(1 - y_pred[:,1:3])), axis=1))[-num_report:]
+            idxs = top_k_indices(np.sum(-(y[:,1:3] * np.log(y_pred[:,1:3]) + (1 - y[:,1:3]) * np.log(1 - y_pred[:,1:3])), axis=1), num_report)
             report_poorly_performing_indices(idxs, data)
             print('\nhard brakes poorly predicted')
-            idxs = np.argsort(-(y[:,3] * np.log(y_pred[:,3]) + (1 - y[:,3]) * np.log(1 - y_pred[:,3])))[-num_report:]
+            idxs = top_k_indices(-(y[:,3] * np.log(y_pred[:,3]) + (1 - y[:,3]) * np.log(1 - y_pred[:,3])), num_report)
             report_poorly_performing_indices(idxs, data)
 
     # psuedo r^2 and other metrics
@@ -182,9 +271,7 @@ def regression_score(y, y_pred, name, data=None, eps=1e-16,
             y_null[y_null < eps] = eps
             y_null[y_null > 1 - eps] = 1 - eps
 
-        null_ll = np.sum(y * np.log(y_null)) + -np.sum((1 - y) * np.log(1 - y_null))
-        mcfadden_r2 = 1 - ll / null_ll
-        tjur_r2 = np.mean(y_pred[y>=.5], axis=0) - np.mean(y_pred[y<.5], axis=0)
+        ll, null_ll, mcfadden_r2, tjur_r2 = pseudo_r2(y, y_pred, y_null)
         y_class = np.zeros(y.shape)
         y_class[y>.5] = 1
         y_class = y_class.flatten()
@@ -210,47 +297,111 @@ def regression_score(y, y_pred, name, data=None, eps=1e-16,
         
     return ce, mse, r2
 
-def evaluate_classification_fit(network, data, flags):
+def streaming_score(network, batches, task_type, name, num_bins=1000):
+    """
+    Description:
+        - Score a network on batches of samples in a single pass, 
+            accumulating the metrics batch by batch so that memory use is 
+            independent of the number of samples. Regression targets are 
+            rounded to compute the classification curves.
+
+    Args:
+        - network: predictor implementing predict
+        - batches: iterable of (x, y) or (x, y, lw) tuples
+        - task_type: 'regression' or 'classification' (binary targets only)
+        - name: name of the evaluated set to display
+        - num_bins: number of probability bins of the ROC and PR curves
+
+    Returns:
+        - metrics: the regression metrics (if regression), and per-target 
+            'roc_auc' and 'avg_precision'
+    """
+    regression, curves = None, None
+    for batch in batches:
+        x, y = batch[0], batch[1]
+        lw = batch[2] if len(batch) > 2 else None
+        probs = network.predict(x, predict_labels=False)
+        if task_type == 'classification':
+            probs = probs[:, :, 1]
+            labels = y
+        else:
+            if regression is None:
+                regression = streaming_metrics.RegressionAccumulator()
+            regression.update(y, probs)
+            labels = np.round(y)
+        if curves is None:
+            curves = streaming_metrics.CurveAccumulator(
+                probs.shape[-1], num_bins)
+        curves.update(labels, probs, lw)
+
+    metrics = dict()
+    if regression is not None:
+        metrics = regression.result()
+        print("\n{} final cross entropy: {}".format(name, metrics['ce']))
+        print("{} final mse: {}".format(name, metrics['mse']))
+        print("{} final r2: {}".format(name, metrics['r2']))
+        print("mcfadden r^2: {}\tll: {}\tnull ll: {}".format(
+            metrics['mcfadden_r2'], metrics['ll'], metrics['null_ll']))
+        print("tjur_r2: {}".format(metrics['tjur_r2']))
+        print("acc: {}\tprecision: {}\trecall: {}".format(
+            metrics['acc'], metrics['precision'], metrics['recall']))
+
+    if curves is not None:
+        metrics['roc_auc'], metrics['avg_precision'] = [], []
+        for tidx in range(curves.num_targets):
+            _, _, roc_auc = curves.roc_curve(tidx)
+            _, _, avg_precision = curves.precision_recall_curve(tidx)
+            metrics['roc_auc'].append(roc_auc)
+            metrics['avg_precision'].append(avg_precision)
+            print('{} target {}\troc auc: {:.4f}\tavg precision: {:.4f}'.format(
+                name, tidx, roc_auc, avg_precision))
+    return metrics
+
+def evaluate_classification_fit(network, data, flags, predictions=None):
+    if predictions is None:
+        predictions = predict_splits(network, data)
+
     # train
-    y_pred, y_probs = network.predict(data['x_train'], predict_labels=True)
+    y_probs = predictions['train']
+    y_pred = predict_labels(y_probs)
     y = data['y_train']
-    y_null = np.mean(y, axis=0)
     lw = data['lw_train'] if 'lw_train' in data.keys() else None
     classification_score(y, y_pred, y_probs, lw, 'training', flags.viz_dir)
 
     # validation
-    y_pred, y_probs = network.predict(data['x_val'], predict_labels=True)
+    y_probs = predictions['val']
+    y_pred = predict_labels(y_probs)
     y = data['y_val']
-    y_null = np.mean(y, axis=0)
     lw = data['lw_val'] if 'lw_val' in data.keys() else None
     classification_score(y, y_pred, y_probs, lw, 'validation', flags.viz_dir)
 
     # print out indices that performed poorly
     try:
-        report_poorly_performing_classification_indices(network, data, flags)
+        report_poorly_performing_classification_indices(network, data, flags,
+            n_report=flags.num_report_samples, predictions=predictions)
     except Exception as e:
         print('exception raised in reporting indices')
         print('was this dataset subselected?')
         raise(e)
 
-def evaluate_regression_fit(network, data, flags):
+def evaluate_regression_fit(network, data, flags, predictions=None):
+    if predictions is None:
+        predictions = predict_splits(network, data)
+
     # final train loss
-    y_pred = network.predict(data['x_train'])
     y = data['y_train']
     y_null = np.mean(y, axis=0)
-    regression_score(y, y_pred, 'training', y_null=y_null)
+    regression_score(y, predictions['train'], 'training', y_null=y_null)
 
     # final validation loss
-    y_pred = network.predict(data['x_val'])
     y = data['y_val']
     y_null = np.mean(y, axis=0)
-    regression_score(y, y_pred, 'validation', y_null=y_null)
+    regression_score(y, predictions['val'], 'validation', y_null=y_null)
 
-    data = dataset_loaders.risk_dataset_loader(
-        flags.dataset_filepath, shuffle=False, train_split=1., 
-        debug_size=flags.debug_size, timesteps=flags.timesteps)
-    y_pred = network.predict(data['x_train'])
-    regression_score(data['y_train'], y_pred, 'unshuffled', data)
+    unshuffled, y_pred = unshuffled_predictions(
+        network, data, flags, predictions)
+    regression_score(unshuffled['y_train'], y_pred, 'unshuffled', unshuffled,
+        num_report=flags.num_report_samples)
 
 def compare_classification_output(network, data, flags, num_samples=10):
     y_idxs = np.where(np.sum(data['y_val'][:10000], axis=1) > 1e-4)[0]
@@ -266,11 +417,13 @@ def evaluate_fit(network, data, flags):
     if not os.path.exists(flags.viz_dir):
         os.mkdir(flags.viz_dir)
     
+    # every metric is computed from a single prediction of each split
+    predictions = predict_splits(network, data)
     if flags.task_type == 'classification':
         compare_classification_output(network, data, flags)
-        evaluate_classification_fit(network, data, flags)
+        evaluate_classification_fit(network, data, flags, predictions)
     else:
-        evaluate_regression_fit(network, data, flags)
+        evaluate_regression_fit(network, data, flags, predictions)
         data['y_train'] = np.round(data['y_train']).astype(int)
         data['y_val'] = np.round(data['y_val']).astype(int)
-        evaluate_classification_fit(network, data, flags)
+        evaluate_classification_fit(network, data, flags, predictions)
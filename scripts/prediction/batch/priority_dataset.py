@@ -1,9 +1,7 @@
 
-import collections
-import heapq
 import numpy as np
-import random
 import sys
+import time
 
 def find_subcutpoints(probs, cutpoints, partition_prob):
     num_elements = len(probs)
@@ -69,27 +67,50 @@ def find_cutpoints(probs, num_partitions):
     cutpoints[-1] = len(probs)
     return cutpoints
 
-def siftdown(heap, startpos, pos, idx_dict):
-    orig = idx_dict[pos]
+# rank-based cutpoints depend only on the number of samples, the number of 
+# partitions and alpha, not on the priority values, so they are shared across
+# repartitions (and datasets) for as long as those stay the same
+_CUTPOINTS_CACHE = {}
+
+def rank_cutpoints(heap_size, batch_size, alpha):
+    """
+    Description:
+        - Memoized cutpoints partitioning heap_size rank-ordered samples into 
+            batch_size segments of approximately equal probability, where the 
+            probability of a sample is proportional to rank ** -alpha.
+
+    Returns:
+        - cutpoints: read-only int array of the (exclusive) end of each segment
+    """
+    key = (heap_size, batch_size, alpha)
+    if key not in _CUTPOINTS_CACHE:
+        probs = np.arange(1., heap_size + 1) ** -alpha
+        probs /= sum(probs)
+        cutpoints = np.asarray(find_cutpoints(probs, batch_size))
+        cutpoints.flags.writeable = False
+        _CUTPOINTS_CACHE[key] = cutpoints
+    return _CUTPOINTS_CACHE[key]
+
+def siftdown(heap, startpos, pos, priorities, orders, positions):
+    # heap holds sample indices ordered by (priority, order), positions maps
+    # each sample index back to its position in the heap
     newitem = heap[pos]
+    newkey = (priorities[newitem], orders[newitem])
     # Follow the path to the root, moving parents down until finding a place
     # newitem fits.
     while pos > startpos:
         parentpos = (pos - 1) >> 1
         parent = heap[parentpos]
-        if newitem < parent:
+        if newkey < (priorities[parent], orders[parent]):
             heap[pos] = parent
-            if parentpos in idx_dict:
-                idx_dict[parentpos] = pos
+            positions[parent] = pos
             pos = parentpos
             continue
         break
     heap[pos] = newitem
-    idx_dict[orig] = pos
+    positions[newitem] = pos
 
-def siftup(heap, pos, idx_dict):
-    endpos = len(heap)
-    orig = idx_dict[pos]
+def siftup(heap, endpos, pos, priorities, orders, positions):
     startpos = pos
     newitem = heap[pos]
     # Bubble up the smaller child until hitting a leaf.
@@ -97,30 +118,71 @@ def siftup(heap, pos, idx_dict):
     while childpos < endpos:
         # Set childpos to index of smaller child.
         rightpos = childpos + 1
-        if rightpos < endpos and not heap[childpos] < heap[rightpos]:
-            childpos = rightpos
+        if rightpos < endpos:
+            left, right = heap[childpos], heap[rightpos]
+            if not ((priorities[left], orders[left]) 
+                    < (priorities[right], orders[right])):
+                childpos = rightpos
         # Move the smaller child up.
-        heap[pos] = heap[childpos]
-        if childpos in idx_dict:
-                idx_dict[childpos] = pos
+        child = heap[childpos]
+        heap[pos] = child
+        positions[child] = pos
         pos = childpos
         childpos = 2*pos + 1
     # The leaf at pos is empty now.  Put newitem there, and bubble it up
     # to its final resting place (by sifting its parents down).
     heap[pos] = newitem
-    idx_dict[orig] = pos
-    siftdown(heap, startpos, pos, idx_dict)
+    positions[newitem] = pos
+    siftdown(heap, startpos, pos, priorities, orders, positions)
 
 class PrioritizedDataset(object):
 
     def __init__(self, data, flags):
+        """
+        Description:
+            - A dataset that samples training batches by the rank of their 
+                priority. Samples are held in preallocated float32 arrays and 
+                the heap ordering them by priority holds integer indices into
+                those arrays, so the memory per sample is close to the size 
+                of its features.
+
+        Args:
+            - data: dictionary containing 'x_train', 'y_train', 'x_val', 'y_val'
+            - flags: options, uses batch_size, priority_alpha, priority_beta,
+                priority_repartition_every, priority_repartition_tolerance
+        """
         self.data = data
         self.flags = flags
-        self.sample_count = 0
-        self.heap = []
 
-        for x, y in zip(data['x_train'], data['y_train']):
-            self.store((x, y))
+        # incremental repartitioning: the heap is only re-sorted into rank 
+        # segments every repartition_every priority updates, or once the 
+        # fraction of samples whose updated priority moved them out of the 
+        # segment they were sampled from exceeds repartition_tolerance. 
+        # A value of 0 disables the respective trigger.
+        self.repartition_every = flags.priority_repartition_every
+        self.repartition_tolerance = flags.priority_repartition_tolerance
+        self.num_updates = 0
+        self.num_drifted = 0
+        self.num_repartitions = 0
+        self.repartition_time = 0.
+        self.repartition_times = []
+        self._partition_key = None
+
+        # sample storage, priorities and (negative) insertion order of each 
+        # sample, the heap of sample indices, and the position of each sample 
+        # in the heap
+        x_train, y_train = data['x_train'], data['y_train']
+        num_samples = len(x_train)
+        self.sample_count = 0
+        self.x = np.empty((num_samples,) + np.shape(x_train)[1:], 
+            dtype=np.float32)
+        self.y = np.empty((num_samples,) + np.shape(y_train)[1:], 
+            dtype=np.float32)
+        self.priorities = np.empty(num_samples, dtype=np.float64)
+        self.orders = np.empty(num_samples, dtype=np.int64)
+        self.heap = np.empty(num_samples, dtype=np.int64)
+        self.positions = np.empty(num_samples, dtype=np.int64)
+        self.store_batch(x_train, y_train)
 
         self.repartition(flags.batch_size, flags.priority_alpha, 
             flags.priority_beta)
@@ -142,66 +204,145 @@ class PrioritizedDataset(object):
                 self.num_val_batches = num_batches
 
         # allocate space for batch a single time
-        self.x_train = np.empty((self.flags.batch_size, self.flags.input_dim), 
+        self.x_train = np.empty((self.flags.batch_size,) + self.x.shape[1:], 
                         dtype=np.float32)
-        self.y_train = np.empty((self.flags.batch_size, self.flags.output_dim), 
+        self.y_train = np.empty((self.flags.batch_size,) + self.y.shape[1:], 
                         dtype=np.float32)
 
+    def _reserve(self, num_samples):
+        # grow the storage geometrically to hold at least num_samples
+        capacity = len(self.heap)
+        if num_samples <= capacity:
+            return
+        capacity = max(num_samples, 2 * capacity)
+        for name in ['x', 'y', 'priorities', 'orders', 'heap', 'positions']:
+            arr = getattr(self, name)
+            grown = np.empty((capacity,) + arr.shape[1:], dtype=arr.dtype)
+            grown[:len(arr)] = arr
+            setattr(self, name, grown)
+
+    def _sort_heap(self):
+        # a sorted array is also a valid heap
+        heap = self.heap[:self.sample_count]
+        heap[:] = heap[np.lexsort((self.orders[heap], self.priorities[heap]))]
+        self.positions[heap] = np.arange(self.sample_count)
+
     def store(self, sample, priority=-1000):
         self.sample_count += 1
+        self._reserve(self.sample_count)
         # new samples are added with highest priority, which is the smallest 
         # value since this is a min heap. We also want newer samples at the top
         # so add the negative sample count to differentiate between equal priorities
-        heapq.heappush(self.heap, (priority, -self.sample_count, sample))
+        idx = self.sample_count - 1
+        self.x[idx], self.y[idx] = sample
+        self.priorities[idx] = priority
+        self.orders[idx] = -self.sample_count
+        self.heap[idx] = idx
+        siftdown(self.heap, 0, idx, self.priorities, self.orders, 
+            self.positions)
+
+    def store_batch(self, x, y, priority=-1000):
+        """
+        Description:
+            - Store many samples at once, equivalent to calling store on each 
+                in turn but vectorized, after which the heap is sorted.
+        """
+        start = self.sample_count
+        end = start + len(x)
+        self._reserve(end)
+        self.x[start:end] = x
+        self.y[start:end] = y
+        self.priorities[start:end] = priority
+        self.orders[start:end] = -np.arange(start + 1, end + 1)
+        self.heap[start:end] = np.arange(start, end)
+        self.sample_count = end
+        self._sort_heap()
 
     def repartition(self, batch_size, alpha, beta):
         assert alpha >= 0
         assert beta >= 0 and beta <= 1
+        st = time.time()
 
         # sort heap
-        self.heap.sort()
-        heap_size = len(self.heap)
+        self._sort_heap()
+        heap_size = self.sample_count
 
-        # recompute cutpoints
+        # recompute cutpoints if the partitioning changed
         # the probability for each sample to be selected is inversely 
         # proportional to its rank. It is purposefully independent of the 
         # actual priority value, and is scaled by exponentiating by alpha.
-        probs = np.arange(1., heap_size + 1) ** -alpha
-        total_prob = sum(probs)
-        probs /= total_prob
-        cutpoints = find_cutpoints(probs, batch_size)
-
-        # store the partition sizes, cutpoints, and partition importance weights
-        self.partition_sizes = np.array([cutpoints[0]] + [b - a
-            for (a, b) in zip(cutpoints, cutpoints[1:])], dtype=float)
-        self.cutpoints = np.asarray(cutpoints)
-
-        # the weights are computed to correct for the bias of oversampling 
-        # beta varies between 0 (no correction) and 1 (full correction)
-        # there are two options:
-        # 1. use the 'true' above-computed probabilities for weighting
-        # 2. use the actual sampling probabilities (i.e., the approximate
-        # probabilities actually used)
-        # we go with the second option
-        self.importance_weights = (heap_size * 
-            (self.partition_sizes * batch_size) ** -1) ** -beta
-        self.importance_weights /= np.max(self.importance_weights)
-        self.importance_weights = self.importance_weights.reshape(-1, 1)
-
-        # need to store indices into the heap when sampling to update priority
-        self.heap_idxs = np.empty(batch_size, dtype=np.int64)
+        key = (heap_size, batch_size, alpha, beta)
+        if key != self._partition_key:
+            cutpoints = rank_cutpoints(heap_size, batch_size, alpha)
+
+            # store the partition sizes, cutpoints, and partition importance 
+            # weights
+            self.partition_starts = np.hstack(([0], cutpoints[:-1]))
+            self.partition_sizes = (cutpoints - self.partition_starts).astype(
+                float)
+            self.cutpoints = cutpoints
+
+            # the weights are computed to correct for the bias of oversampling 
+            # beta varies between 0 (no correction) and 1 (full correction)
+            # there are two options:
+            # 1. use the 'true' above-computed probabilities for weighting
+            # 2. use the actual sampling probabilities (i.e., the approximate
+            # probabilities actually used)
+            # we go with the second option
+            self.importance_weights = (heap_size * 
+                (self.partition_sizes * batch_size) ** -1) ** -beta
+            self.importance_weights /= np.max(self.importance_weights)
+            self.importance_weights = self.importance_weights.reshape(-1, 1)
+
+            # need to store the sampled indices to update their priority
+            self.sample_idxs = np.empty(batch_size, dtype=np.int64)
+            self._partition_key = key
+
+        # the priority range of each segment, used to detect updates that 
+        # move a sample into a different segment
+        upper = self.priorities[self.heap[self.cutpoints - 1]]
+        self.lower_bounds = np.hstack(([-np.inf], upper[:-1]))
+        self.upper_bounds = upper
+        self.upper_bounds[-1] = np.inf
+
+        self.num_updates = 0
+        self.num_drifted = 0
+        self.num_repartitions += 1
+        self.repartition_time += time.time() - st
+
+    def needs_repartition(self):
+        """
+        Description:
+            - Whether the rank segments are stale enough to warrant re-sorting,
+                either because of the number of priority updates since the last 
+                repartition or because the fraction of samples that drifted out
+                of their segment exceeds the tolerance.
+        """
+        if (self.repartition_every > 0 
+                and self.num_updates >= self.repartition_every):
+            return True
+        if (self.repartition_tolerance > 0 and self.num_drifted 
+                > self.repartition_tolerance * self.sample_count):
+            return True
+        return False
+
+    def maybe_repartition(self):
+        if self.needs_repartition():
+            self.repartition(self.flags.batch_size, self.flags.priority_alpha, 
+                self.flags.priority_beta)
+            return True
+        return False
 
     def sample_batch(self):
-        # select a sample_idx uniformly at random from each partition 
-        for idx, (prev_c, c) in enumerate(zip(
-                np.hstack(([0], self.cutpoints)), self.cutpoints)):
-            heap_idx = random.randint(prev_c, c - 1)
-            self.heap_idxs[idx] = heap_idx
+        self.maybe_repartition()
+
+        # select a sample uniformly at random from each partition 
+        heap_idxs = np.random.randint(self.partition_starts, self.cutpoints)
+        np.take(self.heap, heap_idxs, out=self.sample_idxs)
 
-            # add sample to batch
-            (x, y) = self.heap[heap_idx][2]
-            self.x_train[idx] = x
-            self.y_train[idx] = y
+        # add samples to batch
+        np.take(self.x, self.sample_idxs, axis=0, out=self.x_train)
+        np.take(self.y, self.sample_idxs, axis=0, out=self.y_train)
 
     def next_batch(self, validation=False):
 
@@ -220,27 +361,209 @@ class PrioritizedDataset(object):
                 yield x[start:end], y[start:end]
 
         else:
+            # report the time spent repartitioning over the epoch
+            num_repartitions = self.num_repartitions
+            self.repartition_time = 0.
             for bidx in range(self.num_train_batches):
                 self.sample_batch()
                 yield (self.x_train, self.y_train, self.importance_weights)
+            self.repartition_times.append(self.repartition_time)
+            if self.flags.verbose:
+                print('repartition time: {:.4f}s over {} repartitions'.format(
+                    self.repartition_time, 
+                    self.num_repartitions - num_repartitions))
+
+    def update_losses(self, losses):
+        """
+        Description:
+            - Update the priorities of the most recently sampled batch from 
+                their losses. Since the smallest priority value has the 
+                highest rank, the priorities are the negative losses, such 
+                that samples with larger losses are sampled more.
+
+        Args:
+            - losses: array of shape (batch_size,) or (batch_size, 1)
+        """
+        self.update_priorities(-np.asarray(losses, dtype=float))
 
     def update_priorities(self, priorities):
 
-        # iterate through the heap indices previously sampled, updating their 
+        # count the samples whose new priority falls outside of the segment 
+        # they were sampled from, sample idx of the batch is from segment idx
+        new_priorities = np.asarray(priorities, dtype=float).reshape(
+            len(self.sample_idxs), -1)[:, 0]
+        self.num_drifted += np.count_nonzero(
+            (new_priorities < self.lower_bounds) 
+            | (new_priorities > self.upper_bounds))
+        self.num_updates += 1
+
+        # iterate through the samples previously drawn, updating their 
         # priorities
-        idx_dict = collections.defaultdict(int)
-        idx_dict.update({i:i for i in self.heap_idxs})
-        for (orig_hidx, p) in zip(self.heap_idxs, priorities):
-            # get the possibly-updated index in the heap
-            hidx = idx_dict[orig_hidx]
+        for (idx, p) in zip(self.sample_idxs, new_priorities):
+            # get the possibly-updated position in the heap
+            pos = self.positions[idx]
+            prev_p = self.priorities[idx]
+            self.priorities[idx] = p
 
             # increase the priority of the key
-            if p[0] < self.heap[hidx][0]:
-                self.heap[hidx] = (p[0], self.heap[hidx][1], self.heap[hidx][2])
-                siftdown(self.heap, 0, hidx, idx_dict)
+            if p < prev_p:
+                siftdown(self.heap, 0, pos, self.priorities, self.orders, 
+                    self.positions)
 
             # decrease the priority of the key
             else:
-                self.heap[hidx] = (p[0], self.heap[hidx][1], self.heap[hidx][2])
-                siftup(self.heap, hidx, idx_dict)
-        
\ No newline at end of file
+                siftup(self.heap, self.sample_count, pos, self.priorities, 
+                    self.orders, self.positions)
+        
+class SumTree(object):
+
+    def __init__(self, capacity):
+        """
+        Description:
+            - A binary tree stored in a flat array where each internal node 
+                holds the sum of its children. Leaves hold the priorities of 
+                the items, so that sampling an item proportional to its 
+                priority and updating priorities take O(log N) time. Both 
+                operations are vectorized over a batch of items.
+
+        Args:
+            - capacity: number of items (leaves) in the tree
+        """
+        self.capacity = capacity
+        self.depth = int(np.ceil(np.log2(max(capacity, 1))))
+        self.num_leaves = 2 ** self.depth
+        # index 0 is unused, the root is at 1, children of i are 2i and 2i + 1
+        self.tree = np.zeros(2 * self.num_leaves, dtype=np.float64)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    @property
+    def priorities(self):
+        return self.tree[self.num_leaves:self.num_leaves + self.capacity]
+
+    def update(self, idxs, priorities):
+        """
+        Description:
+            - Set the priorities of the items at idxs, propagating the sums 
+                up the tree one level at a time for all items at once.
+        """
+        nodes = np.asarray(idxs, dtype=np.int64) + self.num_leaves
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes >> 1)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """
+        Description:
+            - Find the items whose cumulative priority ranges contain values,
+                descending the tree for all values at once.
+
+        Args:
+            - values: array of values in [0, total)
+
+        Returns:
+            - idxs: array of item indices
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = self.tree[2 * nodes]
+            go_right = values >= left
+            values -= left * go_right
+            nodes = 2 * nodes + go_right
+        # guard against rounding error pushing a value past the last item
+        return np.minimum(nodes - self.num_leaves, self.capacity - 1)
+
+class ProportionalPrioritizedDataset(object):
+
+    def __init__(self, data, flags, eps=1e-6):
+        """
+        Description:
+            - A dataset that samples training batches with probability 
+                proportional to priority ** alpha, backed by a SumTree. 
+                Features and targets are held in contiguous arrays and 
+                priorities in the parallel array of the tree leaves.
+
+        Args:
+            - data: dictionary containing 'x_train', 'y_train', 'x_val', 'y_val'
+            - flags: options, uses batch_size, priority_alpha, priority_beta
+            - eps: added to priorities so that no sample has zero probability
+        """
+        self.data = data
+        self.flags = flags
+        self.eps = eps
+        self.x = np.ascontiguousarray(data['x_train'], dtype=np.float32)
+        self.y = np.ascontiguousarray(data['y_train'], dtype=np.float32)
+        num_samples = len(self.x)
+
+        # samples start with equal priority
+        self.tree = SumTree(num_samples)
+        self.tree.update(np.arange(num_samples), np.ones(num_samples))
+
+        # compute batch information
+        batch_size = self.flags.batch_size
+        self.num_train_batches = int(np.ceil(num_samples / float(batch_size)))
+        self.num_val_batches = int(np.ceil(
+            len(data['x_val']) / float(batch_size)))
+
+        # allocate space for batch a single time
+        self.x_train = np.empty((batch_size,) + self.x.shape[1:], 
+            dtype=np.float32)
+        self.y_train = np.empty((batch_size,) + self.y.shape[1:], 
+            dtype=np.float32)
+        self.importance_weights = np.empty((batch_size, 1), dtype=np.float32)
+        self.sample_idxs = np.empty(batch_size, dtype=np.int64)
+
+    def sample_batch(self):
+        # stratified sampling: one value from each of batch_size equal 
+        # segments of the total priority
+        batch_size = self.flags.batch_size
+        total = self.tree.total
+        values = (np.arange(batch_size) + np.random.rand(batch_size)) * (
+            total / batch_size)
+        self.sample_idxs[:] = self.tree.find(values)
+        np.take(self.x, self.sample_idxs, axis=0, out=self.x_train)
+        np.take(self.y, self.sample_idxs, axis=0, out=self.y_train)
+
+        # importance weights correct for the bias of prioritized sampling
+        probs = self.tree.priorities[self.sample_idxs] / total
+        weights = (len(self.x) * probs) ** -self.flags.priority_beta
+        self.importance_weights[:, 0] = weights / np.max(weights)
+
+    def next_batch(self, validation=False):
+        if validation:
+            x, y = self.data['x_val'], self.data['y_val']
+            for bidx in range(self.num_val_batches):
+                start = bidx * self.flags.batch_size
+                end = (bidx + 1) * self.flags.batch_size
+                yield x[start:end], y[start:end]
+        else:
+            for bidx in range(self.num_train_batches):
+                self.sample_batch()
+                yield (self.x_train, self.y_train, self.importance_weights)
+
+    def update_priorities(self, priorities):
+        """
+        Description:
+            - Update the priorities of the most recently sampled batch.
+
+        Args:
+            - priorities: array of shape (batch_size, 1) of nonnegative 
+                priorities (e.g., losses), larger values are sampled more
+        """
+        priorities = np.abs(np.asarray(priorities, dtype=np.float64).reshape(
+            len(self.sample_idxs), -1)[:, 0]) + self.eps
+        priorities = priorities ** self.flags.priority_alpha
+        # a sample drawn more than once takes the last of its priorities
+        self.tree.update(self.sample_idxs, priorities)
+
+    def update_losses(self, losses):
+        """
+        Description:
+            - Update the priorities of the most recently sampled batch from 
+                their losses, which are used as priorities directly.
+        """
+        self.update_priorities(losses)
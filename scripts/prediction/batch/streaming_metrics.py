@@ -0,0 +1,179 @@
+"""
+Metrics accumulated batch by batch, so that evaluation takes a single pass
+over the predictions with memory independent of the number of samples.
+"""
+import numpy as np
+
+import dataset_loaders
+
+class RegressionAccumulator(object):
+
+    def __init__(self, eps=1e-16):
+        """
+        Description:
+            - Accumulates the statistics of regression_score: cross entropy,
+                mse, r2, mcfadden and tjur pseudo r2, and accuracy,
+                precision and recall of the thresholded predictions.
+
+        Args:
+            - eps: predictions are clipped to [eps, 1 - eps] for the logs
+        """
+        self.eps = eps
+        self.count = 0
+        self.ll = 0.
+        self.sse = 0.
+        # target statistics for r2 and the null model of mcfadden r2
+        self.target_stats = dataset_loaders.RunningStats()
+        self.target_sum = 0.
+        # sums of predictions for positive and negative targets for tjur r2,
+        # which pools all targets as in regression_score
+        self.pos_pred_sum, self.pos_count = 0., 0
+        self.neg_pred_sum, self.neg_count = 0., 0
+        # counts of the thresholded predictions
+        self.num_correct = 0
+        self.num_pred_pos = 0
+        self.num_true_pos = 0
+        self.num_pos = 0
+
+    def update(self, y, y_pred):
+        """
+        Description:
+            - Add a batch of targets and predictions.
+
+        Args:
+            - y: targets in [0, 1], shape = (batch_size, output_dim)
+            - y_pred: predicted probabilities, shape = (batch_size, output_dim)
+        """
+        y = np.asarray(y, dtype=np.float64).reshape(len(y), -1)
+        y_pred = np.clip(np.asarray(y_pred, dtype=np.float64).reshape(
+            len(y), -1), self.eps, 1 - self.eps)
+
+        self.count += len(y)
+        self.ll += np.sum(y * np.log(y_pred) + (1 - y) * np.log1p(-y_pred))
+        self.sse += np.sum((y - y_pred) ** 2)
+        self.target_stats.update(y)
+        self.target_sum += np.sum(y, axis=0)
+
+        pos = y >= .5
+        self.pos_pred_sum += np.sum(y_pred * pos, axis=0)
+        self.pos_count += np.sum(pos, axis=0)
+        self.neg_pred_sum += np.sum(y_pred * ~pos, axis=0)
+        self.neg_count += np.sum(~pos, axis=0)
+
+        y_class = y > .5
+        y_pred_class = y_pred >= .5
+        self.num_correct += np.count_nonzero(y_class == y_pred_class)
+        self.num_pred_pos += np.count_nonzero(y_pred_class)
+        self.num_true_pos += np.count_nonzero(y_class & y_pred_class)
+        self.num_pos += np.count_nonzero(y_class)
+
+    def result(self):
+        """
+        Returns:
+            - dictionary of metrics, where ce and mse are per sample
+        """
+        n = max(self.count, 1)
+        ss_tot = np.sum(self.target_stats.m2) if self.count > 0 else 0.
+        y_null = np.clip(self.target_sum / n, self.eps, 1 - self.eps)
+        null_ll = np.sum(self.target_sum * np.log(y_null)
+            + (self.count - self.target_sum) * np.log1p(-y_null))
+        num_outputs = np.size(self.target_sum)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tjur_r2 = (np.sum(self.pos_pred_sum) / np.sum(self.pos_count)
+                - np.sum(self.neg_pred_sum) / np.sum(self.neg_count))
+        return {
+            'ce': -self.ll / n,
+            'mse': self.sse / n,
+            'r2': 1 - self.sse / (ss_tot + 1e-8),
+            'll': self.ll,
+            'null_ll': null_ll,
+            'mcfadden_r2': 1 - self.ll / null_ll,
+            'tjur_r2': tjur_r2,
+            'acc': self.num_correct / float(max(n * num_outputs, 1)),
+            'precision': self.num_true_pos / float(max(self.num_pred_pos, 1)),
+            'recall': self.num_true_pos / float(max(self.num_pos, 1))
+        }
+
+class CurveAccumulator(object):
+
+    def __init__(self, num_targets, num_bins=1000):
+        """
+        Description:
+            - Accumulates histograms of the predicted probabilities of
+                positive and negative samples for each target, from which
+                ROC and precision-recall curves are computed with thresholds
+                at the bin edges.
+
+        Args:
+            - num_targets: number of binary targets
+            - num_bins: number of probability bins in [0, 1]
+        """
+        self.num_targets = num_targets
+        self.num_bins = num_bins
+        self.pos_hist = np.zeros((num_targets, num_bins))
+        self.neg_hist = np.zeros((num_targets, num_bins))
+
+    def update(self, y, probs, weights=None):
+        """
+        Description:
+            - Add a batch of labels and predicted probabilities.
+
+        Args:
+            - y: binary labels, shape = (batch_size, num_targets)
+            - probs: probability of the positive class,
+                shape = (batch_size, num_targets)
+            - weights: optional sample weights, shape = (batch_size,) or
+                (batch_size, 1)
+        """
+        y = np.asarray(y).reshape(len(y), -1) > .5
+        probs = np.asarray(probs, dtype=np.float64).reshape(len(y), -1)
+        bins = np.clip((probs * self.num_bins).astype(np.int64),
+            0, self.num_bins - 1)
+        # offset the bins of each target to histogram all targets at once
+        bins += np.arange(self.num_targets) * self.num_bins
+        if weights is None:
+            weights = np.ones(probs.shape)
+        else:
+            weights = np.broadcast_to(np.asarray(
+                weights, dtype=np.float64).reshape(len(y), -1), probs.shape)
+        size = self.num_targets * self.num_bins
+        self.pos_hist += np.bincount(bins[y], weights=weights[y],
+            minlength=size).reshape(self.num_targets, self.num_bins)
+        self.neg_hist += np.bincount(bins[~y], weights=weights[~y],
+            minlength=size).reshape(self.num_targets, self.num_bins)
+
+    def _cumulative_counts(self, tidx):
+        # counts of samples predicted positive at decreasing thresholds
+        tp = np.hstack(([0], np.cumsum(self.pos_hist[tidx, ::-1])))
+        fp = np.hstack(([0], np.cumsum(self.neg_hist[tidx, ::-1])))
+        return tp, fp
+
+    def roc_curve(self, tidx):
+        """
+        Returns:
+            - fpr, tpr: false and true positive rates at decreasing thresholds
+            - auc: area under the curve
+        """
+        tp, fp = self._cumulative_counts(tidx)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tpr = tp / tp[-1]
+            fpr = fp / fp[-1]
+        auc = np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2.)
+        return fpr, tpr, auc
+
+    def precision_recall_curve(self, tidx):
+        """
+        Returns:
+            - precision, recall: at decreasing thresholds
+            - avg_precision: average precision, the sum of precisions
+                weighted by the increase in recall
+        """
+        tp, fp = self._cumulative_counts(tidx)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            recall = tp / tp[-1]
+            precision = tp / (tp + fp)
+        precision[0] = 1.
+        valid = (tp + fp) > 0
+        precision[~valid] = 1.
+        avg_precision = np.sum(np.diff(recall) * precision[1:])
+        return precision, recall, avg_precision
@@ -0,0 +1,153 @@
+"""
+Checkpointing from a background thread
+"""
+import os
+import threading
+import time
+
+import tensorflow as tf
+
+class CheckpointManager(object):
+
+    def __init__(self, session, snapshot_dir, var_list=None,
+            min_interval=0., max_to_keep=100,
+            keep_checkpoint_every_n_hours=.5, filename='weights'):
+        """
+        Description:
+            - Writes checkpoints of the variables of a session from a
+                background thread. The values of the variables are fetched in
+                the calling thread, so that each checkpoint is a consistent
+                snapshot, and are then written by a saver in a separate graph
+                and session, so that training continues while the checkpoint
+                is written. Checkpoints use the names of the original
+                variables, so they restore with a tf.train.Saver of the
+                original graph.
+
+                Saves are rate limited to one per min_interval seconds, and
+                if a save is requested while another is being written, only
+                the most recent pending snapshot is kept. Old checkpoints are
+                pruned by the saver according to max_to_keep and
+                keep_checkpoint_every_n_hours.
+
+        Args:
+            - session: the session of the variables to save
+            - snapshot_dir: directory in which to write checkpoints
+            - var_list: variables to save, defaults to all global variables
+            - min_interval: minimum number of seconds between saves
+            - max_to_keep: number of recent checkpoints to keep
+            - keep_checkpoint_every_n_hours: additionally keep a checkpoint
+                every this many hours
+            - filename: prefix of the checkpoint files
+        """
+        self.session = session
+        self.snapshot_dir = snapshot_dir
+        self.filepath = os.path.join(snapshot_dir, filename)
+        self.var_list = var_list if var_list is not None else (
+            tf.global_variables())
+        self.min_interval = min_interval
+        self.last_save_time = None
+        self.num_saved = 0
+
+        # a copy of the variables in a separate graph, assigned before saving
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self._placeholders, self._assign_ops, variables = [], [], {}
+            for var in self.var_list:
+                ph = tf.placeholder(var.dtype.base_dtype, var.get_shape())
+                copy = tf.Variable(ph, name=var.op.name, trainable=False,
+                    collections=[])
+                self._placeholders.append(ph)
+                self._assign_ops.append(copy.initializer)
+                variables[var.op.name] = copy
+            self.saver = tf.train.Saver(variables, max_to_keep=max_to_keep,
+                keep_checkpoint_every_n_hours=keep_checkpoint_every_n_hours)
+        self._session = tf.Session(graph=self.graph)
+
+        # pending snapshot, written by the background thread
+        self._pending = None
+        self._writing = False
+        self._closed = False
+        self._exception = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def save(self, global_step, force=False):
+        """
+        Description:
+            - Snapshot the variables and queue them to be written, unless the
+                previous save was less than min_interval seconds ago.
+
+        Args:
+            - global_step: step with which to label the checkpoint
+            - force: save regardless of the time since the last save
+
+        Returns:
+            - whether a snapshot was queued
+        """
+        self._raise_if_failed()
+        now = time.time()
+        if (not force and self.last_save_time is not None
+                and now - self.last_save_time < self.min_interval):
+            return False
+        self.last_save_time = now
+        values = self.session.run(self.var_list)
+        with self._cond:
+            # replace a pending snapshot that has not started writing
+            self._pending = (global_step, values)
+            self._cond.notify_all()
+        return True
+
+    def wait(self):
+        """
+        Description:
+            - Block until all queued snapshots have been written.
+        """
+        with self._cond:
+            while self._pending is not None or self._writing:
+                self._cond.wait()
+        self._raise_if_failed()
+
+    def close(self):
+        """
+        Description:
+            - Write any queued snapshot and stop the background thread.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._session.close()
+        self._raise_if_failed()
+
+    def _raise_if_failed(self):
+        if self._exception is not None:
+            exception, self._exception = self._exception, None
+            raise exception
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                global_step, values = self._pending
+                self._pending = None
+                self._writing = True
+            try:
+                self._write(global_step, values)
+            except Exception as e:
+                self._exception = e
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+    def _write(self, global_step, values):
+        if not os.path.exists(self.snapshot_dir):
+            os.makedirs(self.snapshot_dir)
+        self._session.run(self._assign_ops,
+            feed_dict=dict(zip(self._placeholders, values)))
+        self.saver.save(self._session, self.filepath, global_step=global_step)
+        self.num_saved += 1
@@ -0,0 +1,58 @@
+"""
+A predictor scoring inputs with a frozen inference graph
+"""
+import numpy as np
+import tensorflow as tf
+
+class FrozenPredictor(object):
+
+    def __init__(self, filepath, batch_size=4096, session_config=None):
+        """
+        Description:
+            - Loads a frozen inference graph written by
+                utils.export_inference_graph into its own graph and session.
+                Since the graph only contains the network with constant
+                weights, loading does not require rebuilding the training
+                graph or restoring a checkpoint.
+
+        Args:
+            - filepath: filepath of the frozen graph
+            - batch_size: number of samples per session.run call
+            - session_config: optional tf.ConfigProto for the session
+        """
+        self.batch_size = batch_size
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(filepath, 'rb') as infile:
+            graph_def.ParseFromString(infile.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self._inputs, self._probs = tf.import_graph_def(graph_def,
+                return_elements=['inputs:0', 'probs:0'], name='')
+        self.session = tf.Session(graph=self.graph, config=session_config)
+        self.output_shape = tuple(self._probs.get_shape().as_list()[1:])
+
+    def predict(self, inputs):
+        """
+        Description:
+            - Predict output probabilities for a set of unnormalized inputs.
+
+        Args:
+            - inputs: input values to predict
+                shape = (?, input_dim)
+
+        Returns:
+            - probabilities, shape = (?, output_dim) for regression or
+                (?, output_dim, num_target_bins) for classification
+        """
+        num_samples = len(inputs)
+        outputs = np.empty((num_samples,) + self.output_shape,
+            dtype=np.float32)
+        for s in range(0, num_samples, self.batch_size):
+            e = s + self.batch_size
+            outputs[s:e] = self.session.run(
+                self._probs, feed_dict={self._inputs: inputs[s:e]})
+        return outputs
+
+    def close(self):
+        self.session.close()
@@ -2,12 +2,30 @@
 A feed-forward neural network class
 """
 import collections
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import os
 import tensorflow as tf
 import time
 
+from . import checkpoints
 from . import models
+from . import profiling
+
+def timed_iterator(iterable, timings, key):
+    """
+    Description:
+        - Iterate, adding the time spent waiting on each item to timings[key].
+    """
+    iterator = iter(iterable)
+    while True:
+        st = time.time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        timings[key] += time.time() - st
+        yield item
 
 class NeuralNetworkPredictor(object):
 
@@ -27,14 +45,32 @@ class NeuralNetworkPredictor(object):
 
         # saving and logging setup
         self.saver = tf.train.Saver(
-            max_to_keep=100, keep_checkpoint_every_n_hours=.5)
+            max_to_keep=self.flags.max_checkpoints_to_keep, 
+            keep_checkpoint_every_n_hours=.5)
+        # in a cluster, only the chief writes checkpoints
+        self.is_chief = self.flags.task_index == 0
+        self.checkpoints = None
+        if self.flags.async_checkpoints and self.is_chief:
+            self.checkpoints = checkpoints.CheckpointManager(
+                self.session, 
+                self.flags.snapshot_dir, 
+                min_interval=self.flags.save_weights_min_interval,
+                max_to_keep=self.flags.max_checkpoints_to_keep, 
+                keep_checkpoint_every_n_hours=.5)
+        self.last_save_time = None
+        # summaries are queued and written in batches by the writers
         self.train_writer = tf.summary.FileWriter(
             os.path.join(self.flags.summary_dir, 'train'), 
-            self.session.graph)
+            self.session.graph,
+            max_queue=self.flags.summary_max_queue,
+            flush_secs=self.flags.summary_flush_secs)
         self.test_writer = tf.summary.FileWriter(
             os.path.join(self.flags.summary_dir, 'val'), 
-            self.session.graph)
+            self.session.graph,
+            max_queue=self.flags.summary_max_queue,
+            flush_secs=self.flags.summary_flush_secs)
         self.info = collections.defaultdict(list)
+        self.step = 0
 
     def fit(self, dataset):
         """
@@ -54,18 +90,32 @@ class NeuralNetworkPredictor(object):
         # fit the model to the dataset over a number of epochs
         for epoch in range(self.flags.num_epochs):
             train_loss, val_loss = 0, 0
-
-            # train epoch
-            for bidx, batch in enumerate(dataset.next_batch(validation=False)):
-                train_loss += self._run_batch(epoch, bidx, batch, validation=False)
+            num_train, num_val = 0, 0
+
+            # train epoch, timing each phase of processing a batch
+            timings = collections.defaultdict(float)
+            batches = timed_iterator(
+                dataset.next_batch(validation=False), timings, 'fetch')
+            # prioritized datasets sample by the losses of their batches
+            update_priorities = (dataset.update_losses 
+                if self.flags.use_priority else None)
+            for bidx, batch in enumerate(batches):
+                train_loss += self._run_batch(epoch, bidx, batch, 
+                    validation=False, timings=timings, 
+                    update_priorities=update_priorities)
+                num_train += len(batch[0])
             
             # validation epoch
             for bidx, batch in enumerate(dataset.next_batch(validation=True)):
                 val_loss += self._run_batch(epoch, bidx, batch, validation=True)
+                num_val += len(batch[0])
+
+            profile = self.profile(epoch, num_train, timings)
 
             # print out progress if verbose
             if self.flags.verbose:
-                self.log(epoch, dataset, train_loss, val_loss)
+                self.log(epoch, num_train, num_val, train_loss, val_loss, 
+                    profile)
 
             # snapshot network
             self.save(epoch)
@@ -73,12 +123,21 @@ class NeuralNetworkPredictor(object):
             # update hyperparameters
             self.update()
 
-    def _run_batch(self, epoch, bidx, batch, validation):
+        # finish writing snapshots and summaries
+        self.flush()
+
+    def _run_batch(self, epoch, bidx, batch, validation, timings=None, 
+            update_priorities=None):
+        st = time.time()
         feed_dict = {}
 
-        if self.flags.use_likelihood_weights:
-            x, y, w = batch 
-            feed_dict[self._weights_ph] = w
+        if self.flags.use_likelihood_weights or self.flags.use_priority:
+            # prioritized datasets only weight training batches
+            x, y = batch[:2]
+            if len(batch) > 2:
+                feed_dict[self._weights_ph] = batch[2]
+            else:
+                feed_dict[self._weights_ph] = np.ones((len(x), 1))
         else:
             x, y = batch
 
@@ -92,20 +151,47 @@ class NeuralNetworkPredictor(object):
         outputs_list = [self._summary_op, self._loss]
         if not validation:
             outputs_list += [self._train_op]
-        fetched = self.session.run(outputs_list, feed_dict=feed_dict)
+        if update_priorities is not None:
+            outputs_list += [self._sample_losses]
+
+        # optionally trace the execution of the graph
+        kwargs = {}
+        trace = (not validation and self.flags.trace_every > 0 
+            and self.step % self.flags.trace_every == 0)
+        if trace:
+            kwargs['options'] = tf.RunOptions(
+                trace_level=tf.RunOptions.FULL_TRACE)
+            kwargs['run_metadata'] = tf.RunMetadata()
+        feed_time = time.time()
+
+        fetched = self.session.run(outputs_list, feed_dict=feed_dict, **kwargs)
+        run_time = time.time()
 
         if validation:
-            summary, loss = fetched
+            summary, loss = fetched[:2]
         else:
-            summary, loss, _ = fetched
+            summary, loss, _ = fetched[:3]
+        if update_priorities is not None:
+            update_priorities(fetched[-1])
 
         if bidx % self.flags.log_summaries_every == 0:
             writer = self.test_writer if validation else self.train_writer
             writer.add_summary(summary, epoch)
+        if trace:
+            self.train_writer.add_run_metadata(kwargs['run_metadata'], 
+                'step_{}'.format(self.step))
+        if not validation:
+            self.step += 1
+
+        if timings is not None:
+            timings['feed'] += feed_time - st
+            timings['run'] += run_time - feed_time
+            timings['summary'] += time.time() - run_time
 
         return loss
 
-    def predict(self, inputs, predict_labels=False):
+    def predict(self, inputs, predict_labels=False, batch_size=None, 
+            num_threads=None):
         """
         Description:
             - Predict output values for a set of inputs.
@@ -113,72 +199,169 @@ class NeuralNetworkPredictor(object):
         Args:
             - inputs: input values to predict
                 shape = (?, input_dim)
+            - predict_labels: whether to also return the argmax labels
+            - batch_size: number of samples per session.run call, 
+                defaults to flags.inference_batch_size
+            - num_threads: number of session.run calls in flight at once,
+                defaults to flags.inference_threads
 
         Returns:
             - returns probability values for each output.
         """
         num_samples = len(inputs)
-        outputs = np.empty((num_samples, self.flags.output_dim))
-        if predict_labels:
-            pred_y = np.empty((num_samples, self.flags.output_dim))
-        num_batches = int(num_samples / self.flags.batch_size)
-        if num_batches * self.flags.batch_size < num_samples:
-            num_batches += 1
-        for bidx in range(num_batches):
-            s = bidx * self.flags.batch_size
-            e = s + self.flags.batch_size
-            batch = inputs[s:e]
-            outputs[s:e, :] = self.session.run(
-                self._probs, feed_dict={self._input_ph: inputs[s:e],
-                self._dropout_ph: 1.})
-            if predict_labels:
-                pred_y[s:e, :] = np.argmax(outputs[s:e, :], axis=-1).reshape(-1,1)
+        outputs = np.empty((num_samples, self.flags.output_dim), 
+            dtype=np.float32)
+        self._predict_probs(inputs, outputs, batch_size, num_threads)
         if predict_labels:
+            pred_y = np.empty((num_samples, self.flags.output_dim), 
+                dtype=np.float32)
+            pred_y[:] = np.argmax(outputs, axis=-1).reshape(-1, 1)
             return pred_y, outputs
         else:
             return outputs
 
+    def _predict_probs(self, inputs, outputs, batch_size=None, 
+            num_threads=None):
+        """
+        Description:
+            - Fill the preallocated outputs with the probabilities of the 
+                network for inputs. Dropout defaults to keeping all units, so
+                only the inputs are fed. With more than one thread, batches 
+                are run concurrently, since session.run releases the GIL.
+
+        Args:
+            - inputs: input values to predict
+            - outputs: array to fill, first dimension matching inputs
+            - batch_size: number of samples per session.run call
+            - num_threads: number of session.run calls in flight at once
+
+        Returns:
+            - outputs
+        """
+        if batch_size is None:
+            batch_size = self.flags.inference_batch_size
+        if num_threads is None:
+            num_threads = self.flags.inference_threads
+        starts = list(range(0, len(inputs), batch_size))
+
+        def run_batch(s):
+            e = s + batch_size
+            outputs[s:e] = self.session.run(
+                self._probs, feed_dict={self._input_ph: inputs[s:e]})
+
+        if num_threads > 1 and len(starts) > 1:
+            pool = ThreadPool(num_threads)
+            try:
+                pool.map(run_batch, starts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for s in starts:
+                run_batch(s)
+        return outputs
+
     def save(self, epoch):
         """
         Description:
-            - Save the session and network parameters to checkpoint file.
+            - Save the session and network parameters to checkpoint file,
+                every save_weights_every epochs and at most once per
+                save_weights_min_interval seconds. With async_checkpoints,
+                the file is written by a background thread.
 
         Args:
             - epoch: epoch of save
         """
-        if epoch % self.flags.save_weights_every == 0:
-            if not os.path.exists(self.flags.snapshot_dir):
-                os.mkdir(self.flags.snapshot_dir)
-            filepath = os.path.join(self.flags.snapshot_dir, 'weights')
-            self.saver.save(self.session, filepath, global_step=epoch)
+        if not self.is_chief or epoch % self.flags.save_weights_every != 0:
+            return
+        if self.checkpoints is not None:
+            self.checkpoints.save(epoch)
+            return
+        now = time.time()
+        if (self.last_save_time is not None and now - self.last_save_time 
+                < self.flags.save_weights_min_interval):
+            return
+        self.last_save_time = now
+        if not os.path.exists(self.flags.snapshot_dir):
+            os.mkdir(self.flags.snapshot_dir)
+        filepath = os.path.join(self.flags.snapshot_dir, 'weights')
+        self.saver.save(self.session, filepath, global_step=epoch)
+
+    def flush(self):
+        """
+        Description:
+            - Block until queued checkpoints and summaries are written.
+        """
+        if self.checkpoints is not None:
+            self.checkpoints.wait()
+        self.train_writer.flush()
+        self.test_writer.flush()
 
     def load(self):
         """
         Description:
             - Load the lastest checkpoint file if it exists.
         """
+        if self.checkpoints is not None:
+            self.checkpoints.wait()
         filepath = tf.train.latest_checkpoint(self.flags.snapshot_dir)
         if filepath is not None:
             self.saver.restore(self.session, filepath)
 
-    def log(self, epoch, dataset, train_loss, val_loss):
+    def profile(self, epoch, num_train, timings):
+        """
+        Description:
+            - Compute the throughput and memory use of a training epoch, 
+                write them as summaries and store them in self.info.
+
+        Args:
+            - epoch: training epoch
+            - num_train: number of training samples seen in the epoch
+            - timings: seconds spent in each phase of processing batches
+
+        Returns:
+            - profile: dictionary of the seconds spent in each phase, 
+                samples per second, and peak resident memory in megabytes
+        """
+        profile = dict(('{}_sec'.format(k), v) for (k, v) in timings.items())
+        profile['samples_per_sec'] = num_train / max(sum(timings.values()), 
+            1e-8)
+        profile['peak_rss_mb'] = profiling.peak_rss_mb()
+
+        summary = tf.Summary(value=[
+            tf.Summary.Value(tag='profile/{}'.format(k), simple_value=v) 
+            for (k, v) in sorted(profile.items())])
+        self.train_writer.add_summary(summary, epoch)
+        for (k, v) in profile.items():
+            self.info[k].append(v)
+        return profile
+
+    def log(self, epoch, num_train, num_val, train_loss, val_loss, 
+            profile=None):
         """
         Description:
             - Log training information to console
 
         Args:
             - epoch: training epoch
-            - dataset: dataset used for training
+            - num_train: number of training samples seen in the epoch
+            - num_val: number of validation samples seen in the epoch
             - train_loss: total training loss of the epoch
             - val_loss: total validation loss of the epoch
+            - profile: optional output of profile to display
         """
         self.info['val_loss'].append(val_loss)
-        num_train = max(len(dataset.data['x_train']), 1)
-        train_loss /= num_train
-        num_val = max(len(dataset.data['x_val']), 1)
-        val_loss /= num_val
+        train_loss /= max(num_train, 1)
+        val_loss /= max(num_val, 1)
         print('epoch: {}\ttrain loss: {:.6f}\tval loss: {:.6f}\ttime: {:.4f}'.format(
             epoch, train_loss, val_loss, time.time() - self.start_time))
+        if profile is not None:
+            phases = ['fetch', 'feed', 'run', 'summary']
+            print('samples/sec: {:.1f}\t{}\tpeak rss: {:.1f}MB'.format(
+                profile['samples_per_sec'],
+                '\t'.join('{}: {:.3f}s'.format(p, profile.get(p + '_sec', 0.)) 
+                    for p in phases),
+                profile['peak_rss_mb']))
 
     def update(self):
 
@@ -215,7 +398,7 @@ class NeuralNetworkPredictor(object):
             self._input_ph, self._dropout_ph)
 
         # loss
-        self._loss, self._probs = self._build_loss(
+        self._loss, self._probs, self._sample_losses = self._build_loss(
             self._scores, self._target_ph, self._weights_ph)
 
         # train operation
@@ -224,8 +407,14 @@ class NeuralNetworkPredictor(object):
         # summaries
         self._summary_op = tf.summary.merge_all()
 
-        # intialize the model
-        self.session.run(tf.global_variables_initializer())
+        # intialize the model, in a cluster the chief initializes the shared
+        # variables and the other workers wait until it has done so
+        if self.flags.task_index == 0:
+            self.session.run(tf.global_variables_initializer())
+        else:
+            uninitialized = tf.report_uninitialized_variables()
+            while len(self.session.run(uninitialized)) > 0:
+                time.sleep(.5)
 
     def _build_placeholders(self):
         """
@@ -252,7 +441,8 @@ class NeuralNetworkPredictor(object):
         weights_ph = tf.placeholder(tf.float32,
                 shape=(None, 1),
                 name="weights_ph")
-        dropout_ph = tf.placeholder(tf.float32,
+        # dropout defaults to keeping all units so prediction need not feed it
+        dropout_ph = tf.placeholder_with_default(1.,
                 shape=(),
                 name="dropout_ph")
         lr_ph = tf.placeholder(tf.float32, 
@@ -302,6 +492,8 @@ class NeuralNetworkPredictor(object):
 
         Returns:
             - symbolic loss value
+            - probabilities of the targets
+            - unweighted loss of each sample, shape = (batch_size,)
         """
 
         # create op for probability to use in 'predict'
@@ -324,8 +516,10 @@ class NeuralNetworkPredictor(object):
             raise(ValueError("invalid loss type: {}".format(
                 self.flags.loss_type)))
 
+        sample_losses = tf.reduce_sum(losses, axis=1)
+
         # multiply in weights
-        if self.flags.use_likelihood_weights:
+        if self.flags.use_likelihood_weights or self.flags.use_priority:
             losses = losses * weights
 
         # reduce accross batch 
@@ -347,7 +541,7 @@ class NeuralNetworkPredictor(object):
         tf.summary.scalar('loss', loss)
         tf.summary.scalar('l2_reg_loss', reg_loss)
 
-        return loss, probs
+        return loss, probs, sample_losses
 
     def _build_train_op(self, loss, learning_rate):
         """
@@ -387,7 +581,8 @@ class NeuralNetworkClassifier(NeuralNetworkPredictor):
         """
         super(NeuralNetworkClassifier, self).__init__(session, flags)
 
-    def predict(self, inputs, predict_labels=True):
+    def predict(self, inputs, predict_labels=True, batch_size=None, 
+            num_threads=None):
         """
         Description:
             - Predict output values for a set of inputs.
@@ -395,27 +590,25 @@ class NeuralNetworkClassifier(NeuralNetworkPredictor):
         Args:
             - inputs: input values to predict
                 shape = (?, input_dim)
+            - predict_labels: whether to also return the class predictions,
+                if False only the probabilities are returned
+            - batch_size: number of samples per session.run call, 
+                defaults to flags.inference_batch_size
+            - num_threads: number of session.run calls in flight at once,
+                defaults to flags.inference_threads
 
         Returns:
             - returns class predictions for each target for each sample.
         """
         num_samples = len(inputs)
-        pred_y = np.empty((num_samples, self.flags.output_dim))
         pred_probs = np.empty((num_samples, self.flags.output_dim, 
-            self.flags.num_target_bins))
-        num_batches = int(num_samples / self.flags.batch_size)
-        if num_batches * self.flags.batch_size < num_samples:
-            num_batches += 1
-        for bidx in range(num_batches):
-            s = bidx * self.flags.batch_size
-            e = s + self.flags.batch_size
-            batch = inputs[s:e]
-            probs = self.session.run(
-                self._probs, feed_dict={self._input_ph: inputs[s:e],
-                self._dropout_ph: 1.})
-            pred_y[s:e, :] = np.argmax(probs, axis=-1)
-            pred_probs[s:e, :, :] = probs
-        return pred_y, pred_probs
+            self.flags.num_target_bins), dtype=np.float32)
+        self._predict_probs(inputs, pred_probs, batch_size, num_threads)
+        if predict_labels:
+            pred_y = np.argmax(pred_probs, axis=-1).astype(np.float32)
+            return pred_y, pred_probs
+        else:
+            return pred_probs
 
     def _build_placeholders(self):
         """
@@ -453,6 +646,8 @@ class NeuralNetworkClassifier(NeuralNetworkPredictor):
 
         Returns:
             - symbolic loss value
+            - probabilities of the target classes
+            - unweighted loss of each sample, shape = (batch_size,)
         """
         # shape to allow for per-target softmax
         scores = tf.reshape(
@@ -473,9 +668,10 @@ class NeuralNetworkClassifier(NeuralNetworkPredictor):
 
         # reduce over target
         loss = tf.reduce_sum(losses, axis=-1)
+        sample_losses = loss
 
-        if self.flags.use_likelihood_weights:
-            loss = loss * weights
+        if self.flags.use_likelihood_weights or self.flags.use_priority:
+            loss = loss * tf.reshape(weights, (-1,))
 
         # reduce over batch 
         loss = tf.reduce_sum(loss, axis=0)
@@ -489,4 +685,4 @@ class NeuralNetworkClassifier(NeuralNetworkPredictor):
         tf.summary.scalar('loss', loss)
         tf.summary.scalar('l2 reg loss', reg_loss)
 
-        return loss, probs
\ No newline at end of file
+        return loss, probs, sample_losses
\ No newline at end of file
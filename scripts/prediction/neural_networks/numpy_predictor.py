@@ -0,0 +1,156 @@
+"""
+A feed-forward network evaluated with numpy, without tensorflow
+"""
+import h5py
+import numpy as np
+import re
+
+def _layer_index(scope):
+    # fully_connected, fully_connected_1, ..., fully_connected_10
+    match = re.match(r'^fully_connected(?:_(\d+))?$', scope)
+    if match is None:
+        raise ValueError('invalid layer in weight file: {}'.format(scope))
+    return 0 if match.group(1) is None else int(match.group(1))
+
+def load_weight_file(filepath):
+    """
+    Description:
+        - Load the layers and normalization statistics of a feed forward
+            network from a file written by utils.save_trainable_variables.
+
+    Args:
+        - filepath: hdf5 filepath of the weight file
+
+    Returns:
+        - layers: list of (weights, biases) tuples in order of application
+        - means: input means, or None if not stored
+        - stds: input std devs, or None if not stored
+    """
+    with h5py.File(filepath, 'r') as infile:
+        # order numerically, since the lexical order places
+        # fully_connected_10 before fully_connected_2
+        group = infile['weights']
+        layers = []
+        for scope in sorted(group.keys(), key=_layer_index):
+            layers.append((group[scope]['weights:0'][()],
+                group[scope]['biases:0'][()]))
+
+        means, stds = None, None
+        if 'stats' in infile:
+            means = infile['stats']['means'][()]
+            stds = infile['stats']['stds'][()]
+    return layers, means, stds
+
+def fold_normalization(layers, means, stds):
+    """
+    Description:
+        - Fold input normalization, (x - means) / stds, into the first layer,
+            such that the folded network applies to unnormalized inputs.
+
+    Args:
+        - layers: list of (weights, biases) tuples
+        - means: input means, shape = (input_dim,)
+        - stds: input std devs, shape = (input_dim,)
+
+    Returns:
+        - layers: list of (weights, biases) with the first layer folded
+    """
+    weights, biases = layers[0]
+    weights = np.asarray(weights, dtype=np.float64)
+    scale = 1. / np.asarray(stds, dtype=np.float64).reshape(-1)
+    shift = -np.asarray(means, dtype=np.float64).reshape(-1) * scale
+    folded = (weights * scale.reshape(-1, 1), biases + np.dot(shift, weights))
+    return [folded] + list(layers[1:])
+
+class NumpyPredictor(object):
+
+    def __init__(self, filepath, task_type='regression', loss_type='ce',
+            num_target_bins=None, batch_size=4096):
+        """
+        Description:
+            - Loads a feed forward network from a julia weight file and
+                evaluates it in float32 with numpy. The stored means and stds
+                are folded into the first layer, so inputs are unnormalized.
+
+        Args:
+            - filepath: hdf5 filepath of the weight file
+            - task_type: 'regression' (sigmoid outputs) or 'classification'
+                (per-target softmax outputs)
+            - loss_type: the loss the network was trained with,
+                'mse_log_probs' networks output exp(scores)
+            - num_target_bins: number of classes per target, for
+                classification
+            - batch_size: number of samples evaluated at a time
+        """
+        self.task_type = task_type
+        self.loss_type = loss_type
+        self.num_target_bins = num_target_bins
+        self.batch_size = batch_size
+
+        layers, means, stds = load_weight_file(filepath)
+        if means is not None:
+            layers = fold_normalization(layers, means, stds)
+        self.weights = [np.ascontiguousarray(w, dtype=np.float32)
+            for (w, _) in layers]
+        self.biases = [np.asarray(b, dtype=np.float32) for (_, b) in layers]
+        self.input_dim = self.weights[0].shape[0]
+
+        if task_type == 'classification':
+            self.output_shape = (self.weights[-1].shape[1] // num_target_bins,
+                num_target_bins)
+        else:
+            self.output_shape = (self.weights[-1].shape[1],)
+
+        # buffers for the activations of each layer, allocated a single time
+        self._buffers = [np.empty((batch_size, w.shape[1]), dtype=np.float32)
+            for w in self.weights]
+
+    def _forward(self, x):
+        num_samples = len(x)
+        state = np.asarray(x, dtype=np.float32)
+        for (lidx, (w, b)) in enumerate(zip(self.weights, self.biases)):
+            out = self._buffers[lidx][:num_samples]
+            np.dot(state, w, out=out)
+            out += b
+            if lidx < len(self.weights) - 1:
+                np.maximum(out, 0, out=out)
+            state = out
+        return state
+
+    def _probs(self, scores):
+        if self.task_type == 'classification':
+            scores = scores.reshape((-1,) + self.output_shape)
+            scores -= np.max(scores, axis=-1, keepdims=True)
+            np.exp(scores, out=scores)
+            scores /= np.sum(scores, axis=-1, keepdims=True)
+        elif self.loss_type == 'mse_log_probs':
+            np.exp(scores, out=scores)
+        else:
+            # in place sigmoid, exp overflow yields the correct limit of 0
+            with np.errstate(over='ignore'):
+                np.negative(scores, out=scores)
+                np.exp(scores, out=scores)
+                scores += 1
+                np.reciprocal(scores, out=scores)
+        return scores
+
+    def predict(self, inputs):
+        """
+        Description:
+            - Predict output probabilities for a set of unnormalized inputs.
+
+        Args:
+            - inputs: input values to predict
+                shape = (?, input_dim)
+
+        Returns:
+            - probabilities, shape = (?, output_dim) for regression or
+                (?, output_dim, num_target_bins) for classification
+        """
+        num_samples = len(inputs)
+        outputs = np.empty((num_samples,) + self.output_shape,
+            dtype=np.float32)
+        for s in range(0, num_samples, self.batch_size):
+            e = s + self.batch_size
+            outputs[s:e] = self._probs(self._forward(inputs[s:e]))
+        return outputs
@@ -0,0 +1,8 @@
+"""
+Helpers for measuring the resource use of fitting models.
+"""
+import resource
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
@@ -1,8 +1,11 @@
 
 import h5py
 import numpy as np
+import os
 import tensorflow as tf
 
+from .numpy_predictor import fold_normalization
+
 def compute_n_batches(n_samples, batch_size):
     n_batches = n_samples // batch_size
     if n_samples % batch_size != 0:
@@ -48,4 +51,79 @@ def save_trainable_variables(output_filepath, session, data=None):
         stats_group['means'] = data['means']
         stats_group['stds'] = data['stds']
         
-    weight_file.close()
\ No newline at end of file
+    weight_file.close()
+
+def get_feed_forward_layers(session):
+    """
+    Description:
+        - Evaluate the weights and biases of a feed forward network built 
+            from fully connected layers (see models.build_feed_forward_network).
+
+    Args:
+        - session: tensorflow session to use in evaluating the weights
+
+    Returns:
+        - layers: list of (weights, biases) tuples in order of application
+    """
+    variables = tf.trainable_variables()
+    layers = []
+    for (weights, biases) in zip(variables[::2], variables[1::2]):
+        scope = weights.name.rsplit('/', 1)[0]
+        if (not scope.startswith('fully_connected')
+                or weights.name != scope + '/weights:0'
+                or biases.name != scope + '/biases:0'):
+            raise ValueError('only networks of fully connected layers can be '
+                'exported, found: {} {}'.format(weights.name, biases.name))
+        layers.append(tuple(session.run([weights, biases])))
+    if len(variables) % 2 != 0 or len(layers) == 0:
+        raise ValueError('invalid number of trainable variables: {}'.format(
+            len(variables)))
+    return layers
+
+def export_inference_graph(output_filepath, session, flags, data=None):
+    """
+    Description:
+        - Write a frozen, inference-only graph of a feed forward network. 
+            Weights are stored as constants, normalization is folded into the 
+            first layer, and dropout, loss, optimizer and summary ops are 
+            left out. The graph takes inputs at 'inputs:0' and outputs 
+            probabilities at 'probs:0', see FrozenPredictor.
+
+    Args:
+        - output_filepath: string filepath where to save the graph
+        - session: tensorflow session to use in evaluating the weights
+        - flags: network options, uses task_type, loss_type, output_dim 
+            and num_target_bins
+        - data: if provided, the 'means' and 'stds' with which inputs were 
+            normalized are folded into the first layer
+    """
+    layers = get_feed_forward_layers(session)
+    if data is not None:
+        layers = fold_normalization(layers, data['means'], data['stds'])
+
+    graph = tf.Graph()
+    with graph.as_default():
+        input_dim = layers[0][0].shape[0]
+        hidden = tf.placeholder(tf.float32, shape=(None, input_dim), 
+            name='inputs')
+        for (lidx, (weights, biases)) in enumerate(layers):
+            hidden = tf.nn.xw_plus_b(hidden, 
+                tf.constant(weights, dtype=tf.float32), 
+                tf.constant(biases, dtype=tf.float32))
+            if lidx < len(layers) - 1:
+                hidden = tf.nn.relu(hidden)
+
+        # output probabilities as computed in the predictor's loss
+        if flags.task_type == 'classification':
+            scores = tf.reshape(
+                hidden, (-1, flags.output_dim, flags.num_target_bins))
+            probs = tf.nn.softmax(scores, dim=-1)
+        elif flags.loss_type == 'mse_log_probs':
+            probs = tf.exp(hidden)
+        else:
+            probs = tf.sigmoid(hidden)
+        tf.identity(probs, name='probs')
+
+    output_dir, filename = os.path.split(os.path.abspath(output_filepath))
+    tf.train.write_graph(graph.as_graph_def(), output_dir, filename, 
+        as_text=False)
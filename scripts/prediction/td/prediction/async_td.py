@@ -1,6 +1,7 @@
 from __future__ import print_function
+import collections
 from collections import namedtuple
-import copy
+import itertools
 import logging
 import numpy as np
 np.set_printoptions(precision=6, suppress=True)
@@ -8,6 +9,7 @@ import six.moves.queue as queue
 import scipy.signal
 import tensorflow as tf
 import threading
+import time
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -15,8 +17,11 @@ logger.setLevel(logging.INFO)
 from . import model
 from . import build_envs
 
-def discount(x, gamma):
-    return scipy.signal.lfilter([1], [1, -gamma], x[::-1], axis=0)[::-1]
+def discount(x, gamma, axis=0):
+    # reverse along axis by slicing, np.flip requires numpy >= 1.12
+    reverse = (slice(None),) * axis + (slice(None, None, -1),)
+    return scipy.signal.lfilter(
+        [1], [1, -gamma], x[reverse], axis=axis)[reverse]
 
 def process_rollout(rollout, gamma):
     """
@@ -25,7 +30,7 @@ def process_rollout(rollout, gamma):
     batch_si = np.asarray(rollout.states)
     rewards = np.asarray(rollout.rewards)
     batch_w = np.asarray(rollout.weights)
-    rewards_plus_v = np.asarray(rollout.rewards + [rollout.r])
+    rewards_plus_v = np.vstack((rewards, rollout.r))
     batch_r = discount(rewards_plus_v, gamma)[:-1]
 
     features = rollout.features[0]
@@ -33,6 +38,38 @@ def process_rollout(rollout, gamma):
 
 Batch = namedtuple("Batch", ["si", "r", "w", "terminal", "features"])
 
+def process_rollouts(rollouts, gamma):
+    """
+    given a list of rollouts, pad them to a common length and compute their 
+    returns in a single vectorized pass
+    """
+    num_rollouts = len(rollouts)
+    lengths = np.array([len(r.states) for r in rollouts], dtype=np.int32)
+    max_length = np.max(lengths)
+    first = rollouts[0]
+    obs_shape = np.shape(first.states)[1:]
+    value_dim = np.shape(first.r)[-1]
+
+    batch_si = np.zeros((num_rollouts, max_length) + obs_shape, np.float32)
+    batch_w = np.zeros((num_rollouts, max_length), np.float32)
+    # the bootstrap value follows the last reward of each rollout, and the 
+    # zeros after it do not contribute to the discounted returns
+    rewards_plus_v = np.zeros((num_rollouts, max_length + 1, value_dim), 
+        np.float32)
+    for (i, r) in enumerate(rollouts):
+        batch_si[i, :lengths[i]] = r.states
+        batch_w[i, :lengths[i]] = r.weights
+        rewards_plus_v[i, :lengths[i]] = r.rewards
+        rewards_plus_v[i, lengths[i]] = r.r
+    batch_r = discount(rewards_plus_v, gamma, axis=1)[:, :-1]
+
+    c = np.concatenate([r.features[0][0] for r in rollouts], axis=0)
+    h = np.concatenate([r.features[0][1] for r in rollouts], axis=0)
+    return SequenceBatch(batch_si, batch_r, batch_w, lengths, [c, h])
+
+SequenceBatch = namedtuple("SequenceBatch", 
+    ["si", "r", "w", "lengths", "features"])
+
 class PartialRollout(object):
     """
     a piece of a complete rollout.  We run our agent, and process its experience
@@ -53,13 +90,124 @@ class PartialRollout(object):
         self.terminal = terminal
         self.features += [features]
 
+class RolloutBuffer(object):
+    """
+    a piece of a complete rollout, like PartialRollout, but stored in float32
+    arrays preallocated to hold capacity steps and written in place. The 
+    states, rewards and weights are views of the steps added since reset.
+    """
+    def __init__(self, capacity, obs_shape, value_dim=5):
+        self.capacity = capacity
+        self._states = np.empty((capacity,) + tuple(obs_shape), np.float32)
+        self._rewards = np.empty((capacity, value_dim), np.float32)
+        self._weights = np.empty(capacity, np.float32)
+        self._features = None
+        self.r = np.zeros(value_dim, np.float32)
+        self.terminal = False
+        self.length = 0
+
+    def reset(self, features):
+        """
+        start a new rollout from the given initial lstm features
+        """
+        if self._features is None:
+            self._features = [np.empty(np.shape(f), np.float32) 
+                for f in features]
+        for (dst, src) in zip(self._features, features):
+            dst[...] = src
+        self.r[:] = 0.
+        self.terminal = False
+        self.length = 0
+
+    def add(self, state, reward, weight, terminal):
+        i = self.length
+        self._states[i] = state
+        self._rewards[i] = reward
+        self._weights[i] = weight
+        self.terminal = terminal
+        self.length += 1
+
+    @property
+    def states(self):
+        return self._states[:self.length]
+
+    @property
+    def rewards(self):
+        return self._rewards[:self.length]
+
+    @property
+    def weights(self):
+        return self._weights[:self.length]
+
+    @property
+    def features(self):
+        # only the initial features of a rollout are used
+        return [self._features]
+
+class MetricsAggregator(object):
+    """
+    averages the values of env info dicts over a window, and writes the 
+    averages as summaries at most every summary_every_secs seconds. The 
+    summaries are written at the global step last cached with 
+    set_global_step, which avoids a session.run per step, falling back to 
+    evaluating the global_step tensor before one has been cached.
+    """
+    def __init__(self, summary_writer, summary_every_secs=10., 
+            global_step=None):
+        self.summary_writer = summary_writer
+        self.summary_every_secs = summary_every_secs
+        self.global_step = global_step
+        self.cached_global_step = None
+        self._reset()
+
+    def _reset(self):
+        self.sums = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+        self.last_write_time = time.time()
+
+    def set_global_step(self, global_step):
+        self.cached_global_step = global_step
+
+    def add(self, info):
+        for k, v in info.items():
+            self.sums[k] += float(v)
+            self.counts[k] += 1
+        if time.time() - self.last_write_time >= self.summary_every_secs:
+            self.write()
+
+    def write(self):
+        """
+        write the averages since the last write, and start a new window
+        """
+        if len(self.sums) > 0:
+            global_step = self.cached_global_step
+            if global_step is None and self.global_step is not None:
+                global_step = self.global_step.eval()
+            summary = tf.Summary(value=[tf.Summary.Value(tag=k, 
+                simple_value=self.sums[k] / self.counts[k]) 
+                for k in sorted(self.sums)])
+            self.summary_writer.add_summary(summary, global_step)
+            self.summary_writer.flush()
+        self._reset()
+
 def env_runner(env, policy, num_local_steps, summary_writer, value_dim=5, 
-        verbose=True, visualize=True, visualize_every=1000):
+        verbose=True, visualize=True, visualize_every=1000, num_buffers=2, 
+        metrics=None):
     """
     The logic of the thread runner.  In brief, it constantly keeps on running
     the policy, and as long as the rollout exceeds a certain length, the thread
     runner appends the policy to the queue.
+
+    Rollouts are written into a ring of num_buffers preallocated buffers, 
+    so a yielded rollout remains valid until num_buffers - 1 further 
+    rollouts have been drawn.
+
+    The values of env infos are logged through metrics, a MetricsAggregator, 
+    by default one writing to summary_writer.
     """
+    if metrics is None:
+        metrics = MetricsAggregator(summary_writer, 
+            global_step=policy.global_step)
     last_state = env.reset()
     last_features = policy.get_initial_features()
     length = 0
@@ -67,10 +215,15 @@ def env_runner(env, policy, num_local_steps, summary_writer, value_dim=5,
     total_length = 0
     ep_count = 0
     rewards = np.zeros(value_dim)
+    buffers = [RolloutBuffer(num_local_steps, np.shape(last_state), value_dim)
+        for _ in range(num_buffers)]
+    rollout_count = 0
     
     while True:
         terminal_end = False
-        rollout = PartialRollout(value_dim=value_dim)
+        rollout = buffers[rollout_count % num_buffers]
+        rollout.reset(last_features)
+        rollout_count += 1
 
         for local_step in range(num_local_steps):
             features = policy.features(last_state, *last_features)
@@ -102,14 +255,8 @@ def env_runner(env, policy, num_local_steps, summary_writer, value_dim=5,
             if visualize and ep_count % visualize_every == 0:
                 env.render()
 
-            # collect the experience
-            # note that the deepcopies seem to be necessary
-            rollout.add(
-                copy.deepcopy(last_state), 
-                copy.deepcopy(reward), 
-                info['weight'], 
-                terminal, 
-                copy.deepcopy(last_features))
+            # collect the experience, copying it into the buffer
+            rollout.add(last_state, reward, info['weight'], terminal)
             
             length += 1
             rewards += reward
@@ -118,12 +265,7 @@ def env_runner(env, policy, num_local_steps, summary_writer, value_dim=5,
             last_features = features
 
             if info:
-                summary = tf.Summary()
-                for k, v in info.items():
-                    summary.value.add(tag=k, simple_value=float(v))
-                summary_writer.add_summary(summary, policy.global_step.eval())
-                summary_writer.flush()
-
+                metrics.add(info)
 
             timestep_limit = env.spec.tags.get(
                 'wrapper_config.TimeLimit.max_episode_steps')
@@ -147,11 +289,183 @@ def env_runner(env, policy, num_local_steps, summary_writer, value_dim=5,
                 break
 
         if not terminal_end:
-            rollout.r = policy.value(last_state, *last_features)
+            rollout.r[:] = policy.value(last_state, *last_features)
 
         # once we have enough experience, yield it
         yield rollout
 
+def vector_env_runner(envs, policy, num_local_steps, summary_writer, 
+        value_dim=5, verbose=True, visualize=True, visualize_every=1000, 
+        metrics=None):
+    """
+    Steps a list of environments in lockstep, advancing the lstm states of 
+    all of them with a single batched session.run per step. Experience is 
+    written into arrays stacked across environments, and after every 
+    num_local_steps steps the rollouts of all environments are yielded as a 
+    list. An environment whose episode ends within the steps contributes a 
+    terminal rollout up to the end of the episode, and a rollout from the 
+    start of its next episode. Env infos are logged as in env_runner.
+    """
+    if metrics is None:
+        metrics = MetricsAggregator(summary_writer, 
+            global_step=policy.global_step)
+    num_envs = len(envs)
+    last_states = np.array([env.reset() for env in envs], dtype=np.float32)
+    c, h = policy.get_initial_features_batch(num_envs)
+    timestep_limits = [env.spec.tags.get(
+        'wrapper_config.TimeLimit.max_episode_steps') for env in envs]
+    lengths = np.zeros(num_envs, dtype=int)
+    rewards = np.zeros((num_envs, value_dim))
+    total_rewards = np.zeros(value_dim)
+    total_length = 0
+    ep_count = 0
+
+    # experience of the current steps, stacked across environments
+    states = np.empty((num_envs, num_local_steps) + last_states.shape[1:], 
+        dtype=np.float32)
+    step_rewards = np.empty((num_envs, num_local_steps, value_dim), 
+        dtype=np.float32)
+    weights = np.empty((num_envs, num_local_steps), dtype=np.float32)
+
+    while True:
+        rollouts = []
+        # start index and initial lstm state of the rollout of each env
+        starts = np.zeros(num_envs, dtype=int)
+        c_starts, h_starts = np.copy(c), np.copy(h)
+
+        for local_step in range(num_local_steps):
+            next_c, next_h = policy.step(last_states, c, h)
+            states[:, local_step] = last_states
+
+            for (i, env) in enumerate(envs):
+                state, reward, terminal, info = env.step(None)
+                step_rewards[i, local_step] = reward
+                weights[i, local_step] = info['weight']
+                lengths[i] += 1
+                rewards[i] += reward
+                last_states[i] = state
+
+                if visualize and i == 0 and ep_count % visualize_every == 0:
+                    env.render()
+
+                if info:
+                    metrics.add(info)
+
+                if terminal or lengths[i] >= timestep_limits[i]:
+                    # the rollout of this env ends with the episode
+                    rollout = PartialRollout(value_dim=value_dim)
+                    s, e = starts[i], local_step + 1
+                    rollout.states = states[i, s:e].copy()
+                    rollout.rewards = step_rewards[i, s:e].copy()
+                    rollout.weights = weights[i, s:e].copy()
+                    rollout.terminal = True
+                    rollout.features = [[c_starts[i:i + 1].copy(), 
+                        h_starts[i:i + 1].copy()]]
+                    rollouts.append(rollout)
+
+                    if (lengths[i] >= timestep_limits[i] 
+                            or not env.metadata.get('semantics.autoreset')):
+                        last_states[i] = env.reset()
+                    next_c[i], next_h[i] = 0., 0.
+                    starts[i] = e
+                    c_starts[i], h_starts[i] = 0., 0.
+
+                    ep_count += 1
+                    total_rewards += rewards[i]
+                    total_length += lengths[i]
+                    if verbose:
+                        print("Episode finished\tSum of rewards: {}\tLength: {}\tAverage Rewards: {}\tAverage Length: {:.2f}".format(
+                            rewards[i], lengths[i], total_rewards / ep_count, 
+                            total_length / float(ep_count)))
+                    lengths[i] = 0
+                    rewards[i] = 0.
+
+            c, h = next_c, next_h
+
+        # bootstrap the unfinished rollouts from their values in one call
+        unfinished = np.where(starts < num_local_steps)[0]
+        if len(unfinished) > 0:
+            _, values = policy.step(last_states[unfinished], 
+                c[unfinished], h[unfinished], compute_value=True)
+        for (j, i) in enumerate(unfinished):
+            rollout = PartialRollout(value_dim=value_dim)
+            s = starts[i]
+            rollout.states = states[i, s:].copy()
+            rollout.rewards = step_rewards[i, s:].copy()
+            rollout.weights = weights[i, s:].copy()
+            rollout.r = values[j]
+            rollout.features = [[c_starts[i:i + 1].copy(), 
+                h_starts[i:i + 1].copy()]]
+            rollouts.append(rollout)
+
+        # once we have enough experience, yield it
+        yield rollouts
+
+class RunnerThread(threading.Thread):
+    """
+    Runs a rollout provider in a background thread that fills a bounded 
+    queue of rollouts, which the learner drains, so that simulating the 
+    environment overlaps with computing gradients. The provider yields 
+    lists of rollouts, and each rollout is queued with the value of 
+    get_version before its list was generated, so before the rollout was 
+    started, from which the learner computes its staleness.
+    """
+    def __init__(self, rollout_provider, queue_size, get_version):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.rollout_provider = rollout_provider
+        self.get_version = get_version
+        self.sess = None
+        self.stop_event = threading.Event()
+        # seconds the runner spent blocked on a full queue
+        self.blocked_time = 0.
+
+    def start_runner(self, sess):
+        self.sess = sess
+        self.start()
+
+    def run(self):
+        # the default session is thread local, and the policy uses it
+        with self.sess.as_default():
+            try:
+                while not self.stop_event.is_set():
+                    version = self.get_version()
+                    rollouts = next(self.rollout_provider)
+                    for rollout in rollouts:
+                        if not self._put((version, rollout)):
+                            return
+            except Exception as e:
+                self._put(e)
+
+    def _put(self, item):
+        # wake periodically so the thread exits once stopped
+        st = time.time()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(item, timeout=.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        finally:
+            self.blocked_time += time.time() - st
+
+    def get(self):
+        """
+        Returns the next (version, rollout), raising any exception of the 
+        runner.
+        """
+        item = self.queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
 class AsyncTD(object):
     def __init__(self, env, task, config):
         self.env = env
@@ -180,31 +494,50 @@ class AsyncTD(object):
                     env.observation_space.shape, config)
                 pi.global_step = self.global_step
 
-            self.r = tf.placeholder(tf.float32, [None, config.value_dim], name="r")
-            self.w = tf.placeholder(tf.float32, [None], name='sample_weights')
+            # the learner trains either on a single rollout, or on a batch 
+            # of rollouts padded to a common length, of which only the 
+            # valid steps contribute to the loss
+            self.batched = config.rollouts_per_update > 1
+            if self.batched:
+                self.r = tf.placeholder(tf.float32, 
+                    [None, None, config.value_dim], name="r")
+                self.w = tf.placeholder(tf.float32, [None, None], 
+                    name='sample_weights')
+                mask = tf.sequence_mask(pi.seq_lengths, 
+                    tf.shape(pi.x_batch)[1])
+                x = tf.boolean_mask(pi.x_batch, mask)
+                vf = tf.boolean_mask(pi.vf_batch, mask)
+                r = tf.boolean_mask(self.r, mask)
+                w = tf.boolean_mask(self.w, mask)
+            else:
+                self.r = tf.placeholder(tf.float32, [None, config.value_dim], 
+                    name="r")
+                self.w = tf.placeholder(tf.float32, [None], 
+                    name='sample_weights')
+                x, vf, r, w = pi.x, pi.vf, self.r, self.w
 
             # loss of value function
-            self.loss = self._build_loss()
+            self.loss = self._build_loss(vf, r, w)
 
             # grads
             grads = tf.gradients(self.loss, pi.var_list)
 
             # summaries
             ## input summaries
-            tf.summary.histogram("model/sample_weights", self.w[0])
-            tf.summary.scalar("model/sample_weights", self.w[0])
+            tf.summary.histogram("model/sample_weights", w[0])
+            tf.summary.scalar("model/sample_weights", w[0])
             if self.config.summarize_features:
                 for i, feature_name in enumerate(build_envs.get_obs_var_names(env)):
                     tf.summary.scalar("features/{}_value".format(
                         feature_name.encode('utf-8')), 
-                        tf.reduce_mean(pi.x[:,i]))
+                        tf.reduce_mean(x[:,i]))
 
             ## target and loss summaries
-            bs = tf.to_float(tf.shape(pi.x)[0])
-            mean_vf = tf.reduce_mean(pi.vf, axis=0)
+            bs = tf.to_float(tf.shape(x)[0])
+            mean_vf = tf.reduce_mean(vf, axis=0)
             if self.config.loss_type == 'ce':
                 mean_vf = tf.nn.sigmoid(mean_vf)
-            tf.summary.scalar("model/value_mean", tf.reduce_mean(pi.vf))
+            tf.summary.scalar("model/value_mean", tf.reduce_mean(vf))
             for i, target_name in enumerate(
                     build_envs.get_target_names(env, self.config.value_dim)):
                 tf.summary.scalar("model/vf_mean_{}".format(target_name), 
@@ -220,7 +553,7 @@ class AsyncTD(object):
                 for v1, v2 in zip(pi.var_list, self.network.var_list)])
 
             grads_and_vars = list(zip(grads, self.network.var_list))
-            inc_step = self.global_step.assign_add(tf.shape(pi.x)[0])
+            inc_step = self.global_step.assign_add(tf.shape(x)[0])
 
             # learning rate decay
             learning_rate = tf.train.polynomial_decay(
@@ -256,13 +589,93 @@ class AsyncTD(object):
             self.summary_op = tf.summary.merge_all()
 
     def start(self, sess, summary_writer):
-        self.rollout_provider = env_runner(self.env, self.local_network, 
-            self.config.local_steps_per_update, summary_writer, 
-            value_dim=self.config.value_dim, 
-            visualize=self.config.visualize and self.task == 0,
-            visualize_every=self.config.visualize_every)
+        # env infos are averaged and written periodically, at the global 
+        # step cached from the last update
+        self.metrics = MetricsAggregator(summary_writer, 
+            self.config.summary_every_secs, self.global_step)
+        num_envs = self.config.num_envs_per_worker
+        if num_envs > 1:
+            # step additional envs in lockstep with the one of this worker
+            envs = [self.env] + [build_envs.create_env(self.config) 
+                for _ in range(num_envs - 1)]
+            rollout_lists = vector_env_runner(envs, self.local_network, 
+                self.config.local_steps_per_update, summary_writer, 
+                value_dim=self.config.value_dim, 
+                visualize=self.config.visualize and self.task == 0,
+                visualize_every=self.config.visualize_every, 
+                metrics=self.metrics)
+        else:
+            # buffers alive at once: those queued, those collected for an 
+            # update and the one being filled
+            rollout_lists = ([rollout] for rollout in env_runner(self.env, 
+                self.local_network, self.config.local_steps_per_update, 
+                summary_writer, value_dim=self.config.value_dim, 
+                visualize=self.config.visualize and self.task == 0,
+                visualize_every=self.config.visualize_every,
+                num_buffers=(self.config.rollout_queue_size 
+                    + self.config.rollouts_per_update + 1), 
+                metrics=self.metrics))
+        self.rollout_provider = itertools.chain.from_iterable(rollout_lists)
         self.summary_writer = summary_writer
 
+        # optionally generate rollouts in a thread while training
+        self.runner = None
+        self.queue_metrics = collections.defaultdict(float)
+        self.queue_metrics_start = time.time()
+        if self.config.rollout_queue_size > 0:
+            self.runner = RunnerThread(rollout_lists, 
+                self.config.rollout_queue_size, lambda: self.local_steps)
+            self.runner.start_runner(sess)
+
+    def stop(self):
+        if self.runner is not None:
+            self.runner.stop()
+            self.runner = None
+        # write the env infos of the last partial window
+        self.metrics.write()
+
+    def _next_rollout(self):
+        """
+        Returns the next rollout, from the runner thread if there is one, 
+        skipping rollouts started more than max_rollout_staleness updates 
+        ago.
+        """
+        if self.runner is None:
+            return next(self.rollout_provider)
+
+        m = self.queue_metrics
+        while True:
+            m['occupancy'] += self.runner.queue.qsize()
+            m['num_gets'] += 1
+            st = time.time()
+            version, rollout = self.runner.get()
+            m['learner_idle_time'] += time.time() - st
+            staleness = self.local_steps - version
+            if staleness <= self.config.max_rollout_staleness:
+                m['staleness'] += staleness
+                m['num_used'] += 1
+                return rollout
+            m['num_stale'] += 1
+
+    def _queue_summary(self):
+        # averages of the queue metrics since the last summary
+        m = self.queue_metrics
+        elapsed = max(time.time() - self.queue_metrics_start, 1e-8)
+        values = {
+            'queue/occupancy': m['occupancy'] / max(m['num_gets'], 1),
+            'queue/capacity': self.config.rollout_queue_size,
+            'queue/staleness': m['staleness'] / max(m['num_used'], 1),
+            'queue/num_stale': m['num_stale'],
+            'queue/learner_idle_fraction': m['learner_idle_time'] / elapsed,
+            'queue/runner_blocked_fraction': (
+                self.runner.blocked_time - m['runner_blocked_start']) / elapsed
+        }
+        self.queue_metrics = collections.defaultdict(float)
+        self.queue_metrics['runner_blocked_start'] = self.runner.blocked_time
+        self.queue_metrics_start = time.time()
+        return tf.Summary(value=[tf.Summary.Value(tag=k, simple_value=v) 
+            for (k, v) in sorted(values.items())])
+
     def process(self, sess):
         """
         process grabs a rollout that's been produced by the thread runner,
@@ -271,8 +684,13 @@ class AsyncTD(object):
         """
 
         sess.run(self.sync)  # copy weights from shared to local
-        rollout = next(self.rollout_provider)
-        batch = process_rollout(rollout, gamma=self.config.discount)
+        if self.batched:
+            rollouts = [self._next_rollout() 
+                for _ in range(self.config.rollouts_per_update)]
+            batch = process_rollouts(rollouts, gamma=self.config.discount)
+        else:
+            rollout = self._next_rollout()
+            batch = process_rollout(rollout, gamma=self.config.discount)
 
         should_compute_summary = (self.task == 0 
             and self.local_steps % self.config.summary_every == 0)
@@ -282,20 +700,33 @@ class AsyncTD(object):
         else:
             fetches = [self.train_op, self.global_step]
 
-        feed_dict = {
-            self.local_network.x: batch.si,
-            self.r: batch.r,
-            self.w: batch.w,
-            self.local_network.state_in[0]: batch.features[0],
-            self.local_network.state_in[1]: batch.features[1],
-            self.local_network.dropout_keep_prob_ph: self.config.dropout_keep_prob
-        }
+        pi = self.local_network
+        if self.batched:
+            feed_dict = {
+                pi.x_batch: batch.si,
+                pi.seq_lengths: batch.lengths,
+                pi.state_in_batch[0]: batch.features[0],
+                pi.state_in_batch[1]: batch.features[1]
+            }
+        else:
+            feed_dict = {
+                pi.x: batch.si,
+                pi.state_in[0]: batch.features[0],
+                pi.state_in[1]: batch.features[1]
+            }
+        feed_dict[self.r] = batch.r
+        feed_dict[self.w] = batch.w
+        feed_dict[pi.dropout_keep_prob_ph] = self.config.dropout_keep_prob
 
         fetched = sess.run(fetches, feed_dict=feed_dict)
+        self.metrics.set_global_step(fetched[-1])
 
         if should_compute_summary:
             self.summary_writer.add_summary(
                 tf.Summary.FromString(fetched[0]), fetched[-1])
+            if self.runner is not None:
+                self.summary_writer.add_summary(
+                    self._queue_summary(), fetched[-1])
             self.summary_writer.flush()
         self.local_steps += 1
 
@@ -359,7 +790,7 @@ class AsyncTD(object):
         else:
             loss = tf.reduce_sum(w * tf.reduce_mean(td_error, axis=-1))
 
-        mean_targets = tf.reduce_mean(self.r, axis=0)
+        mean_targets = tf.reduce_mean(targets, axis=0)
         mean_target_td_errors = tf.reduce_mean(td_error, axis=0)
 
         for i, target_name in enumerate(
@@ -383,7 +814,7 @@ class AsyncTD(object):
 
         loss = loss * tf.reshape(w, [-1,1])
 
-        mean_targets = tf.reduce_mean(self.r, axis=0)
+        mean_targets = tf.reduce_mean(targets, axis=0)
         mean_target_ce_errors = tf.reduce_mean(loss, axis=0)
         done = False
         for i, target_name in enumerate(
@@ -404,24 +835,22 @@ class AsyncTD(object):
         loss = tf.reduce_sum(loss)
         return loss
 
-    def _build_loss(self):
-        pi = self.local_network
-
+    def _build_loss(self, vf, targets, w):
         # log mse
         if self.config.loss_type == 'log_mse':
-            r = tf.log(tf.clip_by_value(self.r, self.config.eps, 1))
+            r = tf.log(tf.clip_by_value(targets, self.config.eps, 1))
             loss = self._build_squared_error_loss_component(
-                pi.vf, self.r, self.w, self.config.target_loss_index)
+                vf, targets, w, self.config.target_loss_index)
             
         # cross entropy loss
         elif self.config.loss_type == 'ce':
             loss = self._build_cross_entropy_loss_component(
-                pi.vf, self.r, self.w, self.config.target_loss_index)
+                vf, targets, w, self.config.target_loss_index)
 
         # mse / brier
         elif self.config.loss_type == 'mse':
             loss = self._build_squared_error_loss_component(
-                pi.vf, self.r, self.w, self.config.target_loss_index)
+                vf, targets, w, self.config.target_loss_index)
 
         # l2 regularization loss
         reg_loss = tf.contrib.layers.apply_regularization(
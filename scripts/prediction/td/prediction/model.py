@@ -36,10 +36,7 @@ class LSTMPredictor(object):
         )
 
         # hidden layers before lstm
-        for l, size in enumerate(config.hidden_layer_sizes):
-            x = tf.nn.elu(linear(x, size, "{}_".format(l), 
-                normalized_columns_initializer(0.01)))
-            x = tf.nn.dropout(x, self.dropout_keep_prob_ph)
+        x = self._build_hidden_layers(x, config)
         size = config.hidden_layer_sizes[-1]
         
         # introduce a "fake" batch dimension of 1 to LSTM over time dim
@@ -61,9 +58,41 @@ class LSTMPredictor(object):
         self.state_out = [lstm_c[:1, :], lstm_h[:1, :]]
         x = tf.reshape(lstm_outputs, [-1, size])
         self.vf = linear(x, config.value_dim, "value", normalized_columns_initializer(1.0))
+
+        # a batch of sequences padded to a common length, sharing the 
+        # variables above, which advances the lstm states of many 
+        # environments in one call and trains on many rollouts at once
+        with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+            self.x_batch = tf.placeholder(tf.float32, 
+                [None, None] + list(ob_space), 'x_batch')
+            self.seq_lengths = tf.placeholder(tf.int32, [None], 'seq_lengths')
+            batch_size = tf.shape(self.x_batch)[0]
+            max_length = tf.shape(self.x_batch)[1]
+            x = tf.reshape(self.x_batch, [-1] + list(ob_space))
+            x = self._build_hidden_layers(x, config)
+            x = tf.reshape(x, tf.stack([batch_size, max_length, size]))
+            c_batch = tf.placeholder(tf.float32, [None, lstm.state_size.c])
+            h_batch = tf.placeholder(tf.float32, [None, lstm.state_size.h])
+            self.state_in_batch = [c_batch, h_batch]
+            batch_outputs, batch_state = tf.nn.dynamic_rnn(
+                lstm, x, initial_state=rnn.LSTMStateTuple(c_batch, h_batch),
+                sequence_length=self.seq_lengths, time_major=False)
+            self.state_out_batch = [batch_state[0], batch_state[1]]
+            vf = linear(tf.reshape(batch_outputs, [-1, size]), 
+                config.value_dim, "value")
+            self.vf_batch = tf.reshape(vf, 
+                tf.stack([batch_size, max_length, config.value_dim]))
+
         self.var_list = tf.get_collection(
             tf.GraphKeys.TRAINABLE_VARIABLES, tf.get_variable_scope().name)
 
+    def _build_hidden_layers(self, x, config):
+        for l, size in enumerate(config.hidden_layer_sizes):
+            x = tf.nn.elu(linear(x, size, "{}_".format(l), 
+                normalized_columns_initializer(0.01)))
+            x = tf.nn.dropout(x, self.dropout_keep_prob_ph)
+        return x
+
     def get_initial_features(self):
         return self.state_init
 
@@ -76,6 +105,43 @@ class LSTMPredictor(object):
             self.dropout_keep_prob_ph: 1.
         })
 
+    def get_initial_features_batch(self, batch_size):
+        return [np.zeros((batch_size, self.state_size.c), np.float32),
+            np.zeros((batch_size, self.state_size.h), np.float32)]
+
+    def step(self, obs, c, h, compute_value=False):
+        """
+        Advance the lstm states of a batch of sequences by one observation 
+        each, in a single session.run. 
+
+        obs.shape = (batch_size,) + ob_space, c.shape = h.shape = 
+        (batch_size, state_size). Returns the next [c, h], and when 
+        compute_value is true also the values after the observations.
+        """
+        sess = tf.get_default_session()
+        fetches = list(self.state_out_batch)
+        if compute_value:
+            fetches += [self.vf_batch]
+        obs = np.asarray(obs)
+        fetched = sess.run(fetches, {
+            self.x_batch: obs[:, np.newaxis], 
+            self.seq_lengths: np.ones(len(obs), dtype=np.int32),
+            self.state_in_batch[0]: c, 
+            self.state_in_batch[1]: h,
+            self.dropout_keep_prob_ph: 1.
+        })
+        if compute_value:
+            return fetched[:2], self._to_probs(fetched[2][:, 0])
+        return fetched
+
+    def _to_probs(self, v):
+        # convert to probability form if necessary
+        if self.config.loss_type == 'log_mse':
+            v = np.exp(v)
+        elif self.config.loss_type == 'ce':
+            v = 1 / (1 + np.exp(-v))
+        return v
+
     def value(self, ob, c, h, sequence=False):
         if not sequence:
             ob = [ob]
@@ -94,9 +160,4 @@ class LSTMPredictor(object):
         else:
             v = v[-1]
 
-        # convert to probability form if necessary
-        if self.config.loss_type == 'log_mse':
-            v = np.exp(v)
-        elif self.config.loss_type == 'ce':
-            v = 1 / (1 + np.exp(-v))
-        return v
\ No newline at end of file
+        return self._to_probs(v)
\ No newline at end of file
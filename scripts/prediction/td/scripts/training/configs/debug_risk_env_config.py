@@ -64,6 +64,10 @@ class Config(object):
         self.hidden_layer_sizes = [64]
         self.value_dim = 5
         self.local_steps_per_update = 20
+        self.num_envs_per_worker = 1
+        self.rollout_queue_size = 0
+        self.max_rollout_staleness = 10
+        self.rollouts_per_update = 1
         self.grad_clip_norm = 40
         self.learning_rate = 1e-3 
         self.learning_rate_end = 1e-5
@@ -77,6 +81,7 @@ class Config(object):
         self.discount = 49./50
         self.n_global_steps = 100000000
         self.summary_every = 11
+        self.summary_every_secs = 10.
         self.normalization_type = 'range'
 
         ## optimizers
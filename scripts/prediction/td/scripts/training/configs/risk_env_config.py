@@ -57,6 +57,10 @@ class Config(object):
         self.hidden_layer_sizes = [128, 128]
         self.value_dim = 5
         self.local_steps_per_update = 20
+        self.num_envs_per_worker = 1
+        self.rollout_queue_size = 0
+        self.max_rollout_staleness = 10
+        self.rollouts_per_update = 1
         self.grad_clip_norm = 40
         self.learning_rate = 1e-4
         self.learning_rate_end = 1e-5
@@ -64,6 +68,7 @@ class Config(object):
         self.discount = 49. / 50
         self.n_global_steps = 100000000
         self.summary_every = 11
+        self.summary_every_secs = 10.
         self.target_loss_index = 3
         self.l2_reg = 1e-5
         self.eps = 1e-8
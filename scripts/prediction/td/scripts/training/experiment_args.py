@@ -93,6 +93,14 @@ def get_experiment_argparser(caller):
                         help="dimension of value function")
     parser.add_argument('--local_steps_per_update', default=100, type=int,
                         help="number of steps before running update, effective batch size")
+    parser.add_argument('--num_envs_per_worker', default=1, type=int,
+                        help="number of environments each worker steps in lockstep")
+    parser.add_argument('--rollout_queue_size', default=0, type=int,
+                        help="rollouts generated ahead in a runner thread, 0 generates them synchronously")
+    parser.add_argument('--max_rollout_staleness', default=10, type=int,
+                        help="max updates since a rollout was started for it to be trained on")
+    parser.add_argument('--rollouts_per_update', default=1, type=int,
+                        help="rollouts padded into a batch for each update")
     parser.add_argument('--learning_rate', default=5e-4, type=float,
                         help="initial learning rate")
     parser.add_argument('--learning_rate_end', default=5e-5, type=float,
@@ -112,6 +120,8 @@ def get_experiment_argparser(caller):
     parser.add_argument('--n_global_steps', default=100000000, type=int,
                         help="global steps to run experiment")
     parser.add_argument('--summary_every', default=11, type=int)
+    parser.add_argument('--summary_every_secs', default=10., type=float,
+                        help="min seconds between summaries of env infos, averaged in between")
     parser.add_argument('--optimizer', default='adam', type=str)
     parser.add_argument('--adam_beta1', default=.99, type=float)
     parser.add_argument('--adam_beta2', default=.999, type=float)
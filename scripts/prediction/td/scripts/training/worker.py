@@ -140,6 +140,7 @@ def run(args, server):
                 trainer.validate(sess, dataset)
                 last_validation_global_step = global_step
             global_step = sess.run(trainer.global_step)
+        trainer.stop()
 
     # Ask for all the services to stop.
     sv.stop()
@@ -4,6 +4,8 @@ import numpy as np
 import os
 import sys
 import tensorflow as tf
+import threading
+import time
 import unittest
 
 path = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
@@ -206,6 +208,250 @@ class TestAsyncTD(unittest.TestCase):
         self.assertTrue(avg_loss < .1)
 
 
+    def test_vector_env_runner(self):
+        config = TestConfig()
+        config.hidden_layer_sizes = [8]
+        config.value_dim = 2
+        config.loss_type = 'mse'
+
+        num_envs = 3
+        horizon = 4
+        num_local_steps = 6
+        envs = []
+        for _ in range(num_envs):
+            env = debug_envs.RandObsConstRewardEnv(horizon=horizon, 
+                reward=1., value_dim=config.value_dim)
+            env.spec = gym.envs.registration.EnvSpec(
+                id='RandObsConstRewardEnv-v0', 
+                tags={'wrapper_config.TimeLimit.max_episode_steps': 100})
+            envs.append(env)
+
+        summary_writer = tf.summary.FileWriter('/tmp/test')
+        with tf.Session() as sess:
+            trainer = async_td.AsyncTD(envs[0], 0, config)
+            sess.run(tf.global_variables_initializer())
+            sess.run(trainer.sync)
+            runner = async_td.vector_env_runner(envs, trainer.local_network, 
+                num_local_steps, summary_writer, 
+                value_dim=config.value_dim, verbose=False, visualize=False)
+            rollouts = next(runner)
+
+            # each env ends an episode after 4 steps, and starts another
+            self.assertEqual(len(rollouts), 2 * num_envs)
+            terminal = [r for r in rollouts if r.terminal]
+            unfinished = [r for r in rollouts if not r.terminal]
+            self.assertEqual(len(terminal), num_envs)
+            for r in terminal:
+                self.assertEqual(r.states.shape, (horizon, 1))
+                np.testing.assert_array_equal(r.r, np.zeros(2))
+            for r in unfinished:
+                self.assertEqual(r.states.shape, (num_local_steps - horizon, 1))
+                np.testing.assert_array_equal(r.features[0][0], 
+                    np.zeros((1, config.hidden_layer_sizes[-1])))
+                batch = async_td.process_rollout(r, gamma=1.)
+                self.assertEqual(batch.r.shape, (2, config.value_dim))
+
+    def test_rollout_buffer(self):
+        buf = async_td.RolloutBuffer(3, (2,), value_dim=2)
+        c, h = np.ones((1, 4)), 2 * np.ones((1, 4))
+        buf.reset([c, h])
+        state = np.array([1., 2.])
+        reward = [.5, 0.]
+        buf.add(state, reward, 1., False)
+        # later changes to the inputs do not change the stored experience
+        state[:] = 0.
+        reward[0] = 0.
+        c[:] = 0.
+        buf.add(state, reward, 2., True)
+
+        np.testing.assert_array_equal(buf.states, [[1., 2.], [0., 0.]])
+        np.testing.assert_array_equal(buf.rewards, [[.5, 0.], [0., 0.]])
+        np.testing.assert_array_equal(buf.weights, [1., 2.])
+        np.testing.assert_array_equal(buf.features[0][0], np.ones((1, 4)))
+        self.assertTrue(buf.terminal)
+        batch = async_td.process_rollout(buf, gamma=1.)
+        np.testing.assert_array_equal(batch.r, [[.5, 0.], [0., 0.]])
+
+        # reset reuses the arrays
+        states = buf._states
+        buf.reset([c, h])
+        self.assertEqual(len(buf.states), 0)
+        self.assertIs(buf._states, states)
+        self.assertFalse(buf.terminal)
+
+    def test_runner_thread(self):
+        def provider():
+            for i in range(3):
+                yield [i]
+            raise ValueError('end of rollouts')
+
+        versions = [0]
+        with tf.Session() as sess:
+            runner = async_td.RunnerThread(provider(), 2, lambda: versions[0])
+            runner.start_runner(sess)
+            self.assertEqual(runner.get(), (0, 0))
+            versions[0] = 5
+            rollouts = [runner.get()[1] for _ in range(2)]
+            self.assertEqual(rollouts, [1, 2])
+            # exceptions of the runner are raised in the learner
+            with self.assertRaises(ValueError):
+                runner.get()
+            runner.stop()
+
+    def test_stale_rollouts_are_skipped(self):
+        config = TestConfig()
+        config.hidden_layer_sizes = [8]
+        config.value_dim = 2
+        config.loss_type = 'mse'
+        config.target_loss_index = None
+        config.rollout_queue_size = 0
+        config.max_rollout_staleness = 1
+
+        env = debug_envs.RandObsConstRewardEnv(horizon=100, reward=1., 
+            value_dim=config.value_dim)
+        env.spec = gym.envs.registration.EnvSpec(
+            id='RandObsConstRewardEnv-v0', 
+            tags={'wrapper_config.TimeLimit.max_episode_steps': 101})
+
+        release = threading.Event()
+        def provider():
+            # rollouts of several envs, all started before the updates
+            yield ['a', 'b', 'c']
+            release.wait()
+            yield ['fresh']
+
+        summary_writer = tf.summary.FileWriter('/tmp/test')
+        with tf.Session() as sess:
+            trainer = async_td.AsyncTD(env, 0, config)
+            sess.run(tf.global_variables_initializer())
+            trainer.start(sess, summary_writer)
+            trainer.runner = async_td.RunnerThread(provider(), 1, 
+                lambda: trainer.local_steps)
+            trainer.runner.start_runner(sess)
+            while trainer.runner.queue.qsize() == 0:
+                time.sleep(.01)
+            trainer.local_steps = 2
+            release.set()
+            self.assertEqual(trainer._next_rollout(), 'fresh')
+            self.assertEqual(trainer.queue_metrics['num_stale'], 3)
+            trainer.stop()
+
+    def test_process_with_rollout_queue(self):
+        config = TestConfig()
+        config.hidden_layer_sizes = [8]
+        config.value_dim = 2
+        config.loss_type = 'mse'
+        config.target_loss_index = None
+        config.local_steps_per_update = 5
+        config.rollout_queue_size = 2
+        config.max_rollout_staleness = 100
+        config.summary_every = 1
+
+        env = debug_envs.RandObsConstRewardEnv(horizon=100, reward=1., 
+            value_dim=config.value_dim)
+        env.spec = gym.envs.registration.EnvSpec(
+            id='RandObsConstRewardEnv-v0', 
+            tags={'wrapper_config.TimeLimit.max_episode_steps': 101})
+
+        summary_writer = tf.summary.FileWriter('/tmp/test')
+        with tf.Session() as sess:
+            trainer = async_td.AsyncTD(env, 0, config)
+            sess.run(tf.global_variables_initializer())
+            sess.run(trainer.sync)
+            trainer.start(sess, summary_writer)
+            for _ in range(10):
+                trainer.process(sess)
+            trainer.stop()
+            global_step = sess.run(trainer.global_step)
+        self.assertEqual(global_step, 10 * config.local_steps_per_update)
+        self.assertEqual(trainer.local_steps, 10)
+
+    def test_process_rollouts(self):
+        rollouts = []
+        for length in [3, 5, 1]:
+            rollout = async_td.PartialRollout(value_dim=2)
+            for _ in range(length):
+                rollout.add(np.random.randn(4), np.random.rand(2), 
+                    np.random.rand(), False, 
+                    [np.random.randn(1, 6), np.random.randn(1, 6)])
+            rollout.r = np.random.rand(2)
+            rollouts.append(rollout)
+
+        batch = async_td.process_rollouts(rollouts, gamma=.9)
+        np.testing.assert_array_equal(batch.lengths, [3, 5, 1])
+        self.assertEqual(batch.si.shape, (3, 5, 4))
+        for (i, rollout) in enumerate(rollouts):
+            expected = async_td.process_rollout(rollout, gamma=.9)
+            length = batch.lengths[i]
+            np.testing.assert_array_almost_equal(batch.r[i, :length], 
+                expected.r, 5)
+            np.testing.assert_array_almost_equal(batch.w[i, :length], 
+                expected.w)
+            np.testing.assert_array_equal(batch.w[i, length:], 0)
+            np.testing.assert_array_almost_equal(batch.features[0][i], 
+                expected.features[0][0])
+
+    def test_process_batched_rollouts(self):
+        config = TestConfig()
+        config.hidden_layer_sizes = [8]
+        config.value_dim = 2
+        config.loss_type = 'mse'
+        config.target_loss_index = None
+        config.local_steps_per_update = 5
+        config.rollouts_per_update = 4
+        config.summary_every = 1
+
+        # episodes end within rollouts, so their lengths differ
+        env = debug_envs.RandObsConstRewardEnv(horizon=7, reward=1., 
+            value_dim=config.value_dim)
+        env.spec = gym.envs.registration.EnvSpec(
+            id='RandObsConstRewardEnv-v0', 
+            tags={'wrapper_config.TimeLimit.max_episode_steps': 100})
+
+        summary_writer = tf.summary.FileWriter('/tmp/test')
+        with tf.Session() as sess:
+            trainer = async_td.AsyncTD(env, 0, config)
+            sess.run(tf.global_variables_initializer())
+            sess.run(trainer.sync)
+            trainer.start(sess, summary_writer)
+            trainer.process(sess)
+            global_step = sess.run(trainer.global_step)
+        # rollouts of 5, 2, 5 and 2 steps
+        self.assertEqual(global_step, 14)
+
+    def test_metrics_aggregator(self):
+        class SummaryRecorder(object):
+            def __init__(self):
+                self.summaries = []
+            def add_summary(self, summary, global_step):
+                self.summaries.append((summary, global_step))
+            def flush(self):
+                pass
+
+        writer = SummaryRecorder()
+        metrics = async_td.MetricsAggregator(writer, summary_every_secs=1e6)
+        metrics.set_global_step(7)
+        for v in range(4):
+            metrics.add({'weight': v, 'reward': 1.})
+        self.assertEqual(len(writer.summaries), 0)
+
+        metrics.write()
+        self.assertEqual(len(writer.summaries), 1)
+        summary, global_step = writer.summaries[0]
+        self.assertEqual(global_step, 7)
+        values = dict((v.tag, v.simple_value) for v in summary.value)
+        self.assertEqual(values, {'weight': 1.5, 'reward': 1.})
+
+        # an empty window writes nothing
+        metrics.write()
+        self.assertEqual(len(writer.summaries), 1)
+
+        # without a rate limit every info is written
+        metrics.summary_every_secs = 0.
+        metrics.add({'weight': 2})
+        metrics.add({'weight': 3})
+        self.assertEqual(len(writer.summaries), 3)
+
          
 class TestAsyncTDHeuristicDeterministicCase(unittest.TestCase):     
 
@@ -200,5 +200,67 @@ class TestLSTMPredictor(unittest.TestCase):
             self.assertTrue(train_loss_mean < 1e-2)
             self.assertTrue(val_loss_mean < 1e-2)
 
+    def test_batched_step_matches_sequence(self):
+        config = TestConfig()
+        config.hidden_layer_sizes = [16, 8]
+        config.value_dim = 2
+        config.loss_type = 'mse'
+
+        n_samples = 3
+        n_timesteps = 5
+        input_dim = 4
+        x = np.random.randn(n_samples, n_timesteps, input_dim)
+
+        with tf.Session() as session:
+            predictor = model.LSTMPredictor((input_dim,), config)
+            session.run(tf.global_variables_initializer())
+
+            # advance the states of all the sequences together
+            c, h = predictor.get_initial_features_batch(n_samples)
+            for t in range(n_timesteps - 1):
+                c, h = predictor.step(x[:, t], c, h)
+            (c, h), values = predictor.step(x[:, -1], c, h, 
+                compute_value=True)
+
+            for i in range(n_samples):
+                expected = predictor.value(x[i], 
+                    predictor.state_init[0], 
+                    predictor.state_init[1],
+                    sequence=True)
+                np.testing.assert_array_almost_equal(values[i], expected, 5)
+
+    def test_padded_batch_matches_sequence(self):
+        config = TestConfig()
+        config.hidden_layer_sizes = [16, 8]
+        config.value_dim = 2
+        config.loss_type = 'mse'
+
+        input_dim = 3
+        lengths = np.array([4, 2, 3], dtype=np.int32)
+        x = np.random.randn(len(lengths), np.max(lengths), input_dim)
+        x[1, 2:] = 0.
+        x[2, 3:] = 0.
+
+        with tf.Session() as session:
+            predictor = model.LSTMPredictor((input_dim,), config)
+            session.run(tf.global_variables_initializer())
+            c, h = predictor.get_initial_features_batch(len(lengths))
+            vf = session.run(predictor.vf_batch, {
+                predictor.x_batch: x,
+                predictor.seq_lengths: lengths,
+                predictor.state_in_batch[0]: c,
+                predictor.state_in_batch[1]: h,
+                predictor.dropout_keep_prob_ph: 1.
+            })
+            for (i, length) in enumerate(lengths):
+                expected = session.run(predictor.vf, {
+                    predictor.x: x[i, :length],
+                    predictor.state_in[0]: predictor.state_init[0],
+                    predictor.state_in[1]: predictor.state_init[1],
+                    predictor.dropout_keep_prob_ph: 1.
+                })
+                np.testing.assert_array_almost_equal(
+                    vf[i, :length], expected, 5)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
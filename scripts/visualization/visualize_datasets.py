@@ -1,5 +1,4 @@
 
-import bisect
 import collections
 import csv
 import h5py
@@ -199,20 +198,11 @@ def collision_probability_by_behavior(dataset, politeness_idx=72):
     for line in lines: print(line)
 
 def report_poorly_performing_indices(idxs, data):
-    batch_idxs = data['batch_idxs']
-    seeds = data['seeds']
-    for idx in idxs:
-        # you could biject, but let's keep it simple
-        for i, b in enumerate(batch_idxs):
-            if b > idx:
-                break
-        seed = seeds[i]
-        if i > 0:
-            veh_idx = idx - batch_idxs[i - 1] + 1
-        else:
-            veh_idx = idx + 1
+    scene_index = dataset_loaders.SceneIndex(data['batch_idxs'], data['seeds'])
+    seeds, veh_idxs, num_vehs = scene_index.lookup(idxs)
+    for (seed, veh_idx, num_veh) in zip(seeds, veh_idxs, num_vehs):
         print('seed: {}\tveh idx: {}'.format(seed, veh_idx))
-        print('seed num veh: {}'.format(batch_idxs[i] - batch_idxs[i-1]))
+        print('seed num veh: {}'.format(num_veh))
 
 def compare_dataset_targets_pairwise(d1, d2, target_labels):
     # truncate to the same number of samples
@@ -263,20 +253,13 @@ def sort_scenario_seeds_by_target(dataset, output_directory):
         sorted_bss = metadata['sorted_bss']
     # otherwise compute means by scenario batch and sort along with seeds
     else:
-        mean_targets = []
-        prev_bidx = 0
-        for (i, bidx) in enumerate(batch_idxs):
-            ys = y[prev_bidx:bidx]
-            bs = bidx - prev_bidx
-            # mean_seed = (tuple(np.mean(ys, axis=0)), seeds[i], bs)
-            mean_seed = (np.mean(np.mean(ys, axis=0)), seeds[i], bs)
-            mean_targets.append(mean_seed)
-            prev_bidx = bidx
-
-        sorted_means = sorted(mean_targets, reverse=True)
-        sorted_seeds = [s for (_, s, _) in sorted_means]
-        sorted_bss = [bs for (_, _, bs) in sorted_means]
-        sorted_means = [m for (m, _, _) in sorted_means]
+        scene_index = dataset_loaders.SceneIndex(batch_idxs, seeds)
+        means, _ = scene_index.scene_means(y)
+        bss = scene_index.ends - scene_index.starts
+        order = np.lexsort((bss, scene_index.seeds, means))[::-1]
+        sorted_seeds = list(scene_index.seeds[order])
+        sorted_bss = list(bss[order])
+        sorted_means = list(means[order])
 
     # display some info
     print(sorted_seeds[:100])
@@ -321,31 +304,15 @@ def compare_dataset_features(d1, d2, l1, l2):
 
 def report_high_prob_target_seeds_veh_idxs(data, output_filepath, 
         tidx=1, threshold=.5):
-    # sort the targets
-    batch_idxs = data['batch_idxs']
-    seeds = data['seeds']
+    # sort the targets, keeping those above the threshold
     targets = data['y_train'][:,tidx]
-    idxs = list(reversed(np.argsort(targets)))
+    idxs = np.argsort(targets)[::-1]
+    idxs = idxs[targets[idxs] >= threshold]
 
     # collect the output seeds and veh idxs
-    rows = []
-    for idx in idxs:
-        # go through batch idxs until finding the scene of the vehicle
-        i = bisect.bisect_right(batch_idxs, idx)
-
-        # get the vehicle idx
-        if i > 0:
-            veh_idx = idx - batch_idxs[i - 1] + 1
-        else:
-            veh_idx = idx + 1
-
-        # check if the target is above the threshold, if not break
-        target_val = data['y_train'][idx,tidx]
-        if target_val < threshold:
-            break
-
-        # write the seed and veh idx to file
-        rows.append([seeds[i], veh_idx])
+    scene_index = dataset_loaders.SceneIndex(data['batch_idxs'], data['seeds'])
+    seeds, veh_idxs, _ = scene_index.lookup(idxs)
+    rows = [[seed, veh_idx] for (seed, veh_idx) in zip(seeds, veh_idxs)]
 
     outfile = open(output_filepath, 'w')
     csv_writer = csv.writer(outfile)
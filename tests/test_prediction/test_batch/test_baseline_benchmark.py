@@ -0,0 +1,67 @@
+import numpy as np
+import os
+import sys
+import unittest
+
+path = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, 'scripts', 'prediction', 'batch')
+sys.path.append(os.path.abspath(path))
+
+import baseline
+import baseline_benchmark
+
+def get_data(num_samples=200, input_dim=3, output_dim=2):
+    np.random.seed(1)
+    x = np.random.randn(num_samples, input_dim)
+    y = np.dot(x, np.random.randn(input_dim, output_dim))
+    num_train = num_samples // 2
+    return {'x_train': x[:num_train], 'y_train': y[:num_train],
+        'x_val': x[num_train:], 'y_val': y[num_train:],
+        'means': np.zeros(input_dim)}
+
+class TestBaselineBenchmark(unittest.TestCase):
+
+    def test_subsample(self):
+        data = get_data()
+        sub = baseline_benchmark.subsample(data, max_train=10, max_val=None)
+        self.assertEqual(len(sub['x_train']), 10)
+        self.assertEqual(len(sub['y_train']), 10)
+        self.assertEqual(len(sub['x_val']), 100)
+        self.assertIs(sub['means'], data['means'])
+        # samples remain aligned
+        idxs = [np.where((data['x_train'] == x).all(axis=1))[0][0]
+            for x in sub['x_train']]
+        np.testing.assert_array_equal(sub['y_train'], data['y_train'][idxs])
+
+        # the selection is reproducible
+        other = baseline_benchmark.subsample(data, max_train=10)
+        np.testing.assert_array_equal(sub['x_train'], other['x_train'])
+
+    def test_configure_model(self):
+        model = baseline.build_model('random_forests', num_targets=2)
+        baseline_benchmark.configure_model(model, n_jobs=3, seed=2)
+        params = model.get_params()
+        self.assertEqual(params['n_jobs'], 1)
+        self.assertEqual(params['estimator__n_jobs'], 3)
+        self.assertEqual(params['estimator__random_state'], 2)
+
+        # without parallel estimators, the wrapper is parallel
+        model = baseline.build_model('gradient_boosting', num_targets=2)
+        baseline_benchmark.configure_model(model, n_jobs=3)
+        self.assertEqual(model.get_params()['n_jobs'], 3)
+
+    def test_run_benchmarks(self):
+        data = get_data()
+        model_types = ['constant_mean', 'linear_regression']
+        results = baseline_benchmark.run_benchmarks(model_types, 
+            baseline.build_model, baseline.score, data, num_processes=2)
+        self.assertEqual([r['model'] for r in results], 
+            ['linear_regression', 'constant_mean'])
+        for r in results:
+            self.assertEqual(r['num_train'], 100)
+            self.assertTrue(r['fit_sec'] >= 0)
+            self.assertTrue(r['predict_samples_per_sec'] > 0)
+        table = baseline_benchmark.format_table(results).split('\n')
+        self.assertEqual(len(table), 4)
+
+if __name__ == '__main__':
+    unittest.main()
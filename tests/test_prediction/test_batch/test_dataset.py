@@ -52,5 +52,85 @@ class TestDataset(unittest.TestCase):
             np.testing.assert_array_equal(e[0], a[0])
             np.testing.assert_array_equal(e[1], a[1])
 
+    def test_next_batch_permutation(self):
+        flags = testing_flags.FLAGS
+        flags.input_dim = 1
+        flags.output_dim = 1
+        flags.batch_size = 4
+        data = {'x_train': np.arange(10).reshape(-1, 1),
+            'y_train': np.arange(10).reshape(-1, 1) * 2,
+            'lw_train': np.ones((10, 1)),
+            'x_val': np.arange(6).reshape(-1, 1),
+            'y_val': np.arange(6).reshape(-1, 1),
+            'lw_val': np.ones((6, 1))}
+        d = dataset.WeightedDataset(data, flags, num_buffers=3)
+
+        # train batches are a permutation of the samples, and each batch 
+        # remains valid until num_buffers more batches have been drawn
+        batches = list(d.next_batch())
+        self.assertEqual([len(b[0]) for b in batches], [4, 4, 2])
+        x = np.concatenate([b[0] for b in batches])
+        np.testing.assert_array_equal(np.sort(x, axis=0), data['x_train'])
+        y = np.concatenate([b[1] for b in batches])
+        np.testing.assert_array_equal(y, x * 2)
+
+        # validation batches are in order
+        batches = list(d.next_batch(validation=True))
+        x = np.concatenate([b[0] for b in batches])
+        np.testing.assert_array_equal(x, data['x_val'])
+
+    def test_next_batch_buffer_lifetime(self):
+        flags = testing_flags.FLAGS
+        flags.input_dim = 1
+        flags.output_dim = 1
+        flags.batch_size = 2
+        data = {'x_train': np.arange(8).reshape(-1, 1),
+            'y_train': np.arange(8).reshape(-1, 1) * 2,
+            'x_val': np.arange(2).reshape(-1, 1),
+            'y_val': np.arange(2).reshape(-1, 1)}
+        d = dataset.Dataset(data, flags, num_buffers=2)
+
+        batches = d.next_batch()
+        first = next(batches)
+        expected = [np.copy(a) for a in first]
+        np.testing.assert_array_equal(expected[1], expected[0] * 2)
+
+        # the first batch is valid until num_buffers more batches are drawn
+        next(batches)
+        for (a, e) in zip(first, expected):
+            np.testing.assert_array_equal(a, e)
+        third = next(batches)
+        for (a, b) in zip(first, third):
+            self.assertTrue(np.shares_memory(a, b))
+        self.assertFalse(np.array_equal(first[0], expected[0]))
+
+class TestPrefetchingDataset(unittest.TestCase):
+
+    def test_next_batch(self):
+        flags = testing_flags.FLAGS
+        flags.input_dim = 3
+        flags.output_dim = 2
+        flags.batch_size = 5
+        data = get_debug_data(flags, train_samples=11, val_samples=4)
+        d = dataset.PrefetchingDataset(
+            dataset.Dataset(data, flags, num_buffers=4), num_prefetch=2)
+        self.assertEqual(d.num_train_batches, 3)
+
+        batches = list(d.next_batch())
+        self.assertEqual([len(b[0]) for b in batches], [5, 5, 1])
+        batches = list(d.next_batch(validation=True))
+        np.testing.assert_array_equal(batches[0][0], np.ones((4, 3)))
+
+        # stopping early should not hang the producer
+        batches = d.next_batch()
+        next(batches)
+        batches.close()
+
+    def test_insufficient_buffers(self):
+        flags = testing_flags.FLAGS
+        data = get_debug_data(flags)
+        d = dataset.Dataset(data, flags, num_buffers=2)
+        self.assertRaises(ValueError, dataset.PrefetchingDataset, d, 1)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
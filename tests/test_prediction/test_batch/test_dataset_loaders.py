@@ -1,7 +1,10 @@
 
+import h5py
 import numpy as np
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 
 path = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, 'scripts')
@@ -15,6 +18,17 @@ from prediction.batch import dataset_loaders
 DEBUG_FILEPATH = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 
     'data', 'debug.h5')
 
+def write_debug_dataset(filepath, num_samples=53, timesteps=3):
+    feature_names = ['velocity', 'timegap', 'lon_T', 'fore_fore_velocity']
+    features = np.random.randn(num_samples, timesteps, len(feature_names)) * 40
+    targets = np.random.rand(num_samples, 2)
+    weights = np.random.rand(num_samples, 1) * 3
+    with h5py.File(filepath, 'w') as outfile:
+        outfile['risk/features'] = features
+        outfile['risk/targets'] = targets
+        outfile['risk/weights'] = weights
+        outfile['risk'].attrs['feature_names'] = feature_names
+
 class TestRiskDatasetLoader(unittest.TestCase):
 
     def setUp(self):
@@ -49,7 +63,7 @@ class TestRiskDatasetLoader(unittest.TestCase):
         expected /= std
 
         actual = data_norm['x_train']
-        np.testing.assert_array_equal(expected, actual)
+        np.testing.assert_allclose(expected, actual, rtol=1e-10, atol=1e-12)
 
     def test_sequence_normalization(self):
         x_train = np.ones(8).reshape(2,2,2)
@@ -66,5 +80,226 @@ class TestRiskDatasetLoader(unittest.TestCase):
         self.assertEquals(data['x_train'].shape, (2,2,2))
         self.assertEquals(data['x_val'].shape, (2,2,2))
 
+    def test_running_stats(self):
+        x = np.random.randn(101, 3, 4) * 5 + 2
+        stats = dataset_loaders.RunningStats()
+        for s in range(0, len(x), 17):
+            stats.update(x[s:s + 17])
+        np.testing.assert_allclose(stats.mean, np.mean(x, axis=(0, 1)))
+        np.testing.assert_allclose(stats.std(), np.std(x, axis=(0, 1)))
+
+        other = dataset_loaders.RunningStats()
+        other.update(x)
+        other.merge(stats)
+        np.testing.assert_allclose(other.mean, np.mean(x, axis=(0, 1)))
+        np.testing.assert_allclose(other.std(), np.std(x, axis=(0, 1)))
+
+    def test_discretize_targets(self):
+        targets = np.array([[0., .2, .5], [.49, 1., 1.5], [-.1, .75, .51]])
+        dataset_loaders.discretize_targets(targets, 2)
+        expected = np.array([[0., 0., 1.], [0., 1., 1.5], [-.1, 1., 1.]])
+        np.testing.assert_array_equal(targets, expected)
+
+    def test_get_balanced_class_weights(self):
+        targets = np.array([[0, 1], [0, 1], [1, 1], [0, 0], [2, 1]])
+        weights = dataset_loaders.get_balanced_class_weights(targets)
+        expected = np.array([[1/3., .25], [1/3., .25], [1., .25], 
+            [1/3., 1.], [1., .25]])
+        np.testing.assert_array_equal(weights, expected)
+
+        # chunked computation on undiscretized targets matches exactly
+        targets = np.random.rand(101, 3)
+        discretized = dataset_loaders.discretize_targets(targets.copy(), 4)
+        expected = dataset_loaders.get_balanced_class_weights(discretized)
+        actual = dataset_loaders.get_balanced_class_weights(
+            targets, num_bins=4, chunk_size=10)
+        np.testing.assert_array_equal(expected, actual)
+
+class TestSceneIndex(unittest.TestCase):
+
+    def test_lookup(self):
+        # three scenes of 3, 2 and 4 vehicles
+        scene_index = dataset_loaders.SceneIndex(
+            np.array([[3], [5], [9]]), np.array([[10], [11], [12]]))
+        seeds, veh_idxs, num_vehs = scene_index.lookup([0, 2, 3, 4, 5, 8])
+        np.testing.assert_array_equal(seeds, [10, 10, 11, 11, 12, 12])
+        np.testing.assert_array_equal(veh_idxs, [1, 3, 1, 2, 1, 4])
+        np.testing.assert_array_equal(num_vehs, [3, 3, 2, 2, 4, 4])
+
+    def test_scene_means(self):
+        scene_index = dataset_loaders.SceneIndex([2, 2, 5], [0, 1, 2])
+        y = np.array([[0., 1.], [1., 1.], [0., 0.], [1., 0.], [1., 1.]])
+        means, counts = scene_index.scene_means(y)
+        np.testing.assert_array_equal(counts, [2, 0, 3])
+        np.testing.assert_array_equal(means[[0, 2]], [.75, .5])
+        self.assertTrue(np.isnan(means[1]))
+
+class TestRiskDatasetChunkIterator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, 'debug.h5')
+        write_debug_dataset(self.filepath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunks_match_loader(self):
+        kwargs = dict(timesteps=1, load_likelihood_weights=True, fore_limit=1)
+        data = dataset_loaders.risk_dataset_loader(self.filepath, 
+            normalize=False, train_split=1., debug_size=53, **kwargs)
+        chunks = list(dataset_loaders.risk_dataset_chunk_iterator(
+            self.filepath, chunk_size=10, **kwargs))
+        self.assertEqual(len(chunks), 6)
+        for (k, dk) in [('x', 'x_train'), ('y', 'y_train'), ('lw', 'lw_train')]:
+            actual = np.concatenate([c[k] for c in chunks])
+            np.testing.assert_array_equal(data[dk], actual)
+        self.assertEqual(chunks[0]['x'].shape[1:], (2,))
+
+    def test_loader_sample_idxs(self):
+        kwargs = dict(normalize=False, debug_size=53, timesteps=1, 
+            load_likelihood_weights=True)
+        unshuffled = dataset_loaders.risk_dataset_loader(self.filepath, 
+            train_split=1., **kwargs)
+        np.random.seed(1)
+        data = dataset_loaders.risk_dataset_loader(self.filepath, 
+            shuffle=True, **kwargs)
+
+        # samples removed by the likelihood weight threshold are not indexed
+        idxs = np.concatenate((data['idxs_train'], data['idxs_val']))
+        self.assertEqual(len(idxs), len(unshuffled['idxs_train']))
+
+        # the unshuffled dataset is a reordering of the shuffled one
+        order = np.argsort(idxs)
+        np.testing.assert_array_equal(idxs[order], unshuffled['idxs_train'])
+        x = np.concatenate((data['x_train'], data['x_val']))
+        np.testing.assert_array_equal(x[order], unshuffled['x_train'])
+
+    def test_chunk_range_and_shuffle(self):
+        chunks = list(dataset_loaders.risk_dataset_chunk_iterator(
+            self.filepath, start=40, end=53, chunk_size=5, shuffle=True))
+        self.assertEqual(sum(len(c['x']) for c in chunks), 13)
+        self.assertEqual(chunks[0]['x'].shape[1:], (3, 3))
+
+    def test_feature_selection_index(self):
+        self.assertEqual(dataset_loaders.keep_idxs_to_ranges(
+            np.array([0, 1, 2, 5, 7, 8])), [(0, 3), (5, 6), (7, 9)])
+
+        all_features = dataset_loaders.risk_dataset_loader(self.filepath, 
+            normalize=False, debug_size=53, timesteps=2, 
+            ignore_behavioral_features=False)
+        expected = all_features['x_train'][:, :, [0, 1]]
+
+        # the index stored in the sidecar gives the same columns, and 
+        # storing it leaves the dataset unmodified
+        mtime = os.path.getmtime(self.filepath)
+        for store in [False, True]:
+            if store:
+                dataset_loaders.store_feature_selection_index(
+                    self.filepath, fore_limit=1)
+            data = dataset_loaders.risk_dataset_loader(self.filepath, 
+                normalize=False, debug_size=53, timesteps=2, fore_limit=1)
+            np.testing.assert_array_equal(data['x_train'], expected)
+        self.assertTrue(os.path.exists(
+            dataset_loaders.feature_selection_filepath(self.filepath)))
+        self.assertEqual(os.path.getmtime(self.filepath), mtime)
+
+    def test_read_features_merges_ranges(self):
+        self.assertEqual(dataset_loaders.merge_ranges(
+            [(0, 3), (5, 6), (12, 14)], 2), [(0, 6), (12, 14)])
+
+        features = np.random.randn(20, 3, 16)
+        keep_idxs = np.array([0, 1, 4, 5, 6, 9, 15])
+        expected = features[10:17, 1:][:, :, keep_idxs]
+        filepath = os.path.join(self.tmpdir, 'chunked.h5')
+        with h5py.File(filepath, 'w') as outfile:
+            outfile.create_dataset('contiguous', data=features)
+            outfile.create_dataset('chunked', data=features, 
+                chunks=(4, 3, 4), compression='gzip')
+        with h5py.File(filepath, 'r') as infile:
+            for name in ['contiguous', 'chunked']:
+                for max_gap in [0, 2, 16]:
+                    actual = dataset_loaders.read_features(infile[name], 
+                        10, 17, timesteps=2, keep_idxs=keep_idxs, 
+                        max_gap=max_gap)
+                    np.testing.assert_array_equal(actual, expected)
+
+    def test_load_feature_stats_cache(self):
+        kwargs = dict(end=40, timesteps=2, load_likelihood_weights=True)
+        mean, std = dataset_loaders.load_feature_stats(
+            self.filepath, chunk_size=7, **kwargs)
+        cache_filepath = dataset_loaders.feature_stats_cache_filepath(
+            self.filepath)
+        self.assertTrue(os.path.exists(cache_filepath))
+
+        data = dataset_loaders.risk_dataset_loader(self.filepath, 
+            train_split=1., debug_size=40, timesteps=2, 
+            load_likelihood_weights=True)
+        np.testing.assert_allclose(data['means'], mean)
+        np.testing.assert_allclose(data['stds'], std)
+
+        # a second load reads from the cache and different settings miss it
+        cached_mean, _ = dataset_loaders.load_feature_stats(
+            self.filepath, **kwargs)
+        np.testing.assert_array_equal(cached_mean, mean)
+        other_mean, _ = dataset_loaders.load_feature_stats(
+            self.filepath, end=40, timesteps=1)
+        self.assertEqual(other_mean.shape, mean.shape)
+        self.assertFalse(np.allclose(other_mean, mean))
+
+    def test_cached_risk_dataset_loader(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        kwargs = dict(debug_size=53, timesteps=2, shuffle=True, 
+            load_likelihood_weights=True)
+        np.random.seed(1)
+        expected = dataset_loaders.risk_dataset_loader(self.filepath, **kwargs)
+        for _ in range(2):
+            np.random.seed(1)
+            data = dataset_loaders.cached_risk_dataset_loader(
+                self.filepath, cache_dir, random_seed=1, **kwargs)
+            self.assertTrue(isinstance(data['x_train'], np.memmap))
+            self.assertEqual(data['x_train'].dtype, np.float32)
+            for k in ['x_train', 'y_train', 'lw_train', 'x_val', 'means']:
+                np.testing.assert_allclose(data[k], expected[k], rtol=1e-6)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+
+        # different arguments are cached separately
+        dataset_loaders.cached_risk_dataset_loader(
+            self.filepath, cache_dir, random_seed=2, **kwargs)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_save_preprocessed_cache_race(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        cache_path = os.path.join(cache_dir, 'key')
+        data = {'x_train': np.ones((3, 2)), 'y_train': np.zeros((3, 1))}
+        dataset_loaders.save_preprocessed_cache(cache_path, data)
+
+        # a second process completing the same cache fails to rename its 
+        # temporary directory, which is removed
+        with self.assertRaises(OSError):
+            dataset_loaders.save_preprocessed_cache(cache_path, data)
+        self.assertEqual(os.listdir(cache_dir), ['key'])
+
+    def test_cached_risk_dataset_loader_race(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        kwargs = dict(debug_size=53, timesteps=2)
+        cache_path = dataset_loaders.preprocessed_cache_path(
+            cache_dir, self.filepath, 1, **kwargs)
+        data = dataset_loaders.risk_dataset_loader(self.filepath, **kwargs)
+        save = dataset_loaders.save_preprocessed_cache
+
+        # another process completes the cache while this one loads
+        def save_after_other(path, data):
+            save(path, data)
+            save(path, data)
+        dataset_loaders.save_preprocessed_cache = save_after_other
+        try:
+            loaded = dataset_loaders.cached_risk_dataset_loader(
+                self.filepath, cache_dir, random_seed=1, **kwargs)
+        finally:
+            dataset_loaders.save_preprocessed_cache = save
+        self.assertTrue(isinstance(loaded['x_train'], np.memmap))
+        self.assertEqual(os.listdir(cache_dir), [os.path.basename(cache_path)])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import numpy as np
+import os
+import sys
+import unittest
+
+path = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, 'scripts', 'prediction', 'batch')
+sys.path.append(os.path.abspath(path))
+
+import distributed
+
+class TestDistributed(unittest.TestCase):
+
+    def test_cluster_spec(self):
+        spec = distributed.cluster_spec(3, port=2000)
+        self.assertEqual(spec['ps'], ['127.0.0.1:2000'])
+        self.assertEqual(spec['worker'],
+            ['127.0.0.1:2001', '127.0.0.1:2002', '127.0.0.1:2003'])
+
+    def test_shard_data(self):
+        data = {'x_train': np.arange(10), 'y_train': np.arange(10) * 2,
+            'x_val': np.arange(5), 'means': np.ones(3)}
+        shards = [distributed.shard_data(data, i, 3) for i in range(3)]
+
+        # shards partition the splits and share other values
+        x_train = np.sort(np.hstack([s['x_train'] for s in shards]))
+        np.testing.assert_array_equal(x_train, data['x_train'])
+        x_val = np.sort(np.hstack([s['x_val'] for s in shards]))
+        np.testing.assert_array_equal(x_val, data['x_val'])
+        for s in shards:
+            np.testing.assert_array_equal(s['y_train'], s['x_train'] * 2)
+            self.assertIs(s['means'], data['means'])
+        self.assertEqual([len(s['x_train']) for s in shards], [4, 3, 3])
+
+    def test_run_local_cluster_worker_failure(self):
+        def fit_fn(task_index, target, device_fn, config, wait_for_workers):
+            # the first worker fails, the others wait for it
+            if task_index == 0:
+                raise ValueError('worker failed')
+            wait_for_workers()
+
+        with self.assertRaises(RuntimeError):
+            distributed.run_local_cluster(fit_fn, 2, port=12422, 
+                poll_secs=.1)
+
+if __name__ == '__main__':
+    unittest.main()
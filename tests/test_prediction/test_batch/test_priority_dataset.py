@@ -0,0 +1,182 @@
+import numpy as np
+import os
+import sys
+import unittest
+
+path = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'scripts')
+sys.path.append(os.path.abspath(path))
+path = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, 'scripts', 'prediction', 'batch')
+sys.path.append(os.path.abspath(path))
+path = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
+sys.path.append(os.path.abspath(path))
+
+import testing_flags
+from prediction.batch import priority_dataset
+
+def get_debug_data(flags, train_samples=10, val_samples=5):
+    data = {'x_train': np.arange(train_samples * flags.input_dim).reshape(
+            train_samples, flags.input_dim),
+        'y_train': np.arange(train_samples).reshape(-1, 1),
+        'x_val': np.ones((val_samples, flags.input_dim)),
+        'y_val': np.ones((val_samples, 1))}
+    return data
+
+class TestSumTree(unittest.TestCase):
+
+    def test_update_and_find(self):
+        tree = priority_dataset.SumTree(5)
+        tree.update(np.arange(5), [1., 2., 3., 4., 0.])
+        self.assertEqual(tree.total, 10.)
+        idxs = tree.find([0., .99, 1., 2.5, 3., 6., 9.99])
+        np.testing.assert_array_equal(idxs, [0, 0, 1, 1, 2, 3, 3])
+
+        tree.update([1, 3], [0., 6.])
+        self.assertEqual(tree.total, 10.)
+        np.testing.assert_array_equal(tree.priorities, [1., 0., 3., 6., 0.])
+        np.testing.assert_array_equal(tree.find([.5, 1.5, 4.5]), [0, 2, 3])
+
+def get_rank_flags(repartition_every=0, repartition_tolerance=0.):
+    flags = testing_flags.FLAGS
+    flags.input_dim = 2
+    flags.output_dim = 1
+    flags.batch_size = 4
+    flags.priority_alpha = 1.
+    flags.priority_beta = 1.
+    flags.priority_repartition_every = repartition_every
+    flags.priority_repartition_tolerance = repartition_tolerance
+    return flags
+
+class TestPrioritizedDataset(unittest.TestCase):
+
+    def test_rank_cutpoints(self):
+        cutpoints = priority_dataset.rank_cutpoints(10, 4, 1.)
+        probs = np.arange(1., 11) ** -1.
+        probs /= sum(probs)
+        np.testing.assert_array_equal(cutpoints, 
+            priority_dataset.find_cutpoints(probs, 4))
+        self.assertIs(cutpoints, priority_dataset.rank_cutpoints(10, 4, 1.))
+
+    def test_repartition_every(self):
+        flags = get_rank_flags(repartition_every=2)
+        d = priority_dataset.PrioritizedDataset(get_debug_data(flags), flags)
+        self.assertEqual(d.num_repartitions, 1)
+        cutpoints = d.cutpoints
+
+        for i in range(2):
+            d.sample_batch()
+            d.update_priorities(np.arange(4).reshape(-1, 1) + i)
+        self.assertEqual(d.num_repartitions, 1)
+        self.assertEqual(d.num_updates, 2)
+
+        # the next batch is sampled from a re-sorted heap, reusing cutpoints
+        d.sample_batch()
+        self.assertEqual(d.num_repartitions, 2)
+        self.assertEqual(d.num_updates, 0)
+        keys = list(zip(d.priorities[d.heap], d.orders[d.heap]))
+        self.assertEqual(keys, sorted(keys))
+        self.assertIs(d.cutpoints, cutpoints)
+
+    def test_repartition_tolerance(self):
+        flags = get_rank_flags(repartition_tolerance=.15)
+        d = priority_dataset.PrioritizedDataset(get_debug_data(flags), flags)
+
+        # updates that keep samples in their segment do not repartition
+        d.sample_batch()
+        d.update_priorities(np.ones((4, 1)) * -1000)
+        self.assertEqual(d.num_drifted, 0)
+        d.sample_batch()
+        self.assertEqual(d.num_repartitions, 1)
+
+        # moving two of ten samples out of their segment does
+        d.update_priorities(np.array([[-1000], [5], [5], [-1000]]))
+        self.assertEqual(d.num_drifted, 2)
+        d.sample_batch()
+        self.assertEqual(d.num_repartitions, 2)
+
+    def test_array_storage(self):
+        flags = get_rank_flags()
+        d = priority_dataset.PrioritizedDataset(get_debug_data(flags), flags)
+        self.assertEqual(d.x.dtype, np.float32)
+        self.assertEqual(d.heap.dtype, np.int64)
+        np.testing.assert_array_equal(d.positions[d.heap], np.arange(10))
+
+        # newer samples are at the top of the heap, and storing past the 
+        # preallocated capacity grows the storage
+        d.store((np.array([100, 101]), np.array([50])))
+        self.assertEqual(d.sample_count, 11)
+        self.assertEqual(d.heap[0], 10)
+        np.testing.assert_array_equal(d.x[10], [100, 101])
+        np.testing.assert_array_equal(d.positions[d.heap[:11]], np.arange(11))
+
+    def test_update_priorities_heap(self):
+        np.random.seed(2)
+        flags = get_rank_flags()
+        d = priority_dataset.PrioritizedDataset(
+            get_debug_data(flags, train_samples=50), flags)
+        for _ in range(20):
+            d.sample_batch()
+            d.update_priorities(np.random.randn(4, 1))
+
+            # the heap property holds and positions track the samples
+            n = d.sample_count
+            keys = list(zip(d.priorities[d.heap[:n]], d.orders[d.heap[:n]]))
+            for pos in range(1, n):
+                self.assertLessEqual(keys[(pos - 1) >> 1], keys[pos])
+            np.testing.assert_array_equal(d.positions[d.heap[:n]], 
+                np.arange(n))
+
+    def test_update_losses_samples_high_losses(self):
+        np.random.seed(1)
+        flags = get_rank_flags(repartition_every=1)
+        d = priority_dataset.PrioritizedDataset(
+            get_debug_data(flags, train_samples=100), flags)
+        losses = np.arange(100, dtype=float)
+        counts = np.zeros(100)
+        for _ in range(500):
+            d.sample_batch()
+            np.add.at(counts, d.sample_idxs, 1)
+            d.update_losses(losses[d.sample_idxs])
+        # the samples with the largest losses are drawn the most
+        self.assertGreater(np.sum(counts[-20:]), 5 * np.sum(counts[:20]))
+
+    def test_repartition_times(self):
+        flags = get_rank_flags(repartition_every=1)
+        d = priority_dataset.PrioritizedDataset(get_debug_data(flags), flags)
+        for epoch in range(2):
+            for x, y, w in d.next_batch():
+                np.testing.assert_array_equal(x[:, 0], y[:, 0] * 2)
+                d.update_priorities(np.random.rand(4, 1))
+        self.assertEqual(len(d.repartition_times), 2)
+        self.assertEqual(d.num_repartitions, 6)
+
+class TestProportionalPrioritizedDataset(unittest.TestCase):
+
+    def test_next_batch_and_update_priorities(self):
+        np.random.seed(1)
+        flags = testing_flags.FLAGS
+        flags.input_dim = 2
+        flags.batch_size = 4
+        flags.priority_alpha = 1.
+        flags.priority_beta = 1.
+        data = get_debug_data(flags)
+        d = priority_dataset.ProportionalPrioritizedDataset(data, flags)
+
+        # batches contain matching rows of x and y
+        batches = list(d.next_batch())
+        self.assertEqual(len(batches), 3)
+        x, y, w = batches[-1]
+        np.testing.assert_array_equal(x[:, 0], y[:, 0] * 2)
+        np.testing.assert_array_equal(w, np.ones((4, 1)))
+
+        # after lowering the priority of all but one sample, it dominates
+        d.tree.update(np.arange(10), np.zeros(10))
+        d.sample_idxs[:] = [7, 7, 7, 7]
+        d.update_priorities(np.ones((4, 1)))
+        x, y, w = next(d.next_batch())
+        np.testing.assert_array_equal(y, np.ones((4, 1)) * 7)
+
+        batches = list(d.next_batch(validation=True))
+        self.assertEqual([len(b[0]) for b in batches], [4, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import numpy as np
+import os
+import sklearn.metrics
+import sys
+import unittest
+
+path = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, 'scripts', 'prediction', 'batch')
+sys.path.append(os.path.abspath(path))
+
+import prediction_metrics
+import streaming_metrics
+
+class TestRegressionAccumulator(unittest.TestCase):
+
+    def test_matches_full_arrays(self):
+        np.random.seed(1)
+        y = np.random.rand(100, 2) ** 4
+        y_pred = np.random.rand(100, 2)
+        acc = streaming_metrics.RegressionAccumulator()
+        for s in range(0, 100, 30):
+            acc.update(y[s:s + 30], y_pred[s:s + 30])
+        metrics = acc.result()
+
+        ll = np.sum(y * np.log(y_pred) + (1 - y) * np.log(1 - y_pred))
+        self.assertAlmostEqual(metrics['ce'], -ll / 100)
+        self.assertAlmostEqual(metrics['mse'], np.sum((y - y_pred) ** 2) / 100)
+        r2 = 1 - np.sum((y - y_pred) ** 2) / np.sum((y - y.mean(axis=0)) ** 2)
+        self.assertAlmostEqual(metrics['r2'], r2)
+        y_null = y.mean(axis=0)
+        null_ll = np.sum(y * np.log(y_null) + (1 - y) * np.log(1 - y_null))
+        self.assertAlmostEqual(metrics['mcfadden_r2'], 1 - ll / null_ll)
+        tjur_r2 = np.mean(y_pred[y >= .5]) - np.mean(y_pred[y < .5])
+        self.assertAlmostEqual(metrics['tjur_r2'], tjur_r2)
+        self.assertAlmostEqual(metrics['acc'], 
+            np.mean((y > .5) == (y_pred >= .5)))
+
+    def test_matches_regression_score(self):
+        np.random.seed(2)
+        y = np.random.rand(100, 3) ** 4
+        y_pred = np.random.rand(100, 3)
+        acc = streaming_metrics.RegressionAccumulator()
+        for s in range(0, 100, 40):
+            acc.update(y[s:s + 40], y_pred[s:s + 40])
+        metrics = acc.result()
+
+        ll, null_ll, mcfadden_r2, tjur_r2 = prediction_metrics.pseudo_r2(
+            y, y_pred, np.mean(y, axis=0))
+        self.assertAlmostEqual(metrics['ll'], ll)
+        self.assertAlmostEqual(metrics['null_ll'], null_ll)
+        self.assertAlmostEqual(metrics['mcfadden_r2'], mcfadden_r2)
+        self.assertAlmostEqual(metrics['tjur_r2'], tjur_r2)
+
+class TestCurveAccumulator(unittest.TestCase):
+
+    def test_matches_sklearn(self):
+        np.random.seed(1)
+        y = np.random.rand(1000, 2) > .7
+        # probabilities on a grid coarser than the bins, so there is no 
+        # approximation due to binning
+        probs = np.clip(np.random.rand(1000, 2) * .5 + y * .3, 0, .999)
+        probs = np.round(probs * 20) / 20. + .001
+        acc = streaming_metrics.CurveAccumulator(2, num_bins=100)
+        for s in range(0, 1000, 128):
+            acc.update(y[s:s + 128], probs[s:s + 128])
+
+        for tidx in range(2):
+            _, _, auc = acc.roc_curve(tidx)
+            self.assertAlmostEqual(auc, 
+                sklearn.metrics.roc_auc_score(y[:, tidx], probs[:, tidx]))
+            _, _, avg_precision = acc.precision_recall_curve(tidx)
+            self.assertAlmostEqual(avg_precision, 
+                sklearn.metrics.average_precision_score(
+                    y[:, tidx], probs[:, tidx]))
+
+if __name__ == '__main__':
+    unittest.main()
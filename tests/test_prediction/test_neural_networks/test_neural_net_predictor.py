@@ -4,7 +4,9 @@ matplotlib.use("TkAgg")
 import matplotlib.pyplot as plt
 import numpy as np
 import os
+import shutil
 import sys
+import tempfile
 import tensorflow as tf
 import unittest
 
@@ -16,7 +18,10 @@ path = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
 sys.path.append(os.path.abspath(path))
 
 from prediction.batch import dataset
+from prediction.batch import priority_dataset
+from prediction.neural_networks import frozen_predictor
 from prediction.neural_networks import neural_network_predictor as nnp
+from prediction.neural_networks import utils
 import testing_flags
 import testing_utils
 
@@ -173,7 +178,109 @@ class TestFeedForwardNeuralNetwork(unittest.TestCase):
             expected[:flags.batch_size // 2] *= testing_utils.sigmoid(43)
             expected[flags.batch_size // 2:] *= testing_utils.sigmoid(7)
             np.testing.assert_array_almost_equal(expected, actual, 4)
-            
+
+    def test_predict_batched(self):
+        flags = testing_flags.FLAGS
+        flags.input_dim = 3
+        flags.hidden_dim = 6
+        flags.num_hidden_layers = 2
+        flags.output_dim = 2
+        flags.batch_size = 6
+        flags.save_weights_every = 100000
+
+        x = np.random.randn(50, flags.input_dim)
+        with tf.Session() as session:
+            network = nnp.NeuralNetworkPredictor(session, flags)
+            expected = network.predict(x, batch_size=len(x))
+            self.assertEqual(expected.dtype, np.float32)
+
+            # smaller batches, run concurrently, give the same outputs
+            actual = network.predict(x, batch_size=7, num_threads=3)
+            np.testing.assert_array_equal(expected, actual)
+            labels, actual = network.predict(x, predict_labels=True,
+                batch_size=7)
+            np.testing.assert_array_equal(expected, actual)
+            self.assertEqual(labels.shape, expected.shape)
+
+    def test_export_inference_graph(self):
+        flags = testing_flags.FLAGS
+        flags.input_dim = 3
+        flags.timesteps = 1
+        flags.hidden_dim = 6
+        flags.hidden_layer_dims = []
+        flags.num_hidden_layers = 2
+        flags.output_dim = 2
+        flags.task_type = 'regression'
+        flags.loss_type = 'ce'
+
+        np.random.seed(1)
+        x = np.random.randn(20, flags.input_dim)
+        means = np.array([1., -2., 0.])
+        stds = np.array([2., 1., .5])
+        tmpdir = tempfile.mkdtemp()
+        filepath = os.path.join(tmpdir, 'frozen.pb')
+        try:
+            with tf.Session() as session:
+                network = nnp.NeuralNetworkPredictor(session, flags)
+                expected = network.predict((x - means) / stds)
+                utils.export_inference_graph(filepath, session, flags, 
+                    {'means': means, 'stds': stds})
+
+            # the frozen graph takes unnormalized inputs
+            predictor = frozen_predictor.FrozenPredictor(filepath, 
+                batch_size=7)
+            actual = predictor.predict(x)
+            predictor.close()
+            np.testing.assert_array_almost_equal(expected, actual, 5)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_async_checkpoints(self):
+        flags = testing_flags.FLAGS
+        flags.input_dim = 3
+        flags.hidden_dim = 6
+        flags.num_hidden_layers = 2
+        flags.output_dim = 2
+        flags.batch_size = 4
+        flags.num_epochs = 5
+        flags.save_weights_every = 1
+        flags.save_weights_min_interval = 0.
+        flags.max_checkpoints_to_keep = 2
+        flags.async_checkpoints = True
+        flags.use_likelihood_weights = False
+        flags.load_network = False
+
+        np.random.seed(1)
+        x = np.random.randn(8, flags.input_dim)
+        y = np.random.rand(8, flags.output_dim)
+        data = {'x_train': x, 'y_train': y, 'x_val': x, 'y_val': y}
+        tmpdir = tempfile.mkdtemp()
+        flags.snapshot_dir = tmpdir
+        try:
+            with tf.Graph().as_default():
+                with tf.Session() as session:
+                    network = nnp.NeuralNetworkPredictor(session, flags)
+                    network.fit(dataset.Dataset(data, flags))
+                    expected = network.predict(x)
+                    network.checkpoints.close()
+
+            # old checkpoints are pruned
+            state = tf.train.get_checkpoint_state(tmpdir)
+            self.assertEqual(len(state.all_model_checkpoint_paths), 2)
+            self.assertTrue(state.model_checkpoint_path.endswith('-4'))
+
+            # the latest checkpoint restores the trained network
+            with tf.Graph().as_default():
+                with tf.Session() as session:
+                    network = nnp.NeuralNetworkPredictor(session, flags)
+                    network.load()
+                    actual = network.predict(x)
+            np.testing.assert_array_almost_equal(expected, actual)
+        finally:
+            flags.max_checkpoints_to_keep = 100
+            flags.async_checkpoints = False
+            shutil.rmtree(tmpdir)
+
     def test_fit_basic(self):
         """
         Description:
@@ -212,6 +319,64 @@ class TestFeedForwardNeuralNetwork(unittest.TestCase):
             actual = network.predict(x)
             np.testing.assert_array_almost_equal(y, actual, 8)
 
+    def test_fit_prioritized(self):
+        flags = testing_flags.FLAGS
+        flags.input_dim = 3
+        flags.hidden_dim = 6
+        flags.num_hidden_layers = 2
+        flags.output_dim = 2
+        flags.batch_size = 4
+        flags.num_epochs = 2
+        flags.save_weights_every = 100000
+        flags.use_likelihood_weights = False
+        flags.use_priority = True
+
+        np.random.seed(1)
+        x = np.random.randn(16, flags.input_dim)
+        y = np.random.rand(16, flags.output_dim)
+        data = {'x_train': x, 'y_train': y, 'x_val': x, 'y_val': y}
+        try:
+            d = priority_dataset.ProportionalPrioritizedDataset(data, flags)
+            with tf.Session() as session:
+                network = nnp.NeuralNetworkPredictor(session, flags)
+                network.fit(d)
+            # samples start with priority one, and are updated to 
+            # (loss + eps) ** alpha after being sampled
+            sampled = d.tree.priorities != 1.
+            self.assertTrue(np.any(sampled))
+        finally:
+            flags.use_priority = False
+
+    def test_fit_profile(self):
+        flags = testing_flags.FLAGS
+        flags.input_dim = 3
+        flags.hidden_dim = 6
+        flags.num_hidden_layers = 2
+        flags.output_dim = 2
+        flags.batch_size = 4
+        flags.num_epochs = 2
+        flags.save_weights_every = 100000
+        flags.use_likelihood_weights = False
+        flags.trace_every = 2
+        flags.snapshot_dir = os.path.abspath(os.path.join(
+            os.path.dirname(__file__), os.pardir, os.pardir, 'data','snapshots','test'))
+
+        x = np.random.randn(10, flags.input_dim)
+        y = np.ones((10, flags.output_dim))
+        data = {'x_train': x, 'y_train': y, 'x_val': x, 'y_val': y}
+        d = dataset.Dataset(data, flags)
+        with tf.Session() as session:
+            network = nnp.NeuralNetworkPredictor(session, flags)
+            network.fit(d)
+        flags.trace_every = 0
+
+        # three training batches per epoch
+        self.assertEqual(network.step, 6)
+        for k in ['fetch_sec', 'feed_sec', 'run_sec', 'summary_sec', 
+                'samples_per_sec', 'peak_rss_mb']:
+            self.assertEqual(len(network.info[k]), 2)
+        self.assertTrue(network.info['samples_per_sec'][-1] > 0)
+
     def test_fit_complex(self):
         tf.set_random_seed(1)
         np.random.seed(1)
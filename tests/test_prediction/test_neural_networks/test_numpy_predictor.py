@@ -0,0 +1,81 @@
+import h5py
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+path = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, os.pardir, 'scripts')
+sys.path.append(os.path.abspath(path))
+
+from prediction.neural_networks import numpy_predictor
+
+def write_weight_file(filepath, layer_dims, means=None, stds=None):
+    # same layout as utils.save_trainable_variables
+    layers = []
+    with h5py.File(filepath, 'w') as outfile:
+        group = outfile.create_group('weights')
+        for (lidx, (i, o)) in enumerate(zip(layer_dims, layer_dims[1:])):
+            scope = 'fully_connected'
+            if lidx > 0:
+                scope += '_{}'.format(lidx)
+            w = np.random.randn(i, o).astype(np.float32)
+            b = np.random.randn(o).astype(np.float32)
+            group['{}/weights:0'.format(scope)] = w
+            group['{}/biases:0'.format(scope)] = b
+            layers.append((w, b))
+        if means is not None:
+            stats = outfile.create_group('stats')
+            stats['means'] = means
+            stats['stds'] = stds
+    return layers
+
+def forward(layers, x):
+    for (lidx, (w, b)) in enumerate(layers):
+        x = np.dot(x, w) + b
+        if lidx < len(layers) - 1:
+            x = np.maximum(x, 0)
+    return x
+
+class TestNumpyPredictor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, 'test.weights')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_predict_regression(self):
+        np.random.seed(1)
+        # more than ten layers to check the order of the layers
+        layer_dims = [3] + [4] * 11 + [2]
+        means = np.array([1., -2., 0.])
+        stds = np.array([2., 1., .5])
+        layers = write_weight_file(self.filepath, layer_dims, means, stds)
+        x = np.random.randn(50, 3)
+        expected = 1. / (1. + np.exp(-forward(layers, (x - means) / stds)))
+
+        predictor = numpy_predictor.NumpyPredictor(self.filepath, 
+            batch_size=16)
+        actual = predictor.predict(x)
+        self.assertEqual(actual.dtype, np.float32)
+        np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-6)
+
+    def test_predict_classification(self):
+        np.random.seed(1)
+        layers = write_weight_file(self.filepath, [3, 5, 6])
+        x = np.random.randn(10, 3)
+        scores = forward(layers, x).reshape(-1, 2, 3)
+        expected = np.exp(scores) / np.sum(
+            np.exp(scores), axis=-1, keepdims=True)
+
+        predictor = numpy_predictor.NumpyPredictor(self.filepath, 
+            task_type='classification', num_target_bins=3, batch_size=4)
+        actual = predictor.predict(x)
+        self.assertEqual(actual.shape, (10, 2, 3))
+        np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-6)
+
+if __name__ == '__main__':
+    unittest.main()